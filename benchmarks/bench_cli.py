@@ -0,0 +1,126 @@
+import os
+
+from unittest import mock
+
+from fbcli import cache, cli, synth, ui
+from fbcli.cassette import FIXTURE_DIR
+
+from benchmarks.runner import benchmark
+
+
+DATASETS = {}
+
+
+def _dataset(args):
+    '''Synthetic dataset at the requested scale, served as FB.'''
+    key = (args.cases, args.events, args.comment_size, args.people)
+    if key not in DATASETS:
+        DATASETS[key] = synth.Dataset(
+            cases=args.cases, events=args.events,
+            comment_size=args.comment_size, people=args.people,
+            attachments=args.events // 10)
+    dataset = DATASETS[key]
+    cli.FB = synth.SynthFB(dataset)
+    # People are looked up through the metadata cache: serve them from
+    # this dataset, not from another one cached before
+    cli.META = cache.MetaCache(cli.FB)
+    cli.META.clear()
+    cli.FBPerson.CACHE.clear()
+    return dataset
+
+
+def _fixture(fname):
+    with open(os.path.join(FIXTURE_DIR, fname), 'r') as fid:
+        return fid.read()
+
+
+def _big_case_xml(args):
+    return _dataset(args).search_xml(1, ','.join(cli.FBCase.COLS))
+
+
+def _parse_case(xml):
+    return cli.FBCase(
+        cli.FBCase._soup_xml(xml).response.cases.case, current=False)
+
+
+@benchmark
+def case_parse_fixture(_args):
+    xml = _fixture('FB41675.xml')
+    return lambda: _parse_case(xml).events
+
+
+@benchmark
+def case_parse_synth(args):
+    xml = _big_case_xml(args)
+    return lambda: _parse_case(xml).events
+
+
+@benchmark
+def case_to_string(args):
+    soup = cli.FBCase._soup_xml(_big_case_xml(args)).response.cases.case
+    return lambda: cli.FBCase(soup, current=False).to_string()
+
+
+@benchmark
+def event_comment_fixture(_args):
+    soup = cli.FBCase._soup_xml(_fixture('FB41675.xml')).response.cases.case
+
+    def f():
+        return [e.comment for e in cli.FBCase(soup, current=False).events]
+
+    return f
+
+
+@benchmark
+def event_comment_synth(args):
+    soup = cli.FBCase._soup_xml(_big_case_xml(args)).response.cases.case
+
+    def f():
+        return [e.comment for e in cli.FBCase(soup, current=False).events]
+
+    return f
+
+
+@benchmark
+def search_parse_sort(args):
+    resp = _dataset(args).respond(
+        'search', {'q': 'status:active', 'cols': cli.FBCaseSearch.COLS})
+    soup = cli.FBCaseSearch._soup_xml(resp).response
+    return lambda: cli.FBCaseSearch._parse_cases(soup)
+
+
+def _fill_completion_caches(args):
+    dataset = _dataset(args)
+    cli.FBPerson.CACHE.clear()
+    cli.FBPerson.from_result(cli.FB.listPeople())
+    resp = cli.FB.search(
+        q=','.join(map(str, range(1, args.history + 1))),
+        cols=cli.FBCaseSearch.COLS)
+    for case in resp.cases.findAll('case'):
+        cli.FBShortCase.HISTORY.push(cli.FBShortCase.from_xml(case))
+    return dataset
+
+
+def _complete(line, text):
+    '''All completions, the way readline asks for them.'''
+    with mock.patch.object(ui.readline, 'get_line_buffer') as buf:
+        buf.return_value = line
+        options, state = [], 0
+        while True:
+            option = ui.completer(text, state)
+            if option is None:
+                return options
+            options.append(option)
+            state += 1
+
+
+@benchmark
+def completer_people(args):
+    _fill_completion_caches(args)
+    return lambda: _complete('assign Ada', 'Ada')
+
+
+@benchmark
+def completer_cases(args):
+    _fill_completion_caches(args)
+    return lambda: _complete('4', '4')
@@ -0,0 +1,28 @@
+from fbcli import editor
+
+from benchmarks.runner import benchmark
+
+
+HEADER = '''Title: Backfill the brand index for last quarter
+Assign to: Albert Einstein
+Project: BrandIndex
+Area: Data
+Priority: 3
+Tags:
+  - backfill
+  - data
+Files: []
+'''
+
+
+@benchmark
+def editor_text(args):
+    body = '\n'.join(
+        'Line {} of a long comment, with some **bold** text.'.format(i)
+        for i in range(args.events))
+    text = '\n'.join([HEADER, editor.Text.SEP, body, editor.FOOTER])
+
+    def f():
+        return editor.Text(text).get_params_for_comment()
+
+    return f
@@ -0,0 +1,174 @@
+'''Time the hot paths of fbcli and compare with a baseline.
+
+Usage:
+    python -m benchmarks -o results.json
+    python -m benchmarks --compare baseline.json --threshold 0.1
+
+Benchmarks run against tests/fixtures and `fbcli.synth` data, with a
+fake FogBugz: no server is needed. With --compare, exits with status 1
+if the median time of any benchmark regressed by more than the
+threshold.
+'''
+
+from __future__ import print_function
+
+from collections import OrderedDict
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+
+# Registered benchmarks: name -> setup function
+BENCHMARKS = OrderedDict()
+
+# Target duration of a single timing, in seconds
+MIN_TIME = 0.05
+
+
+def benchmark(setup):
+    '''Register a benchmark.
+
+    `setup(args)` prepares data at the scale given by the command line
+    `args` and returns the function to time.
+    '''
+    BENCHMARKS[setup.__name__] = setup
+    return setup
+
+
+def _setup_env():
+    # fbcli.cli connects to FogBugz at import: point it elsewhere and
+    # keep caches out of the user's home
+    os.environ.update({
+        'FBURL': 'http://synth/',
+        'FBUSER': 'synth@example.com',
+        'FBTOKEN': 'synth-token',
+        'EDITOR': '',
+        'XDG_CACHE_HOME': tempfile.mkdtemp(prefix='fbcli-bench-'),
+    })
+
+
+def _median(xs):
+    xs = sorted(xs)
+    mid = len(xs) // 2
+    return xs[mid] if len(xs) % 2 else (xs[mid - 1] + xs[mid]) / 2.0
+
+
+def measure(f, repeat):
+    '''Time `f`, returning per-call statistics in seconds.'''
+    start = time.time()
+    f()
+    first = time.time() - start
+    number = max(1, int(MIN_TIME / max(first, 1e-9)))
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(number):
+            f()
+        times.append((time.time() - start) / number)
+    return OrderedDict([
+        ('min', min(times)),
+        ('median', _median(times)),
+        ('mean', sum(times) / len(times)),
+        ('first', first),
+        ('number', number),
+        ('repeat', repeat),
+    ])
+
+
+def run(args):
+    results = OrderedDict()
+    for name, setup in BENCHMARKS.items():
+        if args.filter and args.filter not in name:
+            continue
+        f = setup(args)
+        results[name] = measure(f, args.repeat)
+        print('{:<32} {:>10.3f} ms'.format(
+            name, results[name]['median'] * 1000))
+        sys.stdout.flush()
+    return OrderedDict([
+        ('meta', OrderedDict([
+            ('date', datetime.datetime.utcnow().strftime(
+                '%Y-%m-%dT%H:%M:%SZ')),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('scale', OrderedDict([
+                ('cases', args.cases),
+                ('events', args.events),
+                ('comment_size', args.comment_size),
+                ('people', args.people),
+                ('history', args.history),
+            ])),
+        ])),
+        ('results', results),
+    ])
+
+
+def compare(baseline, current, threshold):
+    '''Print a comparison table and return names of regressions.'''
+    regressions = []
+    print()
+    print('{:<32} {:>12} {:>12} {:>8}'.format(
+        'benchmark', 'baseline ms', 'current ms', 'change'))
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print('{:<32} {:>12} {:>12.3f} {:>8}'.format(
+                name, '-', result['median'] * 1000, 'new'))
+            continue
+        change = result['median'] / base['median'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{:<32} {:>12.3f} {:>12.3f} {:>+7.1f}%{}'.format(
+            name, base['median'] * 1000, result['median'] * 1000,
+            change * 100, flag))
+    if baseline['meta'].get('scale') != current['meta'].get('scale'):
+        print('WARNING: baseline was run at a different scale')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', help='Write results to this file')
+    parser.add_argument('--compare', help='Baseline results to compare to')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='Max slowdown allowed, as a fraction (default: 0.1)')
+    parser.add_argument('--filter', help='Only run benchmarks matching')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        '--cases', type=int, default=5000, help='Cases in a search')
+    parser.add_argument(
+        '--events', type=int, default=1000, help='Events in a case')
+    parser.add_argument('--comment-size', type=int, default=500)
+    parser.add_argument(
+        '--people', type=int, default=5000, help='People to complete')
+    parser.add_argument(
+        '--history', type=int, default=500, help='Cases in history')
+    args = parser.parse_args(argv)
+
+    _setup_env()
+    # Register benchmarks, now that fbcli.cli can be imported
+    # pylint: disable=unused-import
+    from benchmarks import bench_cli, bench_editor  # noqa: F401
+
+    current = run(args)
+    if args.output:
+        with open(args.output, 'w') as fid:
+            json.dump(current, fid, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as fid:
+            baseline = json.load(fid)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print('{} regression(s): {}'.format(
+                len(regressions), ', '.join(regressions)))
+            return 1
+    return 0
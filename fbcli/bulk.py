@@ -0,0 +1,69 @@
+'''Run an action on many cases at once.
+
+Each case is handled by a worker of a thread pool, on its own: a case
+failing does not stop the others, its error is part of the results.
+Calls can be spread out in time, to be gentle with the server.
+'''
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import threading
+import time
+
+
+# Default number of cases handled at once
+JOBS = int(os.environ.get('FBAPPLYJOBS', 4))
+
+# item: what the action was called with
+# error: the exception raised, or None
+# elapsed: seconds taken
+Result = namedtuple('Result', ['item', 'error', 'elapsed'])
+
+
+class RateLimiter(object):
+    '''Let at most `rate` calls a second through, across threads.'''
+
+    def __init__(self, rate=None, clock=time.time, sleep=time.sleep):
+        self._interval = 1.0 / rate if rate else 0
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = self._clock()
+            at = max(now, self._next)
+            self._next = at + self._interval
+        if at > now:
+            self._sleep(at - now)
+
+
+def run(items, action, jobs=None, rate=None):
+    '''Call `action(item)` for all `items`, `jobs` at a time.
+
+    Yields a Result per item, as they complete.
+    '''
+    limiter = RateLimiter(rate)
+
+    def call(item):
+        limiter.wait()
+        start = time.time()
+        try:
+            action(item)
+        except Exception as exc:  # pylint: disable=broad-except
+            return Result(item, exc, time.time() - start)
+        return Result(item, None, time.time() - start)
+
+    with ThreadPoolExecutor(jobs or JOBS) as pool:
+        futures = [pool.submit(call, item) for item in items]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # E.g. interrupted: do not start the others
+            for future in futures:
+                future.cancel()
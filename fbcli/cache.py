@@ -0,0 +1,182 @@
+'''Persistent on-disk cache of FogBugz metadata.
+
+Responses to the list* API methods (people, statuses, projects, ...)
+are stored as XML under ~/.cache/fbcli/<host>/<user>/. Stale entries are
+served immediately and refreshed in the background.
+'''
+
+import logging
+import os
+import threading
+import time
+
+from bs4 import BeautifulSoup
+from six.moves.urllib_parse import urlparse
+
+from fbcli.stats import STATS
+
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'fbcli')
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Time to live of cached responses, in seconds, by API method
+TTL = {
+    'listPeople': DAY,
+    'listStatuses': 7 * DAY,
+    'listProjects': DAY,
+    'listAreas': DAY,
+    'listFixFors': HOUR,
+}
+DEFAULT_TTL = HOUR
+
+
+def host_dir(client, root=None):
+    '''Directory where to keep data for the FogBugz host and user of `client`.
+
+    Users of the same host may see different cases, people and projects.
+    '''
+    host = urlparse(client.full_url('/')).netloc.replace(':', '_')
+    user = (client.current_user or '_').replace(os.sep, '_')
+    return os.path.join(root or CACHE_DIR, host, user)
+
+
+class MetaCache(object):
+
+    logger = logging.getLogger('fb.cache')
+
+    def __init__(self, client, fetch_many=None, ttl=None, root=None):
+        self._client = client
+        self._fetch_many = fetch_many
+        self._ttl = dict(TTL, **(ttl or {}))
+        self._root = root
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    @property
+    def path(self):
+        return host_dir(self._client, self._root)
+
+    def _fname(self, cmd):
+        return os.path.join(self.path, cmd + '.xml')
+
+    def age(self, cmd):
+        '''Age of cached response, in seconds, or None if not cached.'''
+        try:
+            return time.time() - os.path.getmtime(self._fname(cmd))
+        except OSError:
+            return None
+
+    def is_stale(self, cmd):
+        age = self.age(cmd)
+        return age is None or age > self._ttl.get(cmd, DEFAULT_TTL)
+
+    def get(self, cmd):
+        '''Get response to `cmd`, from disk if possible.'''
+        return self.get_many([cmd])[0]
+
+    def get_many(self, cmds):
+        '''Get responses to `cmds`, fetching the missing ones together.'''
+        responses = {}
+        for cmd in cmds:
+            xml = self._load(cmd)
+            if xml is None:
+                continue
+            self.logger.debug('Cache hit: %s', cmd)
+            call = STATS.start(cmd)
+            call.cache, call.nbytes = 'hit', len(xml)
+            responses[cmd] = self._parse(xml)
+            STATS.finish(call)
+            if self.is_stale(cmd):
+                self._refresh_in_background(cmd)
+
+        missing = [cmd for cmd in cmds if cmd not in responses]
+        if missing:
+            self.logger.debug('Cache miss: %s', missing)
+            responses.update(zip(missing, self._fetch(missing)))
+        return [responses[cmd] for cmd in cmds]
+
+    def refresh(self, cmd):
+        '''Fetch `cmd` from FogBugz and store the response.'''
+        return self._fetch([cmd])[0]
+
+    def clear(self, cmd=None):
+        '''Remove `cmd`, or all, cached responses.'''
+        if not os.path.isdir(self.path):
+            return
+        for fname in os.listdir(self.path):
+            if fname == (cmd or os.path.splitext(fname)[0]) + '.xml':
+                os.remove(os.path.join(self.path, fname))
+
+    def entries(self):
+        '''List (cmd, age, size) of cached responses.'''
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        now = time.time()
+        for fname in sorted(os.listdir(self.path)):
+            cmd, ext = os.path.splitext(fname)
+            if ext != '.xml':
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, fname))
+            except OSError:
+                # Cleared meanwhile, e.g. by another process
+                continue
+            entries.append((cmd, now - st.st_mtime, st.st_size))
+        return entries
+
+    def _fetch(self, cmds):
+        with STATS.timed('+'.join(cmds)) as call:
+            call.cache = 'miss'
+            if self._fetch_many is not None and len(cmds) > 1:
+                responses = self._fetch_many([(cmd, {}) for cmd in cmds])
+            else:
+                responses = [getattr(self._client, cmd)() for cmd in cmds]
+        for cmd, response in zip(cmds, responses):
+            self._store(cmd, str(response))
+        return responses
+
+    def _refresh_in_background(self, cmd):
+        with self._lock:
+            if cmd in self._refreshing:
+                return
+            self._refreshing.add(cmd)
+
+        def target():
+            try:
+                self.refresh(cmd)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception('Failed to refresh %s', cmd)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(cmd)
+
+        self.logger.debug('Refreshing %s', cmd)
+        thread = threading.Thread(target=target, name='refresh-' + cmd)
+        thread.daemon = True
+        thread.start()
+
+    def _load(self, cmd):
+        try:
+            with open(self._fname(cmd), 'r') as fid:
+                return fid.read()
+        except IOError:
+            return None
+
+    def _store(self, cmd, xml):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        # Write atomically, as readers may be in other threads/processes
+        tmp = '{}.{}.tmp'.format(
+            self._fname(cmd), threading.current_thread().ident)
+        with open(tmp, 'w') as fid:
+            fid.write(xml)
+        os.rename(tmp, self._fname(cmd))
+
+    @staticmethod
+    def _parse(xml):
+        return BeautifulSoup(xml, 'xml').response
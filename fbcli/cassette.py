@@ -0,0 +1,199 @@
+'''Recorded FogBugz traffic, to be replayed by `fbcli.standin`.
+
+A cassette maps requests, normalized to a key that does not depend on
+the token, to responses. Set $FBRECORD to a file name to record all
+the traffic of a `FBClient` session into a cassette. Credentials and
+tokens are never recorded.
+'''
+
+import base64
+import json
+import logging
+import os
+import threading
+
+from six.moves.urllib_parse import urlencode, urlparse, parse_qsl
+from tornado.httputil import parse_body_arguments
+
+from fbcli import upload
+
+FIXTURE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tests', 'fixtures')
+
+TOKEN = 'standin-token'
+
+# Parameters that must not be recorded
+SECRET_PARAMS = ('token', 'email', 'password')
+
+# Parameters that do not identify a request
+IGNORED_PARAMS = SECRET_PARAMS + ('cmd',)
+
+# Commands whose traffic is all secrets: the stand-in answers them itself
+NOT_RECORDED = ('logon', 'logoff')
+
+
+def _decode(v):
+    return v.decode('utf-8') if isinstance(v, bytes) else v
+
+
+def entry_body(entry):
+    '''Body of a cassette entry, as bytes.'''
+    if entry.get('encoding') == 'base64':
+        return base64.b64decode(entry['body'])
+    return entry['body'].encode('utf-8')
+
+
+def api_key(cmd, params):
+    '''Key of an XML API call.'''
+    query = urlencode(sorted(
+        (k, _decode(v)) for k, v in params.items()
+        if k not in IGNORED_PARAMS))
+    return 'api.asp?cmd={}&{}'.format(cmd, query)
+
+
+def http_key(method, path, query, body=None):
+    '''Key of a JSON API call.'''
+    query = urlencode(sorted(
+        (k, _decode(v)) for k, v in query.items()
+        if k not in IGNORED_PARAMS))
+    key = '{} {}?{}'.format(method, path, query)
+    if body:
+        try:
+            data = json.loads(_decode(body))
+        except ValueError:
+            return key
+        if isinstance(data, dict):
+            data = {
+                k: v for k, v in data.items() if k not in SECRET_PARAMS}
+        key += ' ' + json.dumps(data, sort_keys=True)
+    return key
+
+
+def parse_api_request(content_type, body, query):
+    '''Extract (cmd, params) from an XML API request.'''
+    if isinstance(body, upload.MultipartBody):
+        # Sent already, and streamed: only the fields identify it
+        params = dict(query, **body.fields)
+        return params.pop('cmd', None), params
+    arguments = {}
+    if body:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        parse_body_arguments(content_type, body, arguments, {})
+    params = dict(query)
+    params.update((k, _decode(v[0])) for k, v in arguments.items())
+    return params.pop('cmd', None), params
+
+
+class Cassette(object):
+
+    logger = logging.getLogger('fb.cassette')
+
+    def __init__(self, entries=None):
+        self._lock = threading.Lock()
+        self.entries = {}
+        # First response by API command, to answer unknown requests
+        self._by_cmd = {}
+        for entry in entries or []:
+            self.add(**entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key, body, status=200, content_type='text/xml', cmd=None,
+            encoding=None):
+        if isinstance(body, bytes):
+            try:
+                body = body.decode('utf-8')
+            except UnicodeDecodeError:
+                # Attachments
+                body, encoding = base64.b64encode(body).decode(), 'base64'
+        entry = {
+            'key': key,
+            'status': status,
+            'content_type': content_type,
+            'body': body,
+            'cmd': cmd,
+            'encoding': encoding,
+        }
+        with self._lock:
+            self.entries[key] = entry
+            if cmd is not None:
+                self._by_cmd.setdefault(cmd, entry)
+
+    def lookup(self, key, cmd=None):
+        entry = self.entries.get(key)
+        if entry is None and cmd is not None:
+            entry = self._by_cmd.get(cmd)
+        return entry
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname, 'r') as fid:
+            return cls(json.load(fid)['entries'])
+
+    def save(self, fname):
+        with self._lock:
+            data = {'version': 1, 'entries': list(self.entries.values())}
+        tmp = fname + '.tmp'
+        with open(tmp, 'w') as fid:
+            json.dump(data, fid, indent=1, sort_keys=True)
+        os.rename(tmp, fname)
+
+    @classmethod
+    def from_fixtures(cls, fixture_dir=FIXTURE_DIR):
+        '''Cassette answering from the XML in tests/fixtures.'''
+
+        def read(fname):
+            with open(os.path.join(fixture_dir, fname), 'r') as fid:
+                return fid.read().strip()
+
+        person, fixfor = read('person.xml'), read('milestone.xml')
+        case = read('FB41675.xml')
+        cassette = cls()
+        for cmd, body in [
+                ('search', case),
+                ('viewPerson', '<response>{}</response>'.format(person)),
+                ('listPeople',
+                 '<response><people>{}</people></response>'.format(person)),
+                ('listFixFors',
+                 '<response><fixfors>{}</fixfors></response>'.format(fixfor)),
+                ('listStatuses', '<response><statuses/></response>'),
+                ('listProjects', '<response><projects/></response>'),
+                ('listAreas', '<response><areas/></response>'),
+        ]:
+            cassette.add(api_key(cmd, {}), body, cmd=cmd)
+        cassette.add(
+            api_key('search', {'q': '41675'}), case, cmd='search')
+        return cassette
+
+
+class Recorder(object):
+    '''`requests` response hook, adding responses to a cassette.'''
+
+    def __init__(self, cassette, fname=None):
+        self.cassette = cassette
+        self.fname = fname
+
+    def __call__(self, r, *_args, **kwargs):
+        if kwargs.get('stream'):
+            # Do not consume streamed responses, e.g. downloads
+            return
+        req = r.request
+        url = urlparse(req.url)
+        query = dict(parse_qsl(url.query))
+        content_type = r.headers.get('Content-Type', 'text/xml')
+        if url.path.endswith('api.asp'):
+            cmd, params = parse_api_request(
+                req.headers.get('Content-Type', ''), req.body, query)
+            if cmd in NOT_RECORDED:
+                return
+            key = api_key(cmd, params)
+        else:
+            cmd, key = None, http_key(req.method, url.path, query, req.body)
+        self.cassette.add(key, r.content, r.status_code, content_type, cmd)
+
+    def save(self):
+        if self.fname:
+            self.cassette.save(self.fname)
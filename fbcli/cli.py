@@ -11,43 +11,65 @@ import datetime
 import logging
 import os
 import re
+import shlex
 import sys
-import tempfile
 
-import html2text
 import six
-from six.moves import input, urllib, configparser
+from six.moves import builtins, input, urllib, configparser
 from six.moves.urllib_parse import urlencode
 from lazy_property import LazyProperty as property
+import fogbugz
 
 from tornado.template import Template
-from tornado.options import parse_command_line
+from tornado.options import define, options, parse_command_line
 import yaml
 
+from fbcli import bulk
+from fbcli import cache
+from fbcli import downloads
 from fbcli import errors
 from fbcli import fb
 from fbcli import editor
+from fbcli import index
+from fbcli import markup
+from fbcli import records
+from fbcli import startup
+from fbcli import store
 from fbcli import ui
+from fbcli.stats import STATS, BUCKETS
 
 FB = fb.FBClient()
+FB_ASYNC = fb.AsyncFBClient(FB)
+META = cache.MetaCache(FB, fetch_many=FB_ASYNC.run_all)
+STORE = store.Store(os.path.join(cache.host_dir(FB), 'cases.sqlite'))
+INDEX = index.Index(os.path.join(cache.host_dir(FB), 'index.pickle'))
+DOWNLOADS = downloads.DownloadCache(FB)
+STARTUP = startup.Startup()
 CURRENT_CASE = None
 CURRENT_USER = None
 LAST_SEARCH = None
 
 COMMANDS = {}
 ALIASES = {}
+BULK = {}
 
 ASSUMED_ANSWER = None
 
+define('trace', default=None, type=str,
+       help='Append a JSON line per FogBugz API call to this file')
+define('backend', default='xml', type=str,
+       help='API to search and fetch cases with: xml or json')
+define('color', default='auto', type=str,
+       help='Colour output: always, never or auto (only on terminals)')
+define('gzip_uploads', default=False, type=bool,
+       help='Gzip text files (logs, CSVs, ...) before uploading them')
+define('jobs', default=bulk.JOBS, type=int,
+       help='Cases `apply` works on at once')
+define('rate', default=0, type=float,
+       help='Max cases per second `apply` works on, 0 for no limit')
+define('startup_timings', default=False, type=bool,
+       help='Wait for startup, and show how long each step took')
 
-# Poor man HTML link regex
-# URL_RE = re.compile(r'\bhttp[s]?://[^\b \n\r\(\)\[\]\{\},]*')
-# From https://stackoverflow.com/questions/161738/
-#     what-is-the-best-regular-expression-to-check-if-a-string-is-a-valid-url
-URL_RE = re.compile(
-    r'\b(https?|ftp|file)://'
-    r'[-A-Za-z0-9+&@#/%?=~_|!:,.;]+[-A-Za-z0-9+&@#/%=~_|]',
-    re.IGNORECASE)
 
 BOLD_RE = re.compile(r'\*\*([^\*])+\*\*')
 
@@ -63,6 +85,21 @@ def assume_answer(ans):
     ASSUMED_ANSWER = orig
 
 
+def search_cases(q, cols):
+    '''Cases matching `q`, with the comma separated `cols`.
+
+    Cases are <case> tags or, with --backend=json, dicts from the JSON
+    API: FBCase and FBShortCase accept both.
+    '''
+    if options.backend == 'json':
+        return FB.json_api(
+            'search', q=str(q), cols=cols.split(','))['cases']
+    resp = FB.search(q=q, cols=cols)
+    if resp.cases is None:
+        return []
+    return resp.cases.findAll('case', recursive=False)
+
+
 def set_current_case(case):
     '''Set case as current and refresh history.'''
     global CURRENT_CASE
@@ -82,11 +119,16 @@ def set_last_search(search):
     LAST_SEARCH = search
 
 
-def command(name):
+def command(name, needs_startup=True):
+    '''Register a REPL command.
+
+    Unless `needs_startup` is False, the command waits for the startup
+    tasks (logon, people, ...) to be done.
+    '''
     cmdlogger = logging.getLogger('fb.cmd')
 
     def wrapper(f):
-        COMMANDS[name] = Command(f)
+        COMMANDS[name] = Command(f, needs_startup)
 
         @wraps(f)
         def helper(*args, **kwargs):
@@ -103,6 +145,21 @@ def alias(name, cmdline):
     return a
 
 
+def bulk_action(name):
+    '''Let `apply` run command `name` on many cases at once.
+
+    The decorated function takes the command arguments and returns a
+    function of the case to run it on: it must not use CURRENT_CASE,
+    nor ask anything.
+    '''
+
+    def wrapper(f):
+        BULK[name] = f
+        return f
+
+    return wrapper
+
+
 def xdg_open(what):
     retval = call('which xdg-open > /dev/null', shell=True)
     if retval != 0:
@@ -125,8 +182,9 @@ def xclip(what):
 
 class Command(object):
 
-    def __init__(self, f):
+    def __init__(self, f, needs_startup=True):
         self.f = f
+        self.needs_startup = needs_startup
 
     def __call__(self, *args, **kwargs):
         return self.f(*args, **kwargs)
@@ -167,6 +225,9 @@ class Alias(object):
 
 class FBObj(object):
 
+    # Allow slotted subclasses
+    __slots__ = ()
+
     TMPL = None
 
     def to_string(self, tmpl=None):
@@ -193,9 +254,9 @@ class FBObj(object):
         return u
 
     @staticmethod
-    def _soup(html):
+    def _soup_xml(xml):
         from bs4 import BeautifulSoup
-        return BeautifulSoup(html, 'lxml')
+        return BeautifulSoup(xml, 'xml')
 
 
 class FBStatus(FBObj):
@@ -225,9 +286,12 @@ class FBStatus(FBObj):
                 ss.append(s)
         return ss
 
+    @classmethod
+    def get_all(cls):
+        return cls.from_result(META.get('listStatuses'))
+
     @staticmethod
-    def get_all():
-        result = FB.listStatuses()
+    def from_result(result):
         return [FBStatus(a) for a in result.findAll('status')]
 
     @property
@@ -243,25 +307,107 @@ class FBStatus(FBObj):
         return int(self._status.ixCategory.get_text(strip=True))
 
 
-class FBPerson(FBObj):
+class PersonDirectory(object):
+    '''Persons, indexed by id, email and full name.
+
+    Emails and full names are matched ignoring case. Adding a person
+    already known, by id, replaces it: there is one object per person.
+    '''
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_email = {}
+        self._by_fullname = {}
+        # Ids FogBugz knows nothing about
+        self._unknown_ids = set()
+        # True once all people have been loaded at once
+        self.complete = False
+        # Bumped on changes
+        self.version = 0
+
+    @staticmethod
+    def _key(s):
+        return (s or '').lower()
+
+    def add(self, person):
+        old = self._by_id.get(person.id)
+        if old is not None:
+            self._by_email.pop(self._key(old.email), None)
+            self._by_fullname.pop(self._key(old.fullname), None)
+        self._by_id[person.id] = person
+        self._by_email[self._key(person.email)] = person
+        self._by_fullname[self._key(person.fullname)] = person
+        self._unknown_ids.discard(person.id)
+        self.version += 1
+        return person
+
+    def load(self, persons):
+        '''Add all people, e.g. from listPeople.'''
+        for person in persons:
+            self.add(person)
+        self.complete = True
+
+    def by_id(self, person_id):
+        return self._by_id.get(person_id)
+
+    def by_email(self, email):
+        return self._by_email.get(self._key(email))
+
+    def by_fullname(self, fullname):
+        return self._by_fullname.get(self._key(fullname))
+
+    def set_unknown(self, person_id):
+        self._unknown_ids.add(person_id)
+
+    def is_unknown(self, person_id):
+        return person_id in self._unknown_ids
+
+    def clear(self):
+        version = self.version
+        self.__init__()
+        self.version = version + 1
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+class FBPerson(FBObj, records.Person):
+
+    __slots__ = ()
 
     TMPL = Template('''{% raw obj.fullname %} <{% raw obj.email %}>''')
 
     # Cache persons, who don't change that often...
-    CACHE = set()
+    CACHE = PersonDirectory()
 
     logger = logging.getLogger('fb.person')
 
     def __init__(self, person):
-        self._person = person
-        self.CACHE.add(self)
+        records.Person.__init__(self, **records.Person.decode(person))
+
+    @classmethod
+    def _lookup(cls, find, **kwargs):
+        '''Find a person in the cache, else ask FogBugz.'''
+        person = find()
+        if person is None and not cls.CACHE.complete:
+            # One listPeople is cheaper than many viewPerson
+            cls.get_all()
+            person = find()
+        if person is None:
+            person = cls._get(**kwargs)
+        return person
 
     @classmethod
     def _get(cls, **kwargs):
         cls.logger.debug('Getting person %s', kwargs)
         persons = FB.viewPerson(**kwargs)
         person = persons.find('person')
-        return cls(person)
+        assert person is not None, 'Cannot find person {}'.format(
+            ' '.join(str(v) for v in kwargs.values()))
+        return cls.CACHE.add(cls(person))
 
     @classmethod
     def get_by_guess(cls, what):
@@ -278,43 +424,36 @@ class FBPerson(FBObj):
 
     @classmethod
     def get_by_email(cls, email):
-        for p in cls.CACHE:
-            if p.email == email:
-                return p
-        return cls._get(sEmail=email)
+        return cls._lookup(
+            lambda: cls.CACHE.by_email(email), sEmail=email)
 
     @classmethod
     def get_by_fullname(cls, fullname):
-        for p in cls.CACHE:
-            if p.fullname == fullname:
-                return p
-        return cls._get(sFullname=fullname)
+        return cls._lookup(
+            lambda: cls.CACHE.by_fullname(fullname), sFullname=fullname)
 
     @classmethod
     def get_by_id(cls, person_id):
-        for p in cls.CACHE:
-            if p.id == person_id:
-                return p
-        return cls._get(ixPerson=person_id)
-
-    @staticmethod
-    def get_all():
-        result = FB.listPeople()
-        return sorted(
-            [FBPerson(a) for a in result.findAll('person')],
-            key=lambda p: (p.fullname.lower(), p.email.lower()))
-
-    @property
-    def id(self):
-        return int(self._person.ixPerson.get_text(strip=True))
+        assert not cls.CACHE.is_unknown(person_id), \
+            'Cannot find person {}'.format(person_id)
+        try:
+            return cls._lookup(
+                lambda: cls.CACHE.by_id(person_id), ixPerson=person_id)
+        except (AssertionError, fogbugz.FogBugzAPIError):
+            # Do not ask again
+            cls.CACHE.set_unknown(person_id)
+            raise
 
-    @property
-    def fullname(self):
-        return self._person.sFullName.get_text(strip=True)
+    @classmethod
+    def get_all(cls):
+        return cls.from_result(META.get('listPeople'))
 
-    @property
-    def email(self):
-        return self._person.sEmail.get_text(strip=True)
+    @classmethod
+    def from_result(cls, result):
+        persons = [cls(a) for a in result.findAll('person')]
+        cls.CACHE.load(persons)
+        return sorted(
+            persons, key=lambda p: (p.fullname.lower(), p.email.lower()))
 
 
 class History(FBObj):
@@ -325,6 +464,8 @@ class History(FBObj):
 
     def __init__(self):
         self._history = []
+        # Bumped on changes
+        self.version = 0
 
     def push(self, case):
         '''Add new history item. Remove first if it exists.'''
@@ -332,6 +473,7 @@ class History(FBObj):
         if scase in self._history:
             self._history.remove(scase)
         self._history.insert(0, scase)
+        self.version += 1
 
     def __iter__(self):
         return iter(self._history)
@@ -342,6 +484,83 @@ class History(FBObj):
         return None
 
 
+class CaseIndex(object):
+    '''Events, links and attachments of a case, by id.
+
+    Built incrementally, in event order and only as far as needed:
+    the links of an event only need the events before it to be
+    scanned, so the first events render before the others are even
+    converted to text.
+    '''
+
+    def __init__(self, events):
+        self.events = events
+        self._events_by_id = {event.id: event for event in events}
+        self._positions = {event.id: i for i, event in enumerate(events)}
+        self._indexed = 0
+        self._links = []
+        self._links_by_event = {}
+        self._attachments = []
+        self._attachments_by_id = {}
+        self._last_with_comment = None
+
+    def _index_until(self, n):
+        '''Index the first `n` events.'''
+        while self._indexed < min(n, len(self.events)):
+            event = self.events[self._indexed]
+            links = [
+                FBLink(len(self._links) + i, event, url, pos)
+                for i, (pos, url) in enumerate(event.urls)]
+            # TODO
+            # for text, url in event.inline_urls:
+            #     links.append(FBInlineLink(
+            #         len(self._links) + len(links), event, url, text))
+            self._links.extend(links)
+            self._links_by_event[event.id] = links
+            for attachment in event.attachments:
+                self._attachments.append(attachment)
+                self._attachments_by_id.setdefault(attachment.id, attachment)
+            self._indexed += 1
+
+    def _index_all(self):
+        self._index_until(len(self.events))
+
+    def event(self, event_id):
+        return self._events_by_id.get(int(event_id))
+
+    def links_of(self, event):
+        if event.id not in self._links_by_event:
+            self._index_until(self._positions[event.id] + 1)
+        return self._links_by_event[event.id]
+
+    @builtins.property
+    def links(self):
+        self._index_all()
+        return self._links
+
+    @builtins.property
+    def attachments(self):
+        self._index_all()
+        return self._attachments
+
+    def attachment(self, attachment_id):
+        attachment_id = int(attachment_id)
+        # Look at the events indexed so far first
+        if attachment_id not in self._attachments_by_id:
+            self._index_all()
+        return self._attachments_by_id.get(attachment_id)
+
+    @builtins.property
+    def last_with_comment(self):
+        if self._last_with_comment is None:
+            # From the end: usually the last event or so
+            for event in reversed(self.events):
+                if event.raw_comment.strip():
+                    self._last_with_comment = event
+                    break
+        return self._last_with_comment
+
+
 class FBCase(FBObj):
 
     TMPL_HEADER_TEXT = '''
@@ -374,15 +593,89 @@ Assigned to {% raw ui.red(obj.assigned_to) %}
     TMPL = Template(TMPL_HEADER_TEXT + TMPL_EVENTS_TEXT)
     TMPL_HEADER = Template(TMPL_HEADER_TEXT)
 
-    def __init__(self, case):
+    COLS = [
+        'ixBug',
+        'sTitle',
+        'sStatus',
+        'sPersonAssignedTo',
+        'sPriority',
+        'sProject',
+        'sArea',
+        'sFixFor',
+        'ixCategory',
+        'sCategory',
+        'ixPersonOpenedBy',
+        'ixBugParent',
+        'ixBugChildren',
+        'ixBugOriginal',
+        'ixRelatedBugs',
+        'dtOpened',
+        'ixPriority',
+        'dtLastUpdated',
+        'tags',
+        'events',
+    ]
+
+    # Header and the latest event only, to refresh a case
+    # minievents: ids of all events, without their text
+    UPDATE_COLS = [col for col in COLS if col != 'events'] + [
+        'ixBugEventLatest', 'latestEvent', 'minievents']
+
+    # Enough to write to a case: see `get_slim`
+    SLIM_COLS = ['ixBug', 'operations', 'ixCategory', 'ixBugEventLatest']
+
+    # Max number of case ids in a single search query
+    BATCH_SIZE = 50
+
+    def __init__(self, case, current=True, slim=False):
+        # A <case> tag or a dict, from the JSON API
         self._case = case
-        set_current_case(self)
+        # Header, decoded in one pass
+        self._rec = records.Case.load(case)
+        # Only SLIM_COLS, until updated by a write: no events
+        self.slim = slim
+        # Events, if merged from many responses
+        self._merged_events = [] if slim else None
+        if current:
+            set_current_case(self)
 
     @classmethod
     def get_by_id(cls, ixBug):
         raw = FBCase._get_raw(ixBug)
         return cls(raw)
 
+    @classmethod
+    def get_many(cls, ids):
+        '''Get many cases, in batches, without changing the current case.
+
+        Returns an OrderedDict {id: case}, in the same order as `ids`.
+        Cases not found are missing from the result.
+        '''
+        return cls._search_many(ids, cls.COLS, cls.BATCH_SIZE)
+
+    @classmethod
+    def get_slim(cls, ids):
+        '''Get many cases, with just what is needed to write to them.
+
+        Only SLIM_COLS, for all of them in a single search: writes
+        return the rest. Slim cases cannot be mirrored.
+        '''
+        return cls._search_many(ids, cls.SLIM_COLS, None, slim=True)
+
+    @classmethod
+    def _search_many(cls, ids, cols, batch_size, slim=False):
+        ids = list(OrderedDict.fromkeys(int(id_) for id_ in ids))
+        cols = ','.join(cols)
+        # None: all at once
+        batch_size = batch_size or max(len(ids), 1)
+        found = {}
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            for raw in search_cases(','.join(map(str, batch)), cols):
+                case = cls(raw, current=False, slim=slim)
+                found[case.id] = case
+        return OrderedDict((id_, found[id_]) for id_ in ids if id_ in found)
+
     @classmethod
     def get_by_id_or_current(cls, ixBug):
         if ixBug is None:
@@ -390,65 +683,56 @@ Assigned to {% raw ui.red(obj.assigned_to) %}
             return CURRENT_CASE
         return FBCase.get_by_id(int(ixBug))
 
-    @staticmethod
-    def _get_raw(ixBug):
-        cols = [
-            'ixBug',
-            'sTitle',
-            'sStatus',
-            'sPersonAssignedTo',
-            'sPriority',
-            'sProject',
-            'sArea',
-            'sFixFor',
-            'ixCategory',
-            'sCategory',
-            'ixPersonOpenedBy',
-            'ixBugParent',
-            'ixBugChildren',
-            'ixBugOriginal',
-            'ixRelatedBugs',
-            'dtOpened',
-            'tags',
-            'events',
-        ]
-        raw = FB.search(q=int(ixBug), cols=','.join(cols))
-        count = int(raw.cases.get('count'))
+    @classmethod
+    def get_local(cls, ixBug):
+        '''Get case from the local mirror.'''
+        if ixBug is None:
+            assert_current()
+            ixBug = CURRENT_CASE.id
+        xml = STORE.get_case_xml(int(ixBug))
+        assert xml is not None, \
+            'Case {} not in local mirror: try "sync"'.format(ixBug)
+        return cls(cls._soup_xml(xml).case)
+
+    @classmethod
+    def _get_raw(cls, ixBug, cols=None):
+        cases = search_cases(int(ixBug), ','.join(cols or cls.COLS))
+        count = len(cases)
         assert count != 0, 'Cannot find case {}'.format(ixBug)
         assert count == 1, 'Found too many cases with ixBug=={}'.format(ixBug)
-        return raw
+        return cases[0]
 
     @property
     def id(self):
-        return int(self._case.ixBug.get_text(strip=True))
+        return self._rec.id
 
     @property
     def title(self):
-        return self._case.sTitle.get_text(strip=True)
+        return self._rec.title
 
     @property
     def status(self):
-        return self._case.sStatus.get_text(strip=True)
+        return self._rec.status
 
     @property
     def priority(self):
-        return self._case.sPriority.get_text(strip=True)
+        return self._rec.priority
 
     @property
     def project(self):
-        return self._case.sProject.get_text(strip=True)
+        return self._rec.project
 
     @property
     def area(self):
-        return self._case.sArea.get_text(strip=True)
+        return self._rec.area
 
     @property
     def assigned_to(self):
-        return self._case.sPersonAssignedTo.get_text(strip=True)
+        return self._rec.assigned_to
 
     @property
     def opened_by_id(self):
-        return int(self._case.ixPersonOpenedBy.get_text(strip=True))
+        return self._rec.opened_by_id
 
     @property
     def opened_by(self):
@@ -456,23 +740,23 @@ Assigned to {% raw ui.red(obj.assigned_to) %}
 
     @property
     def dtopened(self):
-        return self._case.dtOpened.get_text(strip=True)[:10]
+        return (self._rec.dtopened or '')[:10]
 
     @property
     def milestone(self):
-        return self._case.sFixFor.get_text(strip=True)
+        return self._rec.milestone
 
     @property
     def parent_id(self):
-        return int(self._case.ixBugParent.get_text(strip=True))
+        return self._rec.parent_id
 
     @property
     def category_id(self):
-        return int(self._case.ixCategory.get_text(strip=True))
+        return self._rec.category_id
 
     @property
     def category(self):
-        return self._case.sCategory.get_text(strip=True)
+        return self._rec.category
 
     @property
     def available_statuses(self):
@@ -480,73 +764,79 @@ Assigned to {% raw ui.red(obj.assigned_to) %}
 
     @property
     def duplicate_of_id(self):
-        id_ = self._case.ixBugOriginal.get_text(strip=True)
-        if id_:
-            return int(id_)
+        return self._rec.duplicate_of_id
 
     @property
     def children_ids(self):
-        return list(map(
-            int,
-            filter(None, self._case.ixBugChildren.get_text(
-                strip=True).split(','))))
+        return self._rec.children_ids
 
     @property
     def related_ids(self):
-        return list(map(
-            int,
-            filter(None, self._case.ixRelatedBugs.get_text(
-                strip=True).split(','))))
+        return self._rec.related_ids
 
     @property
     def events(self):
-        return [FBBugEvent(self, event) for event in self._case.events]
+        if self._merged_events is not None:
+            return self._merged_events
+        return self._events_of(self._case)
+
+    def _events_of(self, raw):
+        if isinstance(raw, dict):
+            return [
+                FBBugEvent(self, records.Event.from_json(event))
+                for event in raw.get('events') or []]
+        return [FBBugEvent(self, event) for event in raw.events]
 
     @property
     def last_event(self):
         return self.events[-1]
 
+    @property
+    def index(self):
+        # Once per case: a refetched case is a new FBCase
+        return CaseIndex(self.events)
+
     @property
     def last_event_with_comment(self):
-        for event in reversed(self.events):
-            if event.raw_comment.strip():
-                return event
+        return self.index.last_with_comment
 
     def get_event(self, event_id):
-        for event in self.events:
-            if event.id == int(event_id):
-                return event
+        return self.index.event(event_id)
 
     @property
     def attachments(self):
-        attachments = []
-        for event in self.events:
-            attachments.extend(event.attachments)
-        return attachments
+        return self.index.attachments
+
+    def get_attachment(self, attachment_id):
+        return self.index.attachment(attachment_id)
 
     @property
     def links(self):
-        ilink, links = 0, []
-        for event in self.events:
-            for pos, url in event.urls:
-                link = FBLink(ilink, event, url, pos)
-                links.append(link)
-                ilink += 1
-            # TODO
-            # for text, url in event.inline_urls:
-            #     link = FBInlineLink(ilink, event, url, text)
-            #     ilink += 1
-            #     links.append(link)
-        return links
+        return self.index.links
 
     @property
     def tags(self):
-        return list(
-            filter(None, self._case.tags.get_text(strip=True).split(',')))
+        return self._rec.tags
+
+    @property
+    def _is_json(self):
+        return isinstance(self._case, dict)
+
+    @property
+    def _case_tag(self):
+        # Either a whole search response or a single <case>
+        if self._case.name == 'case':
+            return self._case
+        return self._case.case
 
     @property
     def operations(self):
-        ops = self._case.case.get('operations')
+        if self._is_json:
+            ops = self._case.get('operations')
+        else:
+            ops = self._case_tag.get('operations')
+        if isinstance(ops, list):
+            return ops
         return ops.split(',') if ops else []
 
     @property
@@ -581,42 +871,48 @@ Assigned to {% raw ui.red(obj.assigned_to) %}
         assert op in self.operations, 'Invalid operation {}: not in {}'.format(
             op, self.operations)
 
+    def _write(self, cmd, **kwargs):
+        '''Call `cmd` on this case, and update it from the response.
+
+        The response has the header and the latest event: no need to
+        fetch the case again.
+        '''
+        resp = getattr(FB, cmd)(
+            ixBug=self.id, ixPersonEditedBy=CURRENT_USER.id,
+            cols=','.join(self.UPDATE_COLS), **self._clean_kwargs(kwargs))
+        raw = resp.find('case') if resp is not None else None
+        if raw is None:
+            self.update()
+        else:
+            self._apply(raw)
+        return self
+
     def edit(self, **kwargs):
         if not kwargs:
             return
         self.assert_operation('edit')
-        FB.edit(
-            ixBug=self.id, ixPersonEditedBy=CURRENT_USER.id,
-            **self._clean_kwargs(kwargs))
+        self._write('edit', **kwargs)
 
     def resolve(self, **kwargs):
         self.assert_operation('resolve')
-        FB.resolve(
-            ixBug=self.id, ixPersonEditedBy=CURRENT_USER.id,
-            **self._clean_kwargs(kwargs))
+        self._write('resolve', **kwargs)
 
     def reopen(self, **kwargs):
         self.assert_operation('reopen')
-        FB.reopen(
-            ixBug=self.id, ixPersonEditedBy=CURRENT_USER.id,
-            **self._clean_kwargs(kwargs))
+        self._write('reopen', **kwargs)
 
     def reactivate(self, **kwargs):
         self.assert_operation('reactivate')
-        FB.reactivate(
-            ixBug=self.id, ixPersonEditedBy=CURRENT_USER.id,
-            **self._clean_kwargs(kwargs))
+        self._write('reactivate', **kwargs)
 
     def assign(self, person, **kwargs):
         self.assert_operation('assign')
-        FB.assign(
-            ixBug=self.id, ixPersonEditedBy=CURRENT_USER.id,
-            sPersonAssignedTo=person.fullname,
-            **self._clean_kwargs(kwargs))
+        self._write(
+            'assign', sPersonAssignedTo=person.fullname, **kwargs)
 
     def notify(self, persons, **kwargs):
         person_ids = [p.id for p in persons]
-        FB.notify(CURRENT_CASE.id, CURRENT_CASE.last_event.id, person_ids)
+        FB.notify(self.id, self.last_event.id, person_ids)
         self.edit(**kwargs)
 
     def amend(self, event, **kwargs):
@@ -624,9 +920,7 @@ Assigned to {% raw ui.red(obj.assigned_to) %}
 
     def close(self, **kwargs):
         self.assert_operation('close')
-        FB.close(
-            ixBug=self.id, ixPersonEditedBy=CURRENT_USER.id,
-            **self._clean_kwargs(kwargs))
+        self._write('close', **kwargs)
 
     def browse(self):
         xdg_open(self.permalink)
@@ -638,6 +932,102 @@ Assigned to {% raw ui.red(obj.assigned_to) %}
     def header(self):
         return self.to_string(self.TMPL_HEADER)
 
+    def update(self, event_id=None):
+        '''Fetch the header again, and only the events not known yet.
+
+        `event_id` is an event changed in place, e.g. amended, to be
+        fetched again as well.
+        '''
+        return self._apply(
+            self._get_raw(self.id, self.UPDATE_COLS), event_id)
+
+    def _apply(self, raw, event_id=None):
+        '''Take header and new events from `raw`, a case.'''
+        events = list(self.events)
+        known = {event.id for event in events}
+        latest = self._latest_event(raw)
+        if latest is not None and latest.id not in known:
+            events.append(FBBugEvent(self, latest))
+            known.add(latest.id)
+        ids = self._event_ids(raw)
+        if not self.slim and ids is not None and not known.issuperset(ids):
+            # Not only the latest is new, e.g. others commented
+            # meanwhile: fetch all events, once
+            events = self._events_of(
+                self._get_raw(self.id, ['ixBug', 'events']))
+        if event_id is not None:
+            edited = FBBugEvent(
+                self, records.Event.from_json(FB.get_event(event_id)))
+            events = [
+                edited if event.id == edited.id else event
+                for event in events]
+        slim = self.slim
+        # Drop values cached by lazy properties, too
+        self.__dict__.clear()
+        self._case = raw
+        self._rec = records.Case.load(raw)
+        self.slim = slim
+        self._merged_events = events
+        if self is CURRENT_CASE:
+            # Refresh history
+            set_current_case(self)
+        return self
+
+    @staticmethod
+    def _event_ids(raw):
+        '''Ids of all the events, from minievents, or None.'''
+        if isinstance(raw, dict):
+            minievents = raw.get('minievents')
+            if minievents is None:
+                return None
+            return [records.Event.from_json(e).id for e in minievents]
+        minievents = raw.find('minievents')
+        if minievents is None:
+            return None
+        return [
+            records.Event.from_xml(e).id
+            for e in minievents.findAll('event')]
+
+    @staticmethod
+    def _latest_event(raw):
+        if isinstance(raw, dict):
+            latest = raw.get('latestEvent')
+            return records.Event.from_json(latest) if latest else None
+        latest = raw.find('latestEvent')
+        if latest is None:
+            return None
+        event = records.Event.from_xml(latest)
+        return event if event.id is not None else None
+
+    def save_local(self):
+        '''Save case in the local mirror and full-text index.'''
+        assert not self.slim, \
+            'Cannot mirror case {}: events not known'.format(self.id)
+        if self._is_json or self._merged_events is not None:
+            # Mirror as XML, from the records
+            xml = self._rec.to_xml(
+                ixBug=self.id, operations=','.join(self.operations))
+            events = [
+                (event.id, event._event.to_xml())  # pylint: disable=W0212
+                for event in self.events]
+        else:
+            xml, events = self._split_events(self._case_tag)
+        short = FBShortCase.from_case(self).to_row()
+        STORE.save_case(short, xml, events or [])
+        INDEX.add_case(self.id, self.title, [
+            (event.id, event.raw_comment) for event in self.events])
+
+    @staticmethod
+    def _split_events(case):
+        events = case.events
+        xml = str(case)
+        if events is not None:
+            xml = xml.replace(str(events), '', 1)
+            events = [
+                (int(e.ixBugEvent.get_text(strip=True)), str(e))
+                for e in events.findAll('event')]
+        return xml, events
+
     @classmethod
     def new(cls, **kwargs):
         rs = FB.new(**kwargs)
@@ -714,6 +1104,8 @@ class FBAttachment(FBObj):
     logger = logging.getLogger('fb.attachment')
 
     def __init__(self, attachment):
+        if not isinstance(attachment, records.Attachment):
+            attachment = records.Attachment.from_xml(attachment)
         self._attachment = attachment
         self._parse_url()
 
@@ -733,41 +1125,49 @@ class FBAttachment(FBObj):
 
     @property
     def filename(self):
-        return self._attachment.sFileName.get_text(strip=True)
+        return self._attachment.filename
 
     @property
     def url(self):
-        url = self._attachment.sURL.get_text(strip=True).replace('&amp;', '&')
-        return FB.full_url(url)
+        return FB.full_url(self._attachment.url.replace('&amp;', '&'))
 
     @property
     def safe_filename(self):
         return self.INVALID_CHARS_RE.sub('_', self.filename)
 
     @property
-    def _local_filename(self):
-        fname = '{}_{}'.format(self.id, self.safe_filename)
-        return os.path.join(tempfile.gettempdir(), fname)
-
-    def download(self):
+    def download_job(self):
+        '''(cache key, file name, url) to download this attachment.'''
         url = self.url
         if self._internal:
-            url += '&token={}'.format(FB.current_token)
+            url += '&token={}'.format(FB.api_token)
+            # Ids are unique in FogBugz, URLs are not (e.g. sTicket)
+            key = 'attachment:{}'.format(self.id)
+        else:
+            key = self.url
+        return key, self.safe_filename, url
 
-        self.logger.debug('Fetching %s', url)
-        r = urllib.request.urlopen(url)
-        assert r.getcode() == 200, 'Failed to download {}'.format(url)
+    @property
+    def _local_filename(self):
+        key, filename, _ = self.download_job
+        return DOWNLOADS.get(key, filename)
 
-        with open(self._local_filename, 'wb') as fid:
-            fid.write(r.read())
-        print('Saved to', self._local_filename)
+    def download(self, progress=True):
+        key, filename, url = self.download_job
+        self.logger.debug('Fetching %s', url)
+        fname = DOWNLOADS.fetch(
+            key, filename, url, FB.session,
+            progress=downloads.Progress(filename) if progress else None)
+        print('Saved to', fname)
+        return fname
 
     def view(self):
-        if os.path.exists(self._local_filename):
+        fname = self._local_filename
+        if fname is not None:
             print('Found local file.')
         else:
-            self.download()
-        xdg_open(self._local_filename)
+            fname = self.download()
+        xdg_open(fname)
 
 
 class FBInlineImg(FBAttachment):
@@ -810,42 +1210,43 @@ class FBBugEvent(FBObj):
     logger = logging.getLogger('fb.event')
 
     def __init__(self, fbcase, event):
+        if not isinstance(event, records.Event):
+            event = records.Event.from_xml(event)
         self._event = event
         self._fbcase = fbcase
 
     @property
     def id(self):
-        return int(self._event.ixBugEvent.get_text(strip=True))
+        return self._event.id
 
     @property
     def dt(self):
-        return self._event.dt.get_text(strip=True)
+        return self._event.dt
 
     @property
     def person(self):
-        return self._event.sPerson.get_text(strip=True)
+        return self._event.person
 
     @property
     def desc(self):
-        return self._event.evtDescription.get_text(strip=True)
+        return self._event.desc
 
     @property
     def changes(self):
         return list(filter(None, [
-            c.strip()
-            for c in self._event.sChanges.get_text(strip=True).splitlines()
+            c.strip() for c in self._event.changes.splitlines()
         ]))
 
     @property
-    def raw_comment(self):
-        if self._event.sHtml:
-            txt = self._event.sHtml.get_text(strip=True)
-            text_maker = html2text.HTML2Text()
-            text_maker.body_width = 0
-            text_maker.protect_links = True
-            return text_maker.handle(txt)
+    def markup(self):
+        # Text, URLs, images and anchors, in one pass
+        if self._event.html is not None:
+            return markup.from_html(self._event.html)
+        return markup.from_text(self._event.s)
 
-        return self._event.s.get_text(strip=True)
+    @property
+    def raw_comment(self):
+        return self.markup.text
 
     @property
     def comment(self):
@@ -869,16 +1270,11 @@ class FBBugEvent(FBObj):
 
     @property
     def urls(self):
-        return [
-            (m.start(), m.group())
-            for m in URL_RE.finditer(self.raw_comment)
-            ]
+        return self.markup.urls
 
     @property
     def _attachments(self):
-        return [
-            FBAttachment(a) for a in self._event.findAll('attachment')
-        ]
+        return [FBAttachment(a) for a in self._event.attachments]
 
     @property
     def attachments(self):
@@ -889,41 +1285,20 @@ class FBBugEvent(FBObj):
 
     @property
     def links(self):
-        return [
-            link for link in self._fbcase.links
-            if link.event.id == self.id]
+        return self._fbcase.index.links_of(self)
 
     @property
     def inline_imgs(self):
-        imgs = []
-        if not self._event.sHtml:
-            return imgs
-        html = self._event.sHtml.get_text(strip=True)
-        soup = self._soup(html)
-        for img in soup.findAll('img'):
-            if 'src' in img.attrs:
-                src = img.attrs['src'].strip()
-                # Only support http links
-                if src.startswith('http'):
-                    imgs.append(FBInlineImg(src))
-        return imgs
+        return [FBInlineImg(src) for src in self.markup.imgs]
 
     @property
     def inline_urls(self):
-        urls = []
-        if not self._event.sHtml:
-            return urls
-        html = self._event.sHtml.get_text(strip=True)
-        soup = self._soup(html)
-        for url in soup.findAll('a'):
-            href = url.attrs.get('href')
-            t = url.text.strip()
-            if t and href and t != href:
-                urls.append((t, href))
-        return urls
+        return list(self.markup.anchors)
+
 
+class FBShortCase(FBObj, records.ShortCase):
 
-class FBShortCase(FBObj):
+    __slots__ = ()
 
     TMPL = Template(
         '''{% raw ui.caseid(obj.id, rjust=8) %} \
@@ -935,62 +1310,18 @@ class FBShortCase(FBObj):
     # Keep a history of visited cases, in short form
     HISTORY = History()
 
-    def __init__(self, case):
-        self._case = case
-
     @classmethod
     def from_case(cls, case):
-        return cls.from_xml(case._case)  # pylint: disable=W0212
+        if isinstance(case, FBShortCase):
+            return case
+        # Copy the header only: do not keep the whole case alive
+        return cls(**case._rec.short().to_dict())  # pylint: disable=W0212
 
-    @classmethod
-    def from_xml(cls, case):
-        return cls(case)
-
-    @property
-    def id(self):
-        return int(self._case.ixBug.get_text(strip=True))
-
-    @property
-    def status(self):
-        return self._case.sStatus.get_text(strip=True)
-
-    @property
-    def title(self):
-        return self._case.sTitle.get_text(strip=True)
-
-    @property
-    def project(self):
-        return self._case.sProject.get_text(strip=True)
-
-    @property
-    def priority(self):
-        return self._case.sPriority.get_text(strip=True)
-
-    @property
-    def priority_id(self):
-        if self._case.ixPriority:
-            return int(self._case.ixPriority.get_text(strip=True))
-        return 999
-
-    @property
-    def last_updated(self):
-        return datetime.datetime.strptime(
-            self._case.dtLastUpdated.get_text(), '%Y-%m-%dT%H:%M:%SZ')
-
-    @property
-    def opened(self):
-        return datetime.datetime.strptime(
-            self._case.dtOpened.get_text(), '%Y-%m-%dT%H:%M:%SZ')
-
-    @property
-    def opened_by_id(self):
-        return int(self._case.ixPersonOpenedBy.get_text(strip=True))
-
-    @property
+    # Slotted: LazyProperty needs an instance __dict__
+    @builtins.property
     def opened_by(self):
         return FBPerson.get_by_id(self.opened_by_id)
 
-
     def __eq__(self, case):
         return self.id == case.id
 
@@ -1005,29 +1336,84 @@ class FBCaseSearch(FBObj):
 
     logger = logging.getLogger('fb.search')
 
+    # True if rows were printed while streaming
+    streamed = False
+
     def __init__(self, shortcases):
         self.shortcases = sorted(
-            shortcases,
-            key=lambda p: (p.priority_id, p.project, p.last_updated))
+            shortcases, key=lambda p: p.sort_key)
         set_last_search(self)
 
     @classmethod
     def _parse_cases(cls, resp):
+        if resp.cases is None:
+            return cls([])
+        return cls._from_cases(resp.cases.findAll('case'))
+
+    @classmethod
+    def _from_cases(cls, raw):
         cases = {}
-        if resp.cases is not None:
-            for case in resp.cases.findAll('case'):
-                cobj = FBShortCase.from_xml(case)
-                cases[cobj.id] = cobj
+        for case in raw:
+            cobj = FBShortCase.load(case)
+            cases[cobj.id] = cobj
         return cls(cases.values())
 
+    COLS = ','.join(store.SHORT_COLS)
+
     @classmethod
     def search(cls, q):
         cls.logger.debug('Searching for %r', q)
-        cols = (
-            "ixBug,sTitle,sStatus,sProject,sPriority,ixPriority,"
-            "dtLastUpdated,ixPersonOpenedBy,dtOpened")
-        resp = FB.search(q=q, cols=cols)
-        return cls._parse_cases(resp)
+        return cls._from_cases(search_cases(q, cls.COLS))
+
+    @classmethod
+    def iter_search(cls, q):
+        '''Yield short cases as the search response arrives.'''
+        cls.logger.debug('Streaming search for %r', q)
+        for el in FB.iter_response('search', 'case', q=q, cols=cls.COLS):
+            yield FBShortCase.from_xml(el)
+
+    @classmethod
+    def search_stream(cls, q, pred=None):
+        '''Search, printing matching cases as soon as they arrive.
+
+        Rows are printed in the order FogBugz returns them: the
+        result, as used by `apply`, is sorted as usual.
+        '''
+        cases = OrderedDict()
+        for sc in cls.iter_search(q):
+            if sc.id in cases or (pred is not None and not pred(sc)):
+                continue
+            print(sc)
+            cases[sc.id] = sc
+        rs = cls(cases.values())
+        rs.streamed = True
+        return rs
+
+    @classmethod
+    def search_local(cls, q):
+        '''Search the local mirror.
+
+        Supports full-text search of words and "phrases" in titles and
+        comments, and title/status/project/priority keywords.
+        '''
+        cls.logger.debug('Searching locally for %r', q)
+        words, filters = [], {}
+        for token in shlex.split(q):
+            k, sep, v = token.replace('=', ':', 1).partition(':')
+            if sep and k.lower() in store.FILTERS:
+                filters[k.lower()] = v
+            else:
+                words.append(token)
+        if words and len(INDEX) > 0:
+            found = INDEX.search(' '.join(shlex.quote(w) for w in words))
+            rank = {r[0]: i for i, r in enumerate(found)}
+            # Best matches first, as ranked by the index
+            rows = sorted(
+                STORE.search(ids=list(rank), **filters),
+                key=lambda row: rank[row['ixBug']])
+        else:
+            rows = STORE.search(words, **filters)
+        return cls([FBShortCase.from_row(row) for row in rows])
 
     @classmethod
     def top(cls, n):
@@ -1104,7 +1490,7 @@ class FBProject(FBObj):
 
     @classmethod
     def get_all(cls):
-        result = FB.listProjects()
+        result = META.get('listProjects')
         return sorted(
             [cls(pxml) for pxml in result.findAll('project')],
             key=lambda p: p.name)
@@ -1211,7 +1597,7 @@ class FBCheckin(FBObj):
     @property
     def author(self):
         html = self._data.get('sAuthor') or 'n/a'
-        return self._soup(html).text.strip()
+        return markup.strip_tags(html)
 
     @property
     def dtUTC(self):
@@ -1220,12 +1606,12 @@ class FBCheckin(FBObj):
     @property
     def date(self):
         html = self._data.get('sDate') or 'n/a'
-        return self._soup(html).text.strip()
+        return markup.strip_tags(html)
 
     @property
     def desc(self):
         html = self._data.get('sDesc') or self._data.get('sDescShort') or 'n/a'
-        return self._soup(html).text.strip()
+        return markup.strip_tags(html)
 
     def browse(self):
         xdg_open(self.url)
@@ -1239,12 +1625,23 @@ def get_prompt():
     return p
 
 
-def refresh():
+def refresh(event_id=None):
+    '''Bring the current case up to date, after changing it.
+
+    Only the header and new events are fetched: see FBCase.update.
+    '''
     assert_current()
-    FBCase.get_by_id_or_current(CURRENT_CASE.id)
+    mirror(CURRENT_CASE.update(event_id))
+
+
+def mirror(case):
+    '''Keep the local mirror up to date, if `case` is in it.'''
+    # Not INDEX: it would load the whole index
+    if case.id in STORE:
+        case.save_local()
 
 
-@command('logon')
+@command('logon', needs_startup=False)
 def logon():
     '''Logon to FB API.
 
@@ -1253,6 +1650,8 @@ def logon():
     Example:
     >>> logon
     '''
+    # Not while logging on at startup
+    STARTUP.succeeded('logon')
     logger.debug('Logging on')
     FB.login()
     return set_current_user(FBPerson.get_by_email(FB.current_user))
@@ -1269,7 +1668,7 @@ def logoff():
     return set_current_user(None)
 
 
-@command('help')
+@command('help', needs_startup=False)
 def help_(*args):
     '''Show help.
 
@@ -1313,17 +1712,25 @@ def whoami():
 
 
 @command('show')
-def show(ixBug=None):
+def show(*args):
     '''Show the current ticket.
 
     Example:
     >>> show  # shows the current ticket, without refreshing it
     >>> show 1234  # shows ticket 1234
+    >>> show --local 1234  # shows ticket 1234 from the local mirror
     '''
-    case = FBCase.get_by_id_or_current(ixBug)
+    local, args = _pop_local(args)
+    ixBug = args[0] if args else None
+    if local:
+        case = FBCase.get_local(ixBug)
+    else:
+        case = FBCase.get_by_id_or_current(ixBug)
     print(case)
-    if ixBug is not None:
+    if ixBug is not None and not local:
         case.mark_as_viewed()
+        case.save_local()
+        STORE.mark_viewed(case.id)
 
 
 @command('header')
@@ -1352,6 +1759,26 @@ def parent():
         print('No parent case.')
 
 
+@command('related')
+def related():
+    '''Show parent, children, duplicate and related tickets.
+
+    Example:
+    >>> related
+    '''
+    assert_current()
+    ids = [CURRENT_CASE.parent_id, CURRENT_CASE.duplicate_of_id]
+    ids += CURRENT_CASE.children_ids + CURRENT_CASE.related_ids
+    cases = FBCase.get_many(id_ for id_ in ids if id_)
+    if not cases:
+        print('No related cases.')
+        return
+    print()
+    for case in cases.values():
+        print(FBShortCase.from_case(case))
+    print()
+
+
 @command('reload')
 def reload_():
     '''Reload current ticket.
@@ -1370,7 +1797,7 @@ def close():
     with editor.maybe_writing('Add a comment?') as text:
         params = text.get_params_for_comment() if text else {}
         CURRENT_CASE.close(**params)
-        refresh()
+        mirror(CURRENT_CASE)
 
 
 @command('reactivate')
@@ -1380,7 +1807,7 @@ def reactivate():
     with editor.maybe_writing('Add a comment?') as text:
         params = text.get_params_for_comment() if text else {}
         CURRENT_CASE.reactivate(**params)
-        refresh()
+        mirror(CURRENT_CASE)
 
 
 @command('resolve')
@@ -1399,7 +1826,7 @@ def resolve(*args):
         if args and not params.get('sStatus'):
             params['sStatus'] = ' '.join(args)
         CURRENT_CASE.resolve(**params)
-        refresh()
+        mirror(CURRENT_CASE)
 
 
 @command('reopen')
@@ -1409,7 +1836,7 @@ def reopen():
     with editor.maybe_writing('Add a comment?') as text:
         params = text.get_params_for_comment() if text else {}
         CURRENT_CASE.reopen(**params)
-        refresh()
+        mirror(CURRENT_CASE)
 
 
 @command('duplicate')
@@ -1425,7 +1852,7 @@ def duplicate():
         params = text.get_params_for_comment() if text else {}
         params['sStatus'] = 'Resolved (Duplicate)'
         CURRENT_CASE.resolve(**params)
-        refresh()
+        mirror(CURRENT_CASE)
         # TODO not working
         # FB.duplicate(CURRENT_CASE.id, ixdup)
 
@@ -1457,7 +1884,7 @@ def assign(*args):
     with editor.maybe_writing('Add a comment?') as text:
         params = text.get_params_for_comment() if text else {}
         CURRENT_CASE.assign(person, **params)
-        refresh()
+        mirror(CURRENT_CASE)
 
 
 @command('comment')
@@ -1474,7 +1901,7 @@ def comment():
         editor.abort_if_empty(text)
         params = text.get_params_for_comment()
         CURRENT_CASE.edit(**params)
-        refresh()
+        mirror(CURRENT_CASE)
 
 
 @command('reply')
@@ -1505,7 +1932,34 @@ def reply(ixBugEvent=None):
         editor.abort_if_empty(text)
         params = text.get_params_for_comment()
         CURRENT_CASE.edit(**params)
-        refresh()
+        mirror(CURRENT_CASE)
+
+
+def _pop_flag(args, flag):
+    '''Remove flag from args.'''
+    args = list(args)
+    found = flag in args
+    if found:
+        args.remove(flag)
+    return found, args
+
+
+def _pop_local(args):
+    '''Remove --local flag from args.'''
+    return _pop_flag(args, '--local')
+
+
+def _pop_option(args, option, type_, default=None):
+    '''Remove --option=value from args.'''
+    args = list(args)
+    value = default
+    prefix = option + '='
+    for arg in args:
+        if arg.startswith(prefix):
+            value = type_(arg[len(prefix):])
+            args.remove(arg)
+            break
+    return value, args
 
 
 def _search(args, pred=None):
@@ -1513,16 +1967,31 @@ def _search(args, pred=None):
     def kwargs_to_q(kwargs):
         return ' '.join('{}:"{}"'.format(k, v) for k, v in kwargs.items())
 
+    local, args = _pop_local(args)
+    stream, args = _pop_flag(args, '--stream')
     q = ' '.join(args)
     if '=' in q:
         kwargs = _parse_kwargs(args)
         q = kwargs_to_q(kwargs)
-    rs = FBCaseSearch.search(q)
+    if local:
+        rs = FBCaseSearch.search_local(q)
+    elif stream:
+        return FBCaseSearch.search_stream(q, pred)
+    else:
+        rs = FBCaseSearch.search(q)
     if pred:
         rs.filter(pred)
     return rs
 
 
+def _print_search(rs):
+    if rs.streamed:
+        # Rows have already been printed
+        print('\n{} case(s) found.'.format(len(rs.shortcases)))
+    else:
+        print(rs)
+
+
 @command('search')
 def search(*args):
     '''Search for cases.
@@ -1540,10 +2009,17 @@ def search(*args):
 
     Using ':' syntax allows to have non-keyword arguments, too:
     >>> search assignedTo:me carmax
+
+    Use --local to search the local mirror (see `sync`):
+    >>> search --local project:devops carmax
+
+    Use --stream to print cases as soon as they arrive, unsorted, when
+    expecting many results:
+    >>> search --stream project:devops
     '''
 
     rs = _search(args)
-    print(rs)
+    _print_search(rs)
 
 
 @command('stale')
@@ -1552,6 +2028,8 @@ def stale(*args):
 
     Find active cases in project last updated 90 days ago:
     >>> stale 90 project:devops status:active
+
+    Also supports --local and --stream, like `search`.
     '''
 
     days, args = args[0], args[1:]
@@ -1561,7 +2039,41 @@ def stale(*args):
         return datetime.datetime.utcnow() - sc.last_updated > age
 
     rs = _search(args, is_stale)
-    print(rs)
+    _print_search(rs)
+
+
+@bulk_action('close')
+def _close_all():
+    return lambda case: case.close()
+
+
+@bulk_action('reactivate')
+def _reactivate_all():
+    return lambda case: case.reactivate()
+
+
+@bulk_action('resolve')
+def _resolve_all(*args):
+    params = {'sStatus': ' '.join(args)} if args else {}
+    return lambda case: case.resolve(**params)
+
+
+@bulk_action('reopen')
+def _reopen_all():
+    return lambda case: case.reopen()
+
+
+@bulk_action('duplicate')
+def _duplicate_all():
+    return lambda case: case.resolve(sStatus='Resolved (Duplicate)')
+
+
+@bulk_action('assign')
+def _assign_all(*args):
+    assert args, 'No assignee'
+    # Once, not per case
+    person = FBPerson.get_by_guess(' '.join(args))
+    return lambda case: case.assign(person)
 
 
 @command('apply')
@@ -1573,20 +2085,85 @@ def apply(*args):
     >>> apply close
 
     Note: interactivity is reduced to a minimum.
+
+    close, reactivate, resolve, reopen, duplicate and assign work on
+    many cases at once, without changing the current case: a case
+    failing does not stop the others, and a summary is printed at the
+    end. Use --jobs to set how many cases at once (default: fb --jobs)
+    and --rate to limit cases per second (default: fb --rate):
+    >>> apply --jobs=8 --rate=5 resolve Resolved (Won't Fix)
     '''
 
     if not LAST_SEARCH:
         print('No last search.')
         return
 
+    jobs, args = _pop_option(args, '--jobs', int, options.jobs)
+    rate, args = _pop_option(args, '--rate', float, options.rate)
+    assert args, 'No command'
     cmd, args = args[0], args[1:]
+    if cmd in BULK:
+        _apply_bulk(BULK[cmd](*args), jobs, rate)
+        return
+
+    cases = FBCase.get_many(sc.id for sc in LAST_SEARCH)
     for sc in LAST_SEARCH:
         with assume_answer('n'):
             print('to case {}'.format(sc.id))
-            FBCase.get_by_id_or_current(sc.id)
+            if sc.id not in cases:
+                print('Cannot find case {}'.format(sc.id))
+                continue
+            set_current_case(cases[sc.id])
             exec_(cmd, args)
 
 
+def _apply_bulk(action, jobs, rate):
+    ids = [sc.id for sc in LAST_SEARCH]
+    cases = FBCase.get_slim(ids)
+    results = {}
+    try:
+        for result in bulk.run(
+                cases.values(), action, jobs=jobs, rate=rate):
+            results[result.item.id] = result
+            sys.stderr.write('\r{}/{} case(s) done'.format(
+                len(results), len(cases)))
+            sys.stderr.flush()
+    finally:
+        # Interrupted, too
+        sys.stderr.write('\n')
+        _print_apply_summary(ids, cases, results)
+    # Slim cases cannot be mirrored: fetch the mirrored ones whole
+    mirrored = [
+        id_ for id_, result in results.items()
+        if result.error is None and id_ in STORE]
+    for case in FBCase.get_many(mirrored).values():
+        case.save_local()
+
+
+def _print_apply_summary(ids, cases, results):
+    row = '{:>8} {:>7} {:>10}  {}'
+    print()
+    print(ui.bold(row.format('Case', 'result', 'ms', 'title / error')))
+    nok = 0
+    for id_ in ids:
+        result = results.get(id_)
+        if id_ not in cases:
+            print(ui.red(row.format(
+                id_, 'missing', '', 'Cannot find case {}'.format(id_))))
+        elif result is None:
+            print(ui.red(row.format(id_, 'skipped', '', 'Interrupted')))
+        elif result.error is None:
+            nok += 1
+            print(row.format(
+                id_, 'ok', _ms(result.elapsed), cases[id_].title))
+        else:
+            print(ui.red(row.format(
+                id_, 'failed', _ms(result.elapsed),
+                str(result.error) or type(result.error).__name__)))
+    print()
+    print('{} ok, {} failed.'.format(nok, len(ids) - nok))
+
+
 @command('top')
 def top(n=None):
     '''Show the top n cases (default 10).'''
@@ -1674,7 +2251,7 @@ def areas(*args):
     >>> areas  # List all areas
     >>> areas devops  # List areas in devops project
     '''
-    result = FB.listAreas()
+    result = META.get('listAreas')
     areas = [FBArea(a) for a in result.findAll('area')]
     if len(args) > 0:
         project = args[0].lower()
@@ -1695,7 +2272,7 @@ def milestones(*args):
     >>> milestones brandindex
     '''
 
-    result = FB.listFixFors()
+    result = META.get('listFixFors')
     milestones = [FBMilestone(m) for m in result.findAll('fixfor')]
     if len(args) > 0:
         project = args[0].lower()
@@ -1724,6 +2301,108 @@ def people(*args):
     print()
 
 
+@command('cache')
+def cache_(*args):
+    '''Show or clear the local cache of people, projects, areas, etc.
+
+    Cached data is refreshed in the background once expired.
+
+    Example:
+    >>> cache  # show cached data
+    >>> cache clear  # clear everything
+    >>> cache clear listPeople  # clear people only
+    >>> cache refresh listAreas  # refresh areas now
+    '''
+    if not args:
+        entries = META.entries()
+        if not entries:
+            print('Cache is empty.')
+            return
+        print()
+        for cmd, age, size in entries:
+            print('{} {} {}'.format(
+                cmd.rjust(15),
+                ui.darkgray('{:.0f}s old'.format(age).rjust(12)),
+                '{} bytes'.format(size)))
+        print()
+        return
+
+    action, names = args[0], args[1:]
+    if action == 'clear':
+        for name in names or [None]:
+            META.clear(name)
+    elif action == 'refresh':
+        assert names, 'Nothing to refresh'
+        for name in names:
+            META.refresh(name)
+    else:
+        assert False, 'Unknown cache action {}'.format(action)
+    print('OK')
+
+
+def _ms(seconds):
+    return '{:.1f}'.format(seconds * 1000)
+
+
+@command('stats', needs_startup=False)
+def stats_(*args):
+    '''Show time spent talking to FogBugz in this session.
+
+    Shows latency, payload, retries and cache hits/misses of API
+    calls, and how much of each command's time is spent in API calls.
+    Run fb with --trace=<file> to log every call as a JSON line.
+
+    Example:
+    >>> stats
+    >>> stats search  # latency histogram of "search" calls
+    >>> stats reset
+    '''
+    if args and args[0] == 'reset':
+        STATS.reset()
+        print('OK')
+        return
+
+    if args:
+        name = args[0]
+        assert name in STATS.calls, 'No calls to {}'.format(name)
+        counts = STATS.calls[name].histogram()
+        labels = ['<={}ms'.format(b) for b in BUCKETS]
+        labels.append('>{}ms'.format(BUCKETS[-1]))
+        scale = 40.0 / max(max(counts), 1)
+        print()
+        for label, count in zip(labels, counts):
+            print('{} {} {}'.format(
+                label.rjust(10), str(count).rjust(5),
+                ui.cyan('#' * int(round(count * scale)))))
+        print()
+        return
+
+    row = '{:>24} {:>6} {:>10} {:>8} {:>8} {:>8} {:>10} {:>7} {:>9}'
+    print()
+    print(ui.bold(row.format(
+        'API call', 'count', 'total ms', 'mean', 'p50', 'p95', 'bytes',
+        'retries', 'hit/miss')))
+    for name, s in sorted(
+            STATS.calls.items(), key=lambda item: -item[1].total):
+        print(row.format(
+            name[:24], s.count, _ms(s.total), _ms(s.total / s.count),
+            _ms(s.percentile(0.5)), _ms(s.percentile(0.95)), s.nbytes,
+            s.retries, '{}/{}'.format(s.hits, s.misses)))
+    print()
+    row = '{:>24} {:>6} {:>10} {:>8} {:>10} {:>10}'
+    print(ui.bold(row.format(
+        'Command', 'count', 'total ms', 'mean', 'API calls', 'API ms')))
+    for name, s in sorted(
+            STATS.commands.items(), key=lambda item: -item[1].total):
+        if not s.count:
+            # Still running, e.g. "stats" itself
+            continue
+        print(row.format(
+            name[:24], s.count, _ms(s.total), _ms(s.total / s.count),
+            s.api_calls, _ms(s.api_time)))
+    print()
+
+
 @command('attachments')
 def attachments():
     '''List attachments in current case.
@@ -1749,12 +2428,30 @@ def attachment(attachment_id):
     >>> attachment 1234  # download and view attachment 1234
     '''
     assert_current()
-    for a in CURRENT_CASE.attachments:
-        if a.id == int(attachment_id):
-            a.view()
-            break
-    else:
-        assert False, 'Attachment not found in current case'
+    a = CURRENT_CASE.get_attachment(attachment_id)
+    assert a is not None, 'Attachment not found in current case'
+    a.view()
+
+
+@command('download_all')
+def download_all():
+    '''Download all attachments in current case, concurrently.
+
+    Downloads are kept in a local cache, reused by `attachment`.
+
+    Example:
+    >>> download_all
+    '''
+    assert_current()
+    jobs = {a.download_job: a for a in CURRENT_CASE.attachments}
+    if not jobs:
+        print('No attachments.')
+        return
+    for job, result in DOWNLOADS.fetch_many(jobs, FB.session):
+        if isinstance(result, Exception):
+            print(jobs[job], ui.red('Failed: {}'.format(result)))
+        else:
+            print(jobs[job], ui.darkgray(result))
 
 
 @command('links')
@@ -1851,7 +2548,7 @@ def edit(*args):
     assert_operation('edit')
     kwargs = _api_kwargs(args)
     CURRENT_CASE.edit(**kwargs)
-    refresh()
+    mirror(CURRENT_CASE)
 
 
 @command('raw')
@@ -1869,13 +2566,115 @@ def raw(*args):
     print(result.prettify())
 
 
-@command('history')
-def history():
-    '''Show the most recently viewed cases, most recent first.'''
-    print(FBShortCase.HISTORY)
+def _sync(q):
+    '''Mirror cases matching `q`, pulling only the ones updated.
+
+    Returns the number of cases updated and of cases pruned, i.e. no
+    longer matching any synced query.
+    '''
+    scs = [
+        FBShortCase.load(c) for c in search_cases(q, FBCaseSearch.COLS)]
+    local = STORE.last_updated(sc.id for sc in scs)
+    updated = [
+        sc.id for sc in scs
+        if sc.id not in local or sc.dtlastupdated > (local[sc.id] or '')
+    ]
+    for case in FBCase.get_many(updated).values():
+        case.save_local()
+    pruned = STORE.set_query_cases(q, [sc.id for sc in scs])
+    for ixbug in pruned:
+        INDEX.remove_case(ixbug)
+    return len(updated), len(pruned)
+
+
+@command('sync')
+def sync(*args):
+    '''Mirror cases locally, to be used with --local.
+
+    Only cases updated since the last sync are downloaded. Cases no
+    longer matching any synced query are removed.
+    Queries are read from the "sync" section in .fbrc, e.g.:
+
+        [sync]
+        queries =
+            assignedto:me
+            project:devops status:active
+
+    Example:
+    >>> sync  # sync queries in .fbrc
+    >>> sync project:devops  # sync a query
+    '''
+    if args:
+        queries = [' '.join(args)]
+    else:
+        cp = read_config()
+        queries = []
+        if cp.has_option('sync', 'queries'):
+            queries = list(filter(None, [
+                q.strip() for q in cp.get('sync', 'queries').splitlines()]))
+    assert queries, 'Nothing to sync: add queries to .fbrc'
+    for q in queries:
+        n, pruned = _sync(q)
+        print('{}: {} case(s) updated, {} removed'.format(q, n, pruned))
+    INDEX.save()
+
+
+# Max number of cases shown by grep
+GREP_LIMIT = 50
+
+
+@command('grep')
+def grep(*args):
+    '''Full-text search of titles and comments in the local mirror.
+
+    Cases must have been mirrored first, with `sync` or `show`.
+    Best matches first, with the matching events.
+
+    Example:
+    >>> grep timeout
+    >>> grep "connection reset" postgres
+    '''
+    assert args, 'Nothing to search'
+    found = INDEX.search(' '.join(args))
+    shown = found[:GREP_LIMIT]
+    rows = {
+        row['ixBug']: row
+        for row in STORE.search(ids=[r[0] for r in shown])
+    }
+    print()
+    for ixbug, _score, events in shown:
+        if ixbug in rows:
+            print(FBShortCase.from_row(rows[ixbug]))
+            events = [e for e in events if e]
+            if events:
+                print(' ' * 9 + ' '.join(ui.eventid(e) for e in events))
+    print()
+    if len(found) > len(shown):
+        print('{} case(s) found, best {} shown.'.format(
+            len(found), len(shown)))
+    else:
+        print('{} case(s) found.'.format(len(found)))
+
+
+@command('history', needs_startup=False)
+def history(*args):
+    '''Show the most recently viewed cases, most recent first.
 
+    Example:
+    >>> history  # cases viewed in this session
+    >>> history --local  # cases viewed in all sessions
+    '''
+    local, _args = _pop_local(args)
+    if not local:
+        print(FBShortCase.HISTORY)
+        return
+    print()
+    for row in STORE.recently_viewed():
+        print(FBShortCase.from_row(row))
+    print()
 
-@command('lastsearch')
+
+@command('lastsearch', needs_startup=False)
 def lastsearch():
     '''Show the last search.'''
     if LAST_SEARCH:
@@ -1965,7 +2764,7 @@ def amend(ixBugEvent=None):
         editor.abort_if_empty(text)
         params = text.get_params_for_amend()
         CURRENT_CASE.amend(event, **params)
-        refresh()
+        refresh(event.id)
 
 
 @command('favorites')
@@ -2030,7 +2829,7 @@ def ipython():
         IPython.embed()
 
 
-@command('quit')
+@command('quit', needs_startup=False)
 def quit_():
     '''Quit.
 
@@ -2049,6 +2848,18 @@ Type "help" to get started.
 ''')
 
 
+def read_config():
+    '''Read configuration from $HOME/.fbrc or the current directory.'''
+    cp = configparser.ConfigParser()
+    # Look in various places
+    cp.read([
+        '/etc/fbrc',
+        os.path.expanduser('~/.fbrc'),
+        os.getcwd(),
+    ])
+    return cp
+
+
 def create_aliases():
     '''Create command aliases.
 
@@ -2081,13 +2892,7 @@ def create_aliases():
     alias('unstar', 'unfavorite')
 
     # User-defined aliases
-    cp = configparser.ConfigParser()
-    # Look in various places
-    cp.read([
-        '/etc/fbrc',
-        os.path.expanduser('~/.fbrc'),
-        os.getcwd(),
-    ])
+    cp = read_config()
     if cp.has_section('aliases'):
         for name in cp.options('aliases'):
             cmdline = cp.get('aliases', name)
@@ -2098,9 +2903,47 @@ def create_aliases():
 create_aliases()
 
 
-def _warmup():
-    logger.debug('Loading people')
-    FBPerson.get_all()
+def _current_user():
+    # A single viewPerson: no need to wait for all people
+    email = FB.current_user
+    return set_current_user(
+        FBPerson.CACHE.by_email(email) or
+        FBPerson._get(sEmail=email))  # pylint: disable=protected-access
+
+
+# Metadata loaded at startup
+PRELOAD = ['listPeople', 'listStatuses', 'listProjects']
+
+
+def _preload():
+    # Missing responses are fetched together, by FB_ASYNC
+    people, statuses, _ = META.get_many(PRELOAD)
+    FBPerson.from_result(people)
+    FBStatus.from_result(statuses)
+
+
+def start_up():
+    '''Logon and load metadata in the background.
+
+    Metadata cached on disk is parsed while logging on: only fetching
+    it from FogBugz needs to wait for the logon.
+    '''
+    STARTUP.start('logon', FB.login)
+    STARTUP.start('user', _current_user, after=['logon'])
+    STARTUP.start(
+        'metadata', _preload,
+        after=['logon'] if any(META.is_stale(cmd) for cmd in PRELOAD)
+        else [])
+
+
+def print_startup_timings():
+    row = '{:>14} {:>10} {:>10}  {}'
+    print()
+    print(ui.bold(row.format('Startup', 'start ms', 'ms', 'error')))
+    for name, start, elapsed, error in STARTUP.timings():
+        print(row.format(
+            name, _ms(start), _ms(elapsed), '' if error is None else error))
+    print()
 
 
 def read_():
@@ -2121,18 +2964,33 @@ def assert_operation(op):
     CURRENT_CASE.assert_operation(op)
 
 
-def exec_(cmd, args):
-
+def _wait_for_startup(cmd):
     if cmd.isdigit():
-        show(cmd)
-
+        f = COMMANDS['show']
     elif cmd in ALIASES:
-        ALIASES[cmd](*args)
-
+        f = ALIASES[cmd].cmd
     else:
         f = COMMANDS.get(cmd)
-        assert f is not None, 'Unknown command {}'.format(cmd)
-        return f(*args)
+    if f is not None and f.needs_startup:
+        STARTUP.wait()
+
+
+def exec_(cmd, args):
+
+    with STATS.command('show' if cmd.isdigit() else cmd):
+
+        _wait_for_startup(cmd)
+
+        if cmd.isdigit():
+            show(cmd)
+
+        elif cmd in ALIASES:
+            ALIASES[cmd](*args)
+
+        else:
+            f = COMMANDS.get(cmd)
+            assert f is not None, 'Unknown command {}'.format(cmd)
+            return f(*args)
 
 
 def _format_exception(exc):
@@ -2159,9 +3017,17 @@ def exec_ctx():
 def main():
     ui.init_readline()
     args = parse_command_line()
-
-    logon()
-    _warmup()
+    if options.trace:
+        STATS.trace_to(options.trace)
+    ui.set_color(options.color)
+    ui.setup_win()
+    FB.gzip_uploads = options.gzip_uploads
+
+    start_up()
+    if options.startup_timings:
+        with exec_ctx():
+            STARTUP.wait()
+        print_startup_timings()
     welcome()
 
     if args:
@@ -2176,7 +3042,9 @@ def main():
                     continue
                 exec_(cmd, args)
     finally:
-        logoff()
+        INDEX.save()
+        if STARTUP.succeeded('logon'):
+            logoff()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+'''Readline completion, with candidates indexed per context.
+
+Readline asks for completions one `state` at a time: matches are
+computed once, for state 0, and then only read. Candidates of a context
+(e.g. people, for "assign") are lower-cased once and kept until the
+context changes. As the typed text grows, matches are searched among
+the previous matches only.
+'''
+
+from collections import OrderedDict
+
+
+def is_subsequence(query, s):
+    '''True if all chars of `query` are in `s`, in order.'''
+    pos = 0
+    for c in query:
+        pos = s.find(c, pos) + 1
+        if not pos:
+            return False
+    return True
+
+
+def rank(query, lower):
+    '''Sort key: prefixes first, then substrings, then subsequences.'''
+    idx = lower.find(query)
+    if idx == 0:
+        return (0, 0, len(lower))
+    if idx > 0:
+        return (1, idx, len(lower))
+    return (2, 0, len(lower))
+
+
+class Candidates(object):
+    '''Candidates of a context, lower-cased once.'''
+
+    def __init__(self, key, options):
+        # What the options were computed from
+        self.key = key
+        self.options = [
+            (option.lower(), option)
+            for option in OrderedDict.fromkeys(options)]
+
+
+class Completer(object):
+    '''Complete text, in contexts.
+
+    `contexts` maps a context name to a function returning a key and a
+    function computing the candidates: candidates are computed again
+    only if the key changes.
+    '''
+
+    def __init__(self, contexts):
+        self.contexts = contexts
+        self._candidates = {}
+        # (context, key, query, matches) of the last search
+        self._last = None
+        self._matches = []
+
+    def invalidate(self):
+        self._candidates.clear()
+        self._last = None
+
+    def candidates(self, context):
+        key, options = self.contexts[context]()
+        candidates = self._candidates.get(context)
+        if candidates is None or candidates.key != key:
+            candidates = Candidates(key, options())
+            self._candidates[context] = candidates
+        return candidates
+
+    def complete(self, context, text):
+        '''All options matching `text`, best first.'''
+        candidates = self.candidates(context)
+        query = text.lower()
+        pool = candidates.options
+        if self._last is not None:
+            last_context, last_key, last_query, last_matches = self._last
+            if (last_context == context and last_key == candidates.key and
+                    query.startswith(last_query)):
+                # Narrow: matches can only be among the previous ones
+                pool = last_matches
+        matches = [
+            (lower, option) for lower, option in pool
+            if query in lower or is_subsequence(query, lower)]
+        self._last = (context, candidates.key, query, matches)
+        return [
+            option for lower, option in sorted(
+                matches, key=lambda m: rank(query, m[0]))]
+
+    def __call__(self, context, text, state):
+        '''Readline interface: the match number `state`, or None.'''
+        if state == 0:
+            self._matches = self.complete(context, text)
+        try:
+            return self._matches[state]
+        except IndexError:
+            return None
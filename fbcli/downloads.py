@@ -0,0 +1,186 @@
+'''On-disk cache of downloaded attachments.
+
+Attachments are streamed to ~/.cache/fbcli/<host>/<user>/attachments/, in
+chunks, and kept across sessions. Interrupted downloads resume with an
+HTTP Range request. Once the cache is bigger than its cap, the least
+recently used files are removed.
+'''
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+
+from fbcli.cache import host_dir
+
+
+# Max size of the cache, in bytes
+MAX_BYTES = int(os.environ.get('FBDOWNLOADCACHE', 1024)) * 1024 * 1024
+
+# Seconds to wait for the server to connect or send data
+TIMEOUT = float(os.environ.get('FBDOWNLOADTIMEOUT', 60))
+
+CHUNK_SIZE = 256 * 1024
+
+# Max number of concurrent downloads
+MAX_WORKERS = 4
+
+PART = '.part'
+
+
+class Progress(object):
+    '''Print progress of a download on one line, at most every `every`s.'''
+
+    def __init__(self, name, stream=None, every=0.2):
+        self.name = name
+        self.stream = stream or sys.stderr
+        self.every = every
+        self._last = 0
+
+    def __call__(self, done, total, final=False):
+        now = time.time()
+        if not final and now - self._last < self.every:
+            return
+        self._last = now
+        if total:
+            msg = '{} {:.1f}/{:.1f} MB ({:.0%})'.format(
+                self.name, done / 1e6, total / 1e6, done / total)
+        else:
+            msg = '{} {:.1f} MB'.format(self.name, done / 1e6)
+        self.stream.write('\r' + msg + ('\n' if final else ''))
+        self.stream.flush()
+
+
+class DownloadCache(object):
+
+    logger = logging.getLogger('fb.downloads')
+
+    def __init__(self, client, max_bytes=None, root=None):
+        self._client = client
+        self._max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+        self._root = root
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(host_dir(self._client, self._root), 'attachments')
+
+    def fname(self, key, filename):
+        '''Where to keep the file named `filename`, with unique `key`.'''
+        digest = hashlib.sha1(str(key).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.path, '{}_{}'.format(digest, filename))
+
+    def get(self, key, filename):
+        '''Path of the cached file, or None.'''
+        fname = self.fname(key, filename)
+        if not os.path.exists(fname):
+            return None
+        # Recently used
+        os.utime(fname, None)
+        return fname
+
+    def fetch(self, key, filename, url, session, progress=None):
+        '''Path of the file at `url`, downloading it if not cached.'''
+        fname = self.get(key, filename)
+        if fname is not None:
+            return fname
+        fname = self.fname(key, filename)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, exist_ok=True)
+        download(session, url, fname, progress=progress)
+        self.evict(keep=fname)
+        return fname
+
+    def fetch_many(self, jobs, session, max_workers=None):
+        '''Fetch (key, filename, url) jobs concurrently.
+
+        Yields (job, path or exception) as downloads complete.
+        '''
+        with ThreadPoolExecutor(max_workers or MAX_WORKERS) as pool:
+            futures = {
+                pool.submit(self.fetch, *job, session=session): job
+                for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as exc:  # pylint: disable=broad-except
+                    yield futures[future], exc
+
+    def entries(self):
+        '''List (path, size, last used) of cached files, oldest first.
+
+        Partial downloads are not listed.
+        '''
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        for fname in os.listdir(self.path):
+            if fname.endswith(PART):
+                continue
+            path = os.path.join(self.path, fname)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Evicted meanwhile
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda e: e[2])
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        '''Remove least recently used files, down to the size cap.'''
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self._max_bytes:
+                    break
+                if path == keep:
+                    continue
+                self.logger.debug('Evicting %s', path)
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+
+def download(session, url, fname, progress=None, chunk_size=None):
+    '''Stream `url` to `fname`, resuming a previous partial download.'''
+    part = fname + PART
+    done = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {'Range': 'bytes={}-'.format(done)} if done else {}
+    r = session.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+    try:
+        if r.status_code == 416:
+            # Nothing left to download
+            os.rename(part, fname)
+            return fname
+        r.raise_for_status()
+        if r.status_code != 206:
+            # Range not supported: start over
+            done = 0
+        total = int(r.headers.get('Content-Length', 0)) or None
+        if total is not None:
+            total += done
+        with open(part, 'ab' if done else 'wb') as fid:
+            for chunk in r.iter_content(chunk_size or CHUNK_SIZE):
+                fid.write(chunk)
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, total)
+    finally:
+        r.close()
+    if progress is not None:
+        progress(done, total, final=True)
+    os.rename(part, fname)
+    return fname
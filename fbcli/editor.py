@@ -156,12 +156,14 @@ class Text:
 
     @property
     def files(self):
+        '''{name: path} of files to upload: they are read when sent.'''
         fs = OrderedDict()
         for fname_ in self.meta.get('Files', []):
             # Handle paths like ~/README.txt
             fname = os.path.expanduser(fname_)
+            assert os.path.isfile(fname), 'No such file {}'.format(fname_)
             bname = _encode_for_upload(os.path.basename(fname))
-            fs[bname] = open(fname, 'rb')
+            fs[bname] = fname
         return fs
 
     def is_empty(self):
@@ -1,22 +1,53 @@
 from copy import deepcopy
+import atexit
 from functools import wraps
 import getpass
 import json
 import logging
 import os
 import importlib
+import io
+import threading
 
 import requests
+from requests.adapters import HTTPAdapter
+import six
 from six.moves import input  # pylint: disable=redefined-builtin
+from six.moves.urllib.error import URLError
 from six.moves.urllib_parse import urljoin
 
+from bs4 import BeautifulSoup
+from lxml import etree
+from six.moves.urllib_parse import urlencode
+from tornado import gen, locks
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.ioloop import IOLoop
 import fogbugz
 
+from fbcli import cassette
+from fbcli import upload
+from fbcli.downloads import Progress
+from fbcli.stats import STATS
+
 
 RETRY_ON_EXCS = (
     fogbugz.FogBugzLogonError,
 )
 
+# Connection pool tuning: number of hosts to keep pools for (FogBugz
+# and Kiln) and max number of keep-alive connections per host.
+POOL_CONNECTIONS = int(os.environ.get('FBPOOLHOSTS', 4))
+POOL_MAXSIZE = int(os.environ.get('FBPOOLSIZE', 10))
+
+# Max number of requests AsyncFBClient keeps in flight at once
+MAX_CONCURRENCY = int(os.environ.get('FBCONCURRENCY', 8))
+
+# Bytes read at a time from streamed responses
+CHUNK_SIZE = 64 * 1024
+
+# Record all traffic to this cassette file, for `fbcli.standin`
+RECORD_TO = os.environ.get('FBRECORD')
+
 
 def from_env_or_ask(k, question, is_password=False):
     what = os.environ.get(k)
@@ -28,12 +59,92 @@ def from_env_or_ask(k, question, is_password=False):
     return input(question)
 
 
+def xml_error(code, msg):
+    '''The exception fogbugz.FogBugz raises for an <error>.'''
+    if code == '3':
+        return fogbugz.FogBugzLogonError(msg)
+    return fogbugz.FogBugzAPIError('Error Code {}: {}'.format(code, msg))
+
+
+def instrumented(f):
+    '''Record latency and payload of calls to `f`.'''
+
+    @wraps(f)
+    def helper(*args, **kwargs):
+        with STATS.timed(f.__name__):
+            return f(*args, **kwargs)
+
+    return helper
+
+
+def _count_bytes(r, *_args, **kwargs):
+    # Do not consume streamed responses
+    if kwargs.get('stream'):
+        STATS.add_bytes(int(r.headers.get('Content-Length', 0)))
+    else:
+        STATS.add_bytes(len(r.content))
+
+
+def pooled_session(pool_connections=None, pool_maxsize=None):
+    '''Create a keep-alive session with a bounded pool per host.
+
+    Connections (and their TLS sessions) are reused across calls, so
+    the handshake is paid once per connection, not once per request.
+    `pool_block` makes callers wait for a free connection instead of
+    opening more than `pool_maxsize` connections to the same host.
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections or POOL_CONNECTIONS,
+        pool_maxsize=pool_maxsize or POOL_MAXSIZE,
+        pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.hooks['response'].append(_count_bytes)
+    return session
+
+
+class PooledOpener(object):
+    '''Stand-in for the urllib opener used by `fogbugz.FogBugz`.
+
+    Routes the XML API calls through a shared `requests.Session`.
+    '''
+
+    def __init__(self, session):
+        self._session = session
+
+    def open(self, fullurl, data=None, timeout=None):
+        if isinstance(fullurl, six.string_types):
+            method, url, headers = 'POST' if data else 'GET', fullurl, {}
+        else:
+            # urllib.request.Request
+            method = fullurl.get_method()
+            url = fullurl.get_full_url()
+            headers = dict(fullurl.header_items())
+            data = fullurl.data
+        try:
+            r = self._session.request(
+                method, url, data=data, headers=headers, timeout=timeout)
+            r.raise_for_status()
+        except requests.RequestException as exc:
+            # fogbugz.FogBugz only knows about urllib errors
+            raise URLError(exc)
+        return io.BytesIO(r.content)
+
+
 class FBClient(object):
 
     logger = logging.getLogger('fb.client')
 
-    def __init__(self):
+    def __init__(self, pool_connections=None, pool_maxsize=None):
         self.__fb = None
+        self.__session = None
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        # Gzip text files on upload
+        self.gzip_uploads = False
+        # Logons may come from many threads, e.g. at startup
+        self._login_lock = threading.Lock()
 
         self._fburl = from_env_or_ask('FBURL', 'Fogbugz URL: ')
         self._fbuser = from_env_or_ask('FBUSER', 'Username: ')
@@ -60,6 +171,25 @@ class FBClient(object):
             return
         return keyring.get_password(self._fburl, self._fbuser)
 
+    @property
+    def session(self):
+        '''HTTP session shared by all calls to FogBugz.'''
+        # Created lazily, like the connection
+        if self.__session is None:
+            self.__session = pooled_session(
+                self._pool_connections, self._pool_maxsize)
+            if RECORD_TO:
+                self._record(self.__session, RECORD_TO)
+        return self.__session
+
+    def _record(self, session, fname):
+        self.logger.info('Recording to %s', fname)
+        recorder = cassette.Recorder(
+            cassette.Cassette.load(fname) if os.path.exists(fname)
+            else cassette.Cassette(), fname)
+        session.hooks['response'].append(recorder)
+        atexit.register(recorder.save)
+
     @property
     def _fb(self):
         # Get connection lazily, to simplify testing
@@ -68,6 +198,9 @@ class FBClient(object):
                 self.__fb = fogbugz.FogBugz(self._fburl, self._fbtoken)
             else:
                 self.__fb = fogbugz.FogBugz(self._fburl)
+            # Use the shared pool for all the XML API calls, too
+            # pylint: disable=protected-access
+            self.__fb._opener = PooledOpener(self.session)
         return self.__fb
 
     def retrying(self, f):
@@ -78,14 +211,48 @@ class FBClient(object):
                 return f(*args, **kwargs)
             except RETRY_ON_EXCS as exc:
                 self.logger.warning('Retrying: %s', exc)
+                STATS.add_retry()
                 self.login()
                 return helper(*args, **kwargs)
 
         return helper
 
     def __getattr__(self, k):
+        if k.startswith('_'):
+            # Not an API method, e.g. probed by mock: do not connect
+            raise AttributeError(k)
         self.logger.debug(k)
-        return self.retrying(getattr(self._fb, k))
+        f = self.retrying(getattr(self._fb, k))
+
+        @wraps(f)
+        def helper(*args, **kwargs):
+            with STATS.timed(k):
+                if kwargs.get('Files'):
+                    # Do not let fogbugz read the files in memory
+                    files = kwargs.pop('Files')
+                    return self.retrying(self._upload)(k, files, kwargs)
+                return f(*args, **kwargs)
+
+        return helper
+
+    def _upload(self, cmd, files, params):
+        '''Call `cmd`, streaming `files` ({name: path}) to FogBugz.'''
+        self.logger.debug('%s (uploading %d files)', cmd, len(files))
+        uploads = [
+            upload.Upload(name, path, compress=self.gzip_uploads)
+            for name, path in files.items()]
+        body = upload.MultipartBody(
+            dict(params, cmd=cmd, token=self.api_token), uploads,
+            progress=Progress)
+        r = self.session.post(self.api_url, data=body, headers={
+            'Content-Type': body.content_type,
+        })
+        r.raise_for_status()
+        response = BeautifulSoup(r.content, 'xml').response
+        if response.error:
+            raise xml_error(
+                response.error.get('code'), response.error.get_text())
+        return response
 
     @property
     def current_user(self):
@@ -95,10 +262,24 @@ class FBClient(object):
     def current_token(self):
         return self._fb._token  # pylint: disable=protected-access
 
+    @property
+    def api_token(self):
+        '''The token, as a string.'''
+        token = self.current_token
+        if isinstance(token, bytes):
+            token = token.decode('utf-8')
+        return token
+
+    @property
+    def api_url(self):
+        '''URL of the XML API endpoint, as advertised by api.xml.'''
+        return self._fb._url  # pylint: disable=protected-access
+
     def login(self):
         if not self.uses_token:
             self.logger.debug('Logging in')
-            self._fb.logon(self._fbuser, self._fbpass)
+            with self._login_lock:
+                self._fb.logon(self._fbuser, self._fbpass)
         else:
             self.logger.debug('Not logging in: using token')
 
@@ -116,15 +297,17 @@ class FBClient(object):
         return urljoin(
             self._fburl, path + '?token={}'.format(self.current_token))
 
+    @instrumented
     def checkins(self, ixbug):
         '''The API does not provide a call for this.'''
         kilnhg_url = self._fburl.replace('.fogbugz.', '.kilnhg.')
         base_url = urljoin(kilnhg_url, '/fogbugz/casecheckins/{}?token={}')
         url = base_url.format(ixbug, self.current_token)
-        r = requests.get(url)
+        r = self.session.get(url)
         r.raise_for_status()
         return r.json()
 
+    @instrumented
     def notify(self, ixbug, ixbugeventlatest, ixPersons):
         path = '/f/api/0/cases/{}'.format(ixbug)
         url = self.full_url_with_token(path)
@@ -137,12 +320,13 @@ class FBClient(object):
         }
 
         payload = json.dumps(params)
-        r = requests.post(url, data=payload, headers={
+        r = self.session.post(url, data=payload, headers={
             'Content-Type': 'application/json',
         })
         r.raise_for_status()
         return r.json()
 
+    @instrumented
     def _http_get_case(self, session, ixbug):
         '''Get case from HTTP API.'''
         path = '/f/api/0/cases/{}'.format(ixbug)
@@ -151,6 +335,7 @@ class FBClient(object):
         r.raise_for_status()
         return r
 
+    @instrumented
     def _http_get_event(self, session, ixbugevent):
         '''Get event from HTTP API.'''
         path = '/f/api/0/caseevents/{}'.format(ixbugevent)
@@ -159,8 +344,14 @@ class FBClient(object):
         r.raise_for_status()
         return r
 
+    def get_event(self, ixbugevent):
+        '''Get event from HTTP API, as a dict.'''
+        r = self._http_get_event(self.session, ixbugevent)
+        return r.json()['data']['event']
+
+    @instrumented
     def amend(self, ixbug, ixbugevent, params):
-        session = requests.Session()
+        session = self.session
 
         # Get the edit history of this case
         r = self._http_get_case(session, ixbug)
@@ -208,8 +399,9 @@ class FBClient(object):
             return False
 
     # TODO not working
+    @instrumented
     def duplicate(self, ixbug, ixdup):
-        session = requests.Session()
+        session = self.session
 
         # Get the edit history of this case
         r = self._http_get_case(session, ixbug)
@@ -275,14 +467,16 @@ class FBClient(object):
             msg = '\n'.join(e['message'] for e in data['errors'])
             raise ValueError(msg)
 
+    @instrumented
     def favorites(self):
         '''Get favorite cases.'''
         path = '/f/api/0/favorites/'
         url = self.full_url_with_token(path)
-        r = requests.get(url, params={'json': '{}'})
+        r = self.session.get(url, params={'json': '{}'})
         self._raise_on_error(r)
         return r.json()
 
+    @instrumented
     def _favorite(self, action, ixbug, category):
         # I am not sure what sType is supposed to be
         stype_map = {
@@ -297,7 +491,7 @@ class FBClient(object):
             'ixItem': ixbug,
             'sType': stype,
         })
-        f = getattr(requests, action)
+        f = getattr(self.session, action)
         r = f(url, data=payload, headers={
             'Content-Type': 'application/json',
         })
@@ -311,3 +505,248 @@ class FBClient(object):
     def unfavorite(self, ixbug, category):
         '''Unfavorite a case.'''
         self._favorite('delete', ixbug, category)
+
+    def json_api(self, cmd, **kwargs):
+        '''Call `cmd` through the JSON API, returning its "data".
+
+        Errors are raised as the XML API would: on logon errors, the
+        call is retried after logging in again.
+        '''
+        self.logger.debug('%s (json)', cmd)
+        with STATS.timed(cmd):
+            return self.retrying(self._json_api)(cmd, kwargs)
+
+    def _json_api(self, cmd, params):
+        url = self.full_url('/f/api/0/jsonapi')
+        payload = json.dumps(dict(params, cmd=cmd, token=self.api_token))
+        r = self.session.post(url, data=payload, headers={
+            'Content-Type': 'application/json',
+        })
+        try:
+            data = r.json()
+        except ValueError:
+            r.raise_for_status()
+            raise
+        for error in data.get('errors') or []:
+            raise xml_error(str(error.get('code')), error.get('message'))
+        r.raise_for_status()
+        return data['data']
+
+    def iter_response(self, cmd, tag, chunk_size=None, **kwargs):
+        '''Call `cmd`, yielding `tag` elements as the response arrives.
+
+        Elements are lxml elements, cleared once the caller is done
+        with them: memory stays flat however big the response is.
+        '''
+        # Spans many yields: can't use STATS.timed
+        call = STATS.start(cmd)
+        try:
+            yield from self._iter_response(
+                call, cmd, tag, chunk_size or CHUNK_SIZE, True, kwargs)
+        except Exception as exc:
+            call.error = type(exc).__name__
+            raise
+        finally:
+            STATS.finish(call)
+
+    def _iter_response(self, call, cmd, tag, chunk_size, retry, params):
+        self.logger.debug('%s (streaming)', cmd)
+        r = self.session.post(
+            self.api_url, data=dict(params, cmd=cmd, token=self.api_token),
+            stream=True)
+        try:
+            r.raise_for_status()
+            parser = etree.XMLPullParser(events=('end',), tag=(tag, 'error'))
+            for chunk in r.iter_content(chunk_size):
+                call.nbytes += len(chunk)
+                parser.feed(chunk)
+                yield from self._read_events(parser)
+            parser.close()
+            yield from self._read_events(parser)
+        except RETRY_ON_EXCS as exc:
+            # Errors come before any element
+            if not retry:
+                raise
+            self.logger.warning('Retrying: %s', exc)
+            call.retries += 1
+            self.login()
+            yield from self._iter_response(
+                call, cmd, tag, chunk_size, False, params)
+        finally:
+            r.close()
+
+    @staticmethod
+    def _read_events(parser):
+        for _, el in parser.read_events():
+            if el.tag == 'error':
+                raise xml_error(el.get('code'), el.text)
+            yield el
+            # Drop the element and the ones before it
+            el.clear()
+            while el.getprevious() is not None:
+                del el.getparent()[0]
+
+
+class AsyncFBClient(object):
+    '''Asynchronous twin of `FBClient`, built on tornado.
+
+    Shares URL and credentials with a `FBClient`: XML API methods
+    (`search`, `edit`, `listPeople`, ...) and JSON endpoints are
+    coroutines. At most `max_concurrency` requests are in flight at
+    any time, so callers can fan out freely.
+
+    Each `run` has its own IOLoop, HTTP client and semaphore: runs can
+    happen in any thread, e.g. in background refreshes.
+
+    Example:
+        afb = AsyncFBClient(FB)
+        people, statuses = afb.run_all([
+            ('listPeople', {}), ('listStatuses', {})])
+    '''
+
+    logger = logging.getLogger('fb.async')
+
+    def __init__(self, client, max_concurrency=None):
+        self._client = client
+        self._max_concurrency = max_concurrency or MAX_CONCURRENCY
+        # HTTP client and semaphore of the run in progress, per thread
+        self._local = threading.local()
+
+    @property
+    def _http(self):
+        return self._local.http
+
+    @property
+    def _semaphore(self):
+        return self._local.semaphore
+
+    @property
+    def _token(self):
+        token = self._client.current_token
+        if isinstance(token, bytes):
+            token = token.decode('utf-8')
+        return token
+
+    async def _fetch(
+            self, call, url, method='GET', body=None, headers=None):
+        async with self._semaphore:
+            request = HTTPRequest(
+                url, method=method, body=body, headers=headers)
+            resp = await self._http.fetch(request, raise_error=False)
+            call.nbytes += len(resp.body or b'')
+            return resp
+
+    async def _call(self, cmd, **kwargs):
+        # Calls run concurrently: they can't use STATS.timed
+        call = STATS.start(cmd)
+        try:
+            return await self.__call(call, cmd, **kwargs)
+        except Exception as exc:
+            call.error = type(exc).__name__
+            raise
+        finally:
+            STATS.finish(call)
+
+    async def __call(self, call, cmd, retry=True, **kwargs):
+        self.logger.debug(cmd)
+        params = dict(kwargs, cmd=cmd, token=self._token)
+        resp = await self._fetch(
+            call, self._client.api_url, 'POST', urlencode(params), {
+                'Content-Type': 'application/x-www-form-urlencoded',
+            })
+        resp.rethrow()
+        response = BeautifulSoup(resp.body, 'xml').response
+        try:
+            self._raise_on_xml_error(response)
+        except RETRY_ON_EXCS as exc:
+            if not retry:
+                raise
+            self.logger.warning('Retrying: %s', exc)
+            call.retries += 1
+            self._client.login()
+            return await self.__call(call, cmd, retry=False, **kwargs)
+        return response
+
+    @staticmethod
+    def _raise_on_xml_error(response):
+        # Same checks as fogbugz.FogBugz
+        if response.error:
+            raise xml_error(response.error['code'], response.error.string)
+
+    def __getattr__(self, k):
+        if k.startswith('_'):
+            raise AttributeError(k)
+
+        async def helper(**kwargs):
+            return await self._call(k, **kwargs)
+
+        return helper
+
+    async def _json(self, path, method='GET', params=None, query=None):
+        url = self._client.full_url_with_token(path)
+        if query:
+            url += '&' + urlencode(query)
+        body, headers = None, None
+        if params is not None:
+            body = json.dumps(params)
+            headers = {'Content-Type': 'application/json'}
+        call = STATS.start(path)
+        try:
+            resp = await self._fetch(call, url, method, body, headers)
+        finally:
+            STATS.finish(call)
+        data = json.loads(resp.body.decode('utf-8')) if resp.body else {}
+        if resp.code >= 400:
+            msg = '\n'.join(e['message'] for e in data.get('errors', []))
+            raise ValueError(msg or 'HTTP {}'.format(resp.code))
+        return data
+
+    async def case(self, ixbug):
+        '''Get case from JSON API.'''
+        return await self._json('/f/api/0/cases/{}'.format(ixbug))
+
+    async def caseevent(self, ixbugevent):
+        '''Get event from JSON API.'''
+        return await self._json('/f/api/0/caseevents/{}'.format(ixbugevent))
+
+    async def favorites(self):
+        '''Get favorite cases.'''
+        return await self._json('/f/api/0/favorites/', query={'json': '{}'})
+
+    async def notify(self, ixbug, ixbugeventlatest, ixPersons):
+        return await self._json('/f/api/0/cases/{}'.format(ixbug), 'POST', {
+            'sCommand': 'edit',
+            'sFormat': 'plain',
+            'ixBug': ixbug,
+            'rgixNotify': ixPersons,
+            'ixBugEventLatest': ixbugeventlatest,
+        })
+
+    @staticmethod
+    async def gather(*aws):
+        '''Wait for all awaitables, returning results in order.'''
+        return await gen.multi(list(aws))
+
+    def run(self, f, *args, **kwargs):
+        '''Run coroutine function `f` to completion from blocking code.'''
+        loop = IOLoop(make_current=False)
+        try:
+            return loop.run_sync(lambda: self._run(f, *args, **kwargs))
+        finally:
+            loop.close()
+
+    async def _run(self, f, *args, **kwargs):
+        # Bound to the loop of this run
+        self._local.http = AsyncHTTPClient(
+            force_instance=True, max_clients=self._max_concurrency)
+        self._local.semaphore = locks.Semaphore(self._max_concurrency)
+        try:
+            return await f(*args, **kwargs)
+        finally:
+            self._local.http.close()
+            self._local.http = self._local.semaphore = None
+
+    def run_all(self, calls):
+        '''Run XML API `calls`, a list of (cmd, kwargs), concurrently.'''
+        return self.run(self.gather, *[
+            self._call(cmd, **kwargs) for cmd, kwargs in calls])
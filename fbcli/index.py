@@ -0,0 +1,215 @@
+'''Inverted full-text index over case titles and event comments.
+
+Documents are (ixBug, ixBugEvent) pairs, with ixBugEvent == 0 for the
+case title. Each token maps to a posting list {doc: [positions]}, so
+that phrases can be matched, too. Results are ranked with BM25 and
+grouped by case.
+'''
+
+from collections import defaultdict
+import logging
+import math
+import os
+import pickle
+import re
+import shlex
+import threading
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Titles are short and to the point: weigh them more than comments
+TITLE_BOOST = 2.0
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    return [t.lower() for t in TOKEN_RE.findall(text)]
+
+
+def parse_query(q):
+    '''Split query into words and phrases (quoted), as token lists.'''
+    try:
+        terms = shlex.split(q)
+    except ValueError:
+        # Unbalanced quotes
+        terms = q.split()
+    return [tokens for tokens in map(tokenize, terms) if tokens]
+
+
+class Index(object):
+
+    VERSION = 1
+
+    logger = logging.getLogger('fb.index')
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.RLock()
+        self._loaded = False
+        self.dirty = False
+        # token -> {doc: [positions]}
+        self._postings = defaultdict(dict)
+        # doc -> (length, tokens)
+        self._docs = {}
+        # ixBug -> [docs]
+        self._cases = {}
+        self._total_length = 0
+
+    def __len__(self):
+        self._load()
+        return len(self._docs)
+
+    def __contains__(self, ixbug):
+        self._load()
+        return ixbug in self._cases
+
+    def add_case(self, ixbug, title, comments):
+        '''(Re)index case `ixbug`.
+
+        `comments` is a list of (ixBugEvent, text).
+        '''
+        self._load()
+        with self._lock:
+            self._remove_case(ixbug)
+            docs = [(0, title)] + list(comments)
+            self._cases[ixbug] = []
+            for ixbugevent, text in docs:
+                self._add_doc((ixbug, ixbugevent), text)
+            self.dirty = True
+
+    def remove_case(self, ixbug):
+        self._load()
+        with self._lock:
+            self._remove_case(ixbug)
+            self.dirty = True
+
+    def _add_doc(self, doc, text):
+        tokens = tokenize(text or '')
+        if not tokens:
+            return
+        positions = defaultdict(list)
+        for pos, token in enumerate(tokens):
+            positions[token].append(pos)
+        for token, poss in positions.items():
+            self._postings[token][doc] = poss
+        self._docs[doc] = (len(tokens), tuple(positions))
+        self._cases[doc[0]].append(doc)
+        self._total_length += len(tokens)
+
+    def _remove_case(self, ixbug):
+        for doc in self._cases.pop(ixbug, []):
+            length, tokens = self._docs.pop(doc)
+            self._total_length -= length
+            for token in tokens:
+                postings = self._postings[token]
+                postings.pop(doc, None)
+                if not postings:
+                    del self._postings[token]
+
+    def search(self, q, limit=None):
+        '''Find cases matching all words and phrases in `q`.
+
+        Returns a list of (ixBug, score, [ixBugEvent]), best first.
+        ixBugEvent is 0 if the title matches.
+        '''
+        self._load()
+        terms = parse_query(q)
+        if not terms:
+            return []
+
+        with self._lock:
+            # Match each term (word or phrase) to a {doc: tf} map
+            matches = [self._match(tokens) for tokens in terms]
+            if not all(matches):
+                return []
+
+            # All terms must appear in the case, not in the same doc
+            cases = set.intersection(*[
+                {doc[0] for doc in match} for match in matches])
+
+            ndocs = len(self._docs)
+            avglen = float(self._total_length) / max(ndocs, 1)
+            scores = defaultdict(float)
+            events = defaultdict(set)
+            for match in matches:
+                idf = math.log(1 + (ndocs - len(match) + 0.5) /
+                               (len(match) + 0.5))
+                for doc, tf in match.items():
+                    if doc[0] not in cases:
+                        continue
+                    length = self._docs[doc][0]
+                    score = idf * tf * (K1 + 1) / (
+                        tf + K1 * (1 - B + B * length / avglen))
+                    if doc[1] == 0:
+                        score *= TITLE_BOOST
+                    scores[doc[0]] += score
+                    events[doc[0]].add(doc[1])
+
+        results = sorted(
+            ((ixbug, score, sorted(events[ixbug]))
+             for ixbug, score in scores.items()),
+            key=lambda r: (-r[1], -r[0]))
+        return results[:limit] if limit else results
+
+    def _match(self, tokens):
+        '''Map docs containing `tokens`, in sequence, to frequency.'''
+        postings = [self._postings.get(token, {}) for token in tokens]
+        if not all(postings):
+            return {}
+        if len(tokens) == 1:
+            return {doc: len(poss) for doc, poss in postings[0].items()}
+
+        # Phrase: docs with all tokens, at consecutive positions
+        docs = set.intersection(*[set(p) for p in postings])
+        match = {}
+        for doc in docs:
+            starts = set(postings[0][doc])
+            for offset, p in enumerate(postings[1:], 1):
+                starts &= {pos - offset for pos in p[doc]}
+                if not starts:
+                    break
+            if starts:
+                match[doc] = len(starts)
+        return match
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self._path or not os.path.exists(self._path):
+                return
+            try:
+                with open(self._path, 'rb') as fid:
+                    version, state = pickle.load(fid)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception('Cannot load index: rebuild it')
+                return
+            if version != self.VERSION:
+                self.logger.warning('Outdated index: rebuild it')
+                return
+            postings, self._docs, self._cases, self._total_length = state
+            self._postings = defaultdict(dict, postings)
+
+    def save(self):
+        if not self._path or not self.dirty:
+            return
+        with self._lock:
+            dirname = os.path.dirname(self._path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            state = (
+                dict(self._postings), self._docs, self._cases,
+                self._total_length)
+            tmp = self._path + '.tmp'
+            with open(tmp, 'wb') as fid:
+                pickle.dump(
+                    (self.VERSION, state), fid, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self._path)
+            self.dirty = False
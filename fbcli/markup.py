@@ -0,0 +1,104 @@
+'''Event HTML, processed in a single pass.
+
+The HTML of an event is parsed once, by html2text: while converting it
+to plain text, the same parser collects inline images and anchors.
+Outputs are memoized by content, so the same HTML (e.g. rendered again
+after a refresh) is never converted twice.
+'''
+
+from collections import namedtuple
+from html.parser import HTMLParser
+import functools
+import re
+
+import html2text
+
+
+# Poor man HTML link regex
+# URL_RE = re.compile(r'\bhttp[s]?://[^\b \n\r\(\)\[\]\{\},]*')
+# From https://stackoverflow.com/questions/161738/
+#     what-is-the-best-regular-expression-to-check-if-a-string-is-a-valid-url
+URL_RE = re.compile(
+    r'\b(https?|ftp|file)://'
+    r'[-A-Za-z0-9+&@#/%?=~_|!:,.;]+[-A-Za-z0-9+&@#/%=~_|]',
+    re.IGNORECASE)
+
+# Max number of outputs to keep
+CACHE_SIZE = 4096
+
+# text: plain text
+# urls: [(position in text, url)]
+# imgs: [src of http images]
+# anchors: [(text, href)], for anchors whose text is not the href
+Markup = namedtuple('Markup', ['text', 'urls', 'imgs', 'anchors'])
+
+
+def find_urls(text):
+    return [(m.start(), m.group()) for m in URL_RE.finditer(text)]
+
+
+class Converter(html2text.HTML2Text):
+    '''html2text, collecting images and anchors on the way.'''
+
+    def __init__(self):
+        html2text.HTML2Text.__init__(self)
+        self.body_width = 0
+        self.protect_links = True
+        self.imgs = []
+        self.anchors = []
+        # Text of the anchors being parsed, innermost last
+        self._open_anchors = []
+
+    def handle_tag(self, tag, attrs, start):
+        if tag == 'img' and start:
+            src = (attrs.get('src') or '').strip()
+            # Only support http links
+            if src.startswith('http'):
+                self.imgs.append(src)
+        elif tag == 'a':
+            if start:
+                self._open_anchors.append((attrs.get('href'), []))
+            elif self._open_anchors:
+                href, data = self._open_anchors.pop()
+                text = ''.join(data).strip()
+                if text and href and text != href:
+                    self.anchors.append((text, href))
+        html2text.HTML2Text.handle_tag(self, tag, attrs, start)
+
+    def handle_data(self, data, *args, **kwargs):
+        for _, anchor_data in self._open_anchors:
+            anchor_data.append(data)
+        html2text.HTML2Text.handle_data(self, data, *args, **kwargs)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def from_html(html):
+    # A converter holds the state of one document: not reusable
+    converter = Converter()
+    text = converter.handle(html)
+    return Markup(
+        text, tuple(find_urls(text)), tuple(converter.imgs),
+        tuple(converter.anchors))
+
+
+def from_text(text):
+    return Markup(text, tuple(find_urls(text)), (), ())
+
+
+class _TextExtractor(HTMLParser):
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.data = []
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def strip_tags(html):
+    '''Text of a snippet of HTML.'''
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return ''.join(extractor.data).strip()
@@ -0,0 +1,324 @@
+'''Compact records decoded from FogBugz XML.
+
+A record decodes the children of a tag in a single pass and keeps
+plain values in slots: the BeautifulSoup tree, which is many times
+bigger than the values, can be dropped right after parsing. Elements
+from lxml (e.g. from a streaming parser) are decoded the same way, and
+so are objects from the JSON API, whose keys are the XML tag names.
+'''
+
+from collections import OrderedDict
+import datetime
+
+from xml.sax.saxutils import escape, quoteattr
+
+
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _is_soup(tag):
+    return hasattr(tag, 'get_text')
+
+
+def _root(tag, name):
+    # Accept a whole document, too
+    if _is_soup(tag):
+        found = tag.find(name) if tag.name != name else None
+    else:
+        found = tag.find('.//' + name) if tag.tag != name else None
+    return tag if found is None else found
+
+
+def _children(tag):
+    if _is_soup(tag):
+        return ((child.name, child) for child in tag.children)
+    return ((child.tag, child) for child in tag)
+
+
+def _find_all(tag, name):
+    if _is_soup(tag):
+        return tag.findAll(name)
+    return tag.iter(name)
+
+
+def text(tag):
+    if _is_soup(tag):
+        return tag.get_text(strip=True)
+    return ''.join(tag.itertext()).strip()
+
+
+def integer(tag):
+    s = text(tag)
+    return int(s) if s else None
+
+
+def ids(tag):
+    return [int(id_) for id_ in text(tag).split(',') if id_]
+
+
+def strings(tag):
+    return [s for s in text(tag).split(',') if s]
+
+
+def parse_dt(s):
+    return datetime.datetime.strptime(s, ISO_FORMAT)
+
+
+# Class -> all its slots
+_SLOTS = {}
+
+
+def slots(cls):
+    '''Slots of `cls` and of its bases.
+
+    Subclasses mixing in behaviour only, e.g. cli.FBPerson, declare no
+    slots of their own.
+    '''
+    try:
+        return _SLOTS[cls]
+    except KeyError:
+        all_slots = _SLOTS[cls] = tuple(OrderedDict.fromkeys(
+            slot for klass in reversed(cls.__mro__)
+            for slot in klass.__dict__.get('__slots__', ())))
+        return all_slots
+
+
+class Record(object):
+
+    __slots__ = ()
+
+    # Name of the tag to decode
+    TAG = None
+
+    # Child tag -> (slot, decoder)
+    FIELDS = {}
+
+    # Slot -> value if the tag is missing
+    DEFAULTS = {}
+
+    def __init__(self, **values):
+        for slot in slots(type(self)):
+            if slot in values:
+                value = values[slot]
+            else:
+                value = self.DEFAULTS.get(slot)
+                if isinstance(value, list):
+                    # Do not share mutable defaults
+                    value = []
+            setattr(self, slot, value)
+
+    @classmethod
+    def decode(cls, tag):
+        '''Map slots to values of the children of `tag`.'''
+        values = {}
+        for name, child in _children(_root(tag, cls.TAG)):
+            field = cls.FIELDS.get(name)
+            if field is not None:
+                slot, decoder = field
+                values[slot] = decoder(child)
+        return values
+
+    @classmethod
+    def from_xml(cls, tag):
+        return cls(**cls.decode(tag))
+
+    @classmethod
+    def from_json(cls, obj):
+        values = {}
+        for key, (slot, decoder) in cls.FIELDS.items():
+            # Nulls are missing values
+            if obj.get(key) is not None:
+                values[slot] = JSON_DECODERS[decoder](obj[key])
+        return cls(**values)
+
+    @classmethod
+    def load(cls, data):
+        '''From either XML or JSON.'''
+        if isinstance(data, dict):
+            return cls.from_json(data)
+        return cls.from_xml(data)
+
+    def to_xml(self, **attrs):
+        '''Render as XML, the way FogBugz would.'''
+        parts = []
+        for tag, (slot, decoder) in self.FIELDS.items():
+            value = getattr(self, slot)
+            if value is not None:
+                parts.append(XML_ENCODERS[decoder](tag, value))
+        return '<{0}{1}>{2}</{0}>'.format(self.TAG, ''.join(
+            ' {}={}'.format(k, quoteattr(str(v)))
+            for k, v in sorted(attrs.items())), ''.join(parts))
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in slots(type(self))}
+
+
+class ShortCase(Record):
+
+    __slots__ = (
+        'id', 'title', 'status', 'project', 'priority', 'priority_id',
+        'dtlastupdated', 'opened_by_id', 'dtopened')
+
+    TAG = 'case'
+
+    # Same as store.SHORT_COLS
+    FIELDS = {
+        'ixBug': ('id', integer),
+        'sTitle': ('title', text),
+        'sStatus': ('status', text),
+        'sProject': ('project', text),
+        'sPriority': ('priority', text),
+        'ixPriority': ('priority_id', integer),
+        'dtLastUpdated': ('dtlastupdated', text),
+        'ixPersonOpenedBy': ('opened_by_id', integer),
+        'dtOpened': ('dtopened', text),
+    }
+
+    DEFAULTS = {'priority_id': 999}
+
+    @classmethod
+    def from_row(cls, row):
+        '''From a row of the local mirror.'''
+        return cls(**{
+            slot: row[col] for col, (slot, _) in cls.FIELDS.items()
+            if row[col] is not None})
+
+    def to_row(self):
+        return {
+            col: getattr(self, slot)
+            for col, (slot, _) in self.FIELDS.items()}
+
+    @property
+    def sort_key(self):
+        # ISO dates sort like datetimes: no need to parse them
+        priority_id = self.priority_id
+        if priority_id is None:
+            priority_id = self.DEFAULTS['priority_id']
+        return (priority_id, self.project or '', self.dtlastupdated or '')
+
+    @property
+    def last_updated(self):
+        return parse_dt(self.dtlastupdated)
+
+    @property
+    def opened(self):
+        return parse_dt(self.dtopened)
+
+
+class Case(Record):
+
+    __slots__ = ShortCase.__slots__ + (
+        'area', 'assigned_to', 'milestone', 'parent_id', 'category_id',
+        'category', 'duplicate_of_id', 'children_ids', 'related_ids',
+        'tags')
+
+    TAG = 'case'
+
+    FIELDS = dict(ShortCase.FIELDS, **{
+        'sArea': ('area', text),
+        'sPersonAssignedTo': ('assigned_to', text),
+        'sFixFor': ('milestone', text),
+        'ixBugParent': ('parent_id', integer),
+        'ixCategory': ('category_id', integer),
+        'sCategory': ('category', text),
+        'ixBugOriginal': ('duplicate_of_id', integer),
+        'ixBugChildren': ('children_ids', ids),
+        'ixRelatedBugs': ('related_ids', ids),
+        'tags': ('tags', strings),
+    })
+
+    DEFAULTS = dict(ShortCase.DEFAULTS, children_ids=[], related_ids=[],
+                    tags=[])
+
+    def short(self):
+        return ShortCase(**{
+            slot: getattr(self, slot) for slot in ShortCase.__slots__})
+
+
+class Person(Record):
+
+    __slots__ = ('id', 'fullname', 'email')
+
+    TAG = 'person'
+
+    FIELDS = {
+        'ixPerson': ('id', integer),
+        'sFullName': ('fullname', text),
+        'sEmail': ('email', text),
+    }
+
+
+class Attachment(Record):
+
+    __slots__ = ('filename', 'url')
+
+    TAG = 'attachment'
+
+    FIELDS = {
+        'sFileName': ('filename', text),
+        'sURL': ('url', text),
+    }
+
+
+def attachments(tag):
+    return [Attachment.from_xml(a) for a in _find_all(tag, 'attachment')]
+
+
+class Event(Record):
+
+    __slots__ = (
+        'id', 'dt', 'person', 'desc', 'changes', 's', 'html',
+        'attachments')
+
+    TAG = 'event'
+
+    FIELDS = {
+        'ixBugEvent': ('id', integer),
+        'dt': ('dt', text),
+        'sPerson': ('person', text),
+        'evtDescription': ('desc', text),
+        'sChanges': ('changes', text),
+        's': ('s', text),
+        # None if missing, unlike empty
+        'sHtml': ('html', text),
+        'rgAttachments': ('attachments', attachments),
+    }
+
+    DEFAULTS = {'changes': '', 's': '', 'attachments': []}
+
+
+def _json_text(value):
+    return str(value).strip()
+
+
+def _json_integer(value):
+    return int(value) if value != '' else None
+
+
+def _json_list(value):
+    if isinstance(value, list):
+        return value
+    return [v for v in _json_text(value).split(',') if v]
+
+
+JSON_DECODERS = {
+    text: _json_text,
+    integer: _json_integer,
+    ids: lambda value: [int(v) for v in _json_list(value)],
+    strings: lambda value: [str(v) for v in _json_list(value)],
+    attachments: lambda value: [Attachment.from_json(a) for a in value],
+}
+
+
+def _xml_text(tag, value):
+    return '<{0}>{1}</{0}>'.format(tag, escape(str(value)))
+
+
+XML_ENCODERS = {
+    text: _xml_text,
+    integer: _xml_text,
+    ids: lambda tag, value: _xml_text(tag, ','.join(map(str, value))),
+    strings: lambda tag, value: _xml_text(tag, ','.join(value)),
+    attachments: lambda tag, value: '<{0}>{1}</{0}>'.format(
+        tag, ''.join(a.to_xml() for a in value)),
+}
@@ -0,0 +1,244 @@
+'''Local FogBugz stand-in, replaying recorded traffic.
+
+Serves `api.xml`, the XML API (`api.asp`) and any other endpoint (e.g.
+`/f/api/0/*` JSON) from a `fbcli.cassette.Cassette`, optionally adding
+latency to each response. XML API calls that were not recorded are
+answered with the first recording of the same command, if any.
+
+With a synthetic `fbcli.synth.Dataset`, the stand-in answers from it
+first, falling back to the cassette.
+
+Usage:
+    python -m fbcli.standin --cassette=fb.json --latency=0.05
+    python -m fbcli.standin --synth --cases=50000 --events=100
+    FBURL=http://localhost:8888/ FBUSER=me FBTOKEN=x fb
+'''
+
+import argparse
+import json
+import logging
+import random
+import threading
+
+from tornado import gen
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.web import Application, RequestHandler
+
+from fbcli.cassette import (
+    Cassette, TOKEN, api_key, entry_body, http_key)
+from fbcli.synth import Dataset
+
+
+API_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?><response>'
+    '<version>8</version><minversion>1</minversion>'
+    '<url>api.asp?</url></response>')
+
+NOT_RECORDED = (
+    '<response><error code="0"><![CDATA[Not recorded: {}]]></error>'
+    '</response>')
+
+
+class StandInHandler(RequestHandler):
+
+    logger = logging.getLogger('fb.standin')
+
+    def initialize(self, standin):
+        # pylint: disable=attribute-defined-outside-init
+        self.standin = standin
+
+    def _reply(self, entry):
+        self.set_status(entry['status'])
+        self.set_header('Content-Type', entry['content_type'])
+        self.write(entry_body(entry))
+
+    def compute_etag(self):
+        return None
+
+
+class ApiXmlHandler(StandInHandler):
+
+    def get(self):
+        self.set_header('Content-Type', 'text/xml')
+        self.write(API_XML)
+
+
+class ApiHandler(StandInHandler):
+
+    async def get(self):
+        await self.standin.delay()
+        params = {
+            k: self.get_argument(k) for k in self.request.arguments}
+        cmd = params.pop('cmd', None)
+        self.set_header('Content-Type', 'text/xml')
+        if cmd == 'logon':
+            self.write('<response><token>{}</token></response>'.format(
+                TOKEN))
+            return
+        if cmd == 'logoff':
+            self.write('<response/>')
+            return
+        if self.standin.dataset is not None:
+            body = self.standin.dataset.respond(cmd, params)
+            if body is not None:
+                self.write(body)
+                return
+        key = api_key(cmd, params)
+        entry = self.standin.cassette.lookup(key, cmd)
+        if entry is None:
+            self.logger.warning('Not recorded: %s', key)
+            self.write(NOT_RECORDED.format(key))
+            return
+        self._reply(entry)
+
+    post = get
+
+
+class RecordedHandler(StandInHandler):
+
+    async def get(self):
+        await self.standin.delay()
+        query = {
+            k: self.get_query_argument(k)
+            for k in self.request.query_arguments}
+        if self.standin.dataset is not None:
+            body = self.standin.dataset.respond_http(
+                self.request.method, self.request.path, query)
+            if body is not None:
+                self.set_header('Content-Type', 'application/json')
+                self.write(body)
+                return
+        key = http_key(
+            self.request.method, self.request.path, query,
+            self.request.body)
+        entry = self.standin.cassette.lookup(key)
+        if entry is None:
+            self.logger.warning('Not recorded: %s', key)
+            self.set_status(404)
+            self.set_header('Content-Type', 'application/json')
+            self.write(json.dumps({
+                'errors': [{'message': 'Not recorded: {}'.format(key)}]}))
+            return
+        self._reply(entry)
+
+    post = delete = put = get
+
+
+class StandIn(object):
+    '''FogBugz stand-in, running its own IOLoop in a thread.
+
+    Example:
+        standin = StandIn(Cassette.from_fixtures(), latency=0.02)
+        url = standin.start()
+        ...
+        standin.stop()
+    '''
+
+    logger = logging.getLogger('fb.standin')
+
+    def __init__(self, cassette=None, latency=0.0, jitter=0.0, port=0,
+                 dataset=None):
+        self.cassette = cassette or Cassette.from_fixtures()
+        self.dataset = dataset
+        self.latency = latency
+        self.jitter = jitter
+        self.port = port
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.port)
+
+    def env(self):
+        '''Environment for `FBClient` to talk to this stand-in.'''
+        return {
+            'FBURL': self.url,
+            'FBUSER': 'standin@example.com',
+            'FBTOKEN': TOKEN,
+        }
+
+    def make_app(self):
+        kwargs = {'standin': self}
+        return Application([
+            (r'/api\.xml', ApiXmlHandler, kwargs),
+            (r'/api\.asp', ApiHandler, kwargs),
+            (r'/.*', RecordedHandler, kwargs),
+        ])
+
+    def delay(self):
+        return gen.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def start(self):
+        '''Start serving in a background thread and return the URL.'''
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._ready.wait()
+        return self.url
+
+    def _run(self):
+        # Not current: this thread only runs the loop
+        self._loop = IOLoop(make_current=False)
+        self._loop.add_callback(self._serve_and_signal)
+        self._loop.start()
+        self._loop.close(all_fds=True)
+
+    def _serve_and_signal(self):
+        # Called by the loop: the server listens on it
+        self.serve()
+        self._ready.set()
+
+    def serve(self):
+        '''Listen on the current IOLoop.'''
+        sockets = bind_sockets(self.port, '127.0.0.1')
+        self.port = sockets[0].getsockname()[1]
+        server = HTTPServer(self.make_app())
+        server.add_sockets(sockets)
+        self.logger.info('Serving on %s', self.url)
+        return server
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.add_callback(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--cassette', help='Recorded traffic (default: tests/fixtures)')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument(
+        '--latency', type=float, default=0.0, help='Seconds per response')
+    parser.add_argument(
+        '--jitter', type=float, default=0.0,
+        help='Max random seconds added to latency')
+    parser.add_argument(
+        '--synth', action='store_true', help='Serve synthetic data')
+    parser.add_argument('--cases', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--comment-size', type=int, default=500)
+    parser.add_argument('--people', type=int, default=50)
+    parser.add_argument('--attachments', type=int, default=2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    cassette = (
+        Cassette.load(args.cassette) if args.cassette
+        else Cassette.from_fixtures())
+    dataset = Dataset(
+        args.cases, args.events, args.comment_size, args.people,
+        args.attachments) if args.synth else None
+    standin = StandIn(
+        cassette, args.latency, args.jitter, args.port, dataset)
+    standin.serve()
+    IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
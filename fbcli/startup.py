@@ -0,0 +1,111 @@
+'''Startup tasks, run in background threads.
+
+Logging on and loading people, statuses, ... take seconds: they run
+concurrently, while the prompt is shown, and commands wait only for
+what is not ready yet. A task can wait for others to finish first,
+e.g. fetching people needs a logon.
+'''
+
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+
+class Task(object):
+
+    def __init__(self, name, f, after=(), clock=time.time):
+        self.name = name
+        self.f = f
+        # Tasks to wait for, before starting
+        self.after = list(after)
+        self.result = None
+        # Also set if a task to wait for failed
+        self.error = None
+        self._clock = clock
+        self.queued = clock()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='startup-' + name)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for task in self.after:
+                task.join()
+                if task.error is not None:
+                    raise task.error
+            self.started = self._clock()
+            self.result = self.f()
+        except Exception as exc:  # pylint: disable=broad-except
+            self.error = exc
+        finally:
+            self.finished = self._clock()
+            self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def join(self):
+        self._done.wait()
+
+
+class Startup(object):
+
+    logger = logging.getLogger('fb.startup')
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self.t0 = clock()
+        self._tasks = OrderedDict()
+        # Errors raised already
+        self._reported = []
+
+    def start(self, name, f, after=()):
+        '''Run `f` in the background, after the tasks named `after`.'''
+        self.logger.debug('Starting %s', name)
+        task = Task(
+            name, f, [self._tasks[n] for n in after], clock=self._clock)
+        self._tasks[name] = task
+        return task.start()
+
+    def wait(self, *names):
+        '''Wait for the tasks `names`, or all of them.
+
+        Results are returned in the same order. Errors are raised once,
+        by the first wait: later, the task that failed has a None result.
+        '''
+        tasks = [self._tasks[n] for n in names] if names else list(
+            self._tasks.values())
+        for task in tasks:
+            task.join()
+            if task.error is not None and task.error not in self._reported:
+                self._reported.append(task.error)
+                raise task.error
+        return [task.result for task in tasks]
+
+    def succeeded(self, name):
+        '''Wait for task `name`: True if it did not fail.'''
+        task = self._tasks.get(name)
+        if task is None:
+            return False
+        task.join()
+        return task.error is None
+
+    def timings(self):
+        '''List (name, start, elapsed, error) of finished tasks.
+
+        Start is in seconds since startup, elapsed excludes the time
+        spent waiting for other tasks.
+        '''
+        return [
+            (task.name, (task.started or task.finished) - self.t0,
+             task.finished - (task.started or task.finished), task.error)
+            for task in self._tasks.values() if task.done]
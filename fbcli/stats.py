@@ -0,0 +1,193 @@
+'''Latency and payload statistics of calls to FogBugz.
+
+Every API call is recorded with its wall time, response bytes, number
+of retries and cache outcome, tagged with the REPL command that caused
+it. Calls made while another one is in progress (e.g. the requests
+made by `amend`) are accounted to the outermost one.
+'''
+
+from collections import defaultdict
+import bisect
+import contextlib
+import json
+import logging
+import threading
+import time
+
+
+# Upper bounds of histogram buckets, in milliseconds
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+class Call(object):
+
+    __slots__ = (
+        'name', 'command', 'start', 'elapsed', 'nbytes', 'retries',
+        'cache', 'error')
+
+    def __init__(self, name, command=None):
+        self.name = name
+        self.command = command
+        self.start = time.time()
+        self.elapsed = 0.0
+        self.nbytes = 0
+        self.retries = 0
+        self.cache = None
+        self.error = None
+
+    def to_json(self):
+        return json.dumps({
+            'ts': round(self.start, 3),
+            'name': self.name,
+            'command': self.command,
+            'ms': round(self.elapsed * 1000, 2),
+            'bytes': self.nbytes,
+            'retries': self.retries,
+            'cache': self.cache,
+            'error': self.error,
+        })
+
+
+class Summary(object):
+    '''Aggregated calls with the same name.'''
+
+    def __init__(self):
+        self.elapsed = []
+        self.nbytes = 0
+        self.retries = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        # For commands: time spent in API calls
+        self.api_calls = 0
+        self.api_time = 0.0
+
+    def add(self, call):
+        bisect.insort(self.elapsed, call.elapsed)
+        self.nbytes += call.nbytes
+        self.retries += call.retries
+        self.hits += call.cache == 'hit'
+        self.misses += call.cache == 'miss'
+        self.errors += call.error is not None
+
+    @property
+    def count(self):
+        return len(self.elapsed)
+
+    @property
+    def total(self):
+        return sum(self.elapsed)
+
+    def percentile(self, p):
+        if not self.elapsed:
+            return 0.0
+        i = min(int(p * len(self.elapsed)), len(self.elapsed) - 1)
+        return self.elapsed[i]
+
+    def histogram(self):
+        '''Count of calls in each of BUCKETS, plus one for slower calls.'''
+        counts = [0] * (len(BUCKETS) + 1)
+        for elapsed in self.elapsed:
+            counts[bisect.bisect_left(BUCKETS, elapsed * 1000)] += 1
+        return counts
+
+
+class Stats(object):
+
+    logger = logging.getLogger('fb.stats')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._trace = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = defaultdict(Summary)
+            self.commands = defaultdict(Summary)
+
+    def trace_to(self, fname):
+        '''Append a JSON line per call to `fname`.'''
+        self._trace = open(fname, 'a')
+
+    @property
+    def current(self):
+        '''The outermost call in progress in this thread, if any.'''
+        return getattr(self._local, 'call', None)
+
+    @property
+    def current_command(self):
+        return getattr(self._local, 'command', None)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        '''Record a call to `name`.'''
+        if self.current is not None:
+            yield self.current
+            return
+        call = Call(name, self.current_command)
+        self._local.call = call
+        try:
+            yield call
+        except Exception as exc:
+            call.error = type(exc).__name__
+            raise
+        finally:
+            call.elapsed = time.time() - call.start
+            self._local.call = None
+            self.record(call)
+
+    @contextlib.contextmanager
+    def command(self, name):
+        '''Record execution of REPL command `name`.'''
+        outer = self.current_command
+        self._local.command = name
+        call = Call(name)
+        try:
+            yield call
+        finally:
+            call.elapsed = time.time() - call.start
+            self._local.command = outer
+            with self._lock:
+                self.commands[name].add(call)
+
+    def start(self, name):
+        '''Start recording a call, without making it current.
+
+        For concurrent calls in the same thread, i.e. coroutines.
+        '''
+        return Call(name, self.current_command)
+
+    def finish(self, call):
+        call.elapsed = time.time() - call.start
+        outer = self.current
+        if outer is not None:
+            outer.nbytes += call.nbytes
+            outer.retries += call.retries
+        else:
+            self.record(call)
+
+    def add_bytes(self, nbytes):
+        if self.current is not None:
+            self.current.nbytes += nbytes
+
+    def add_retry(self):
+        if self.current is not None:
+            self.current.retries += 1
+
+    def record(self, call):
+        with self._lock:
+            self.calls[call.name].add(call)
+            if call.command is not None:
+                self.commands[call.command].api_calls += 1
+                self.commands[call.command].api_time += call.elapsed
+            if self._trace is not None:
+                self._trace.write(call.to_json() + '\n')
+                self._trace.flush()
+        self.logger.debug(
+            '%s took %.1fms, %d bytes', call.name, call.elapsed * 1000,
+            call.nbytes)
+
+
+STATS = Stats()
@@ -0,0 +1,235 @@
+'''Local SQLite mirror of FogBugz cases.
+
+Cases are stored with their short-case columns (for searching and
+listing) plus the XML of the header and of each event (for showing).
+Each synced query keeps the cases it matched, so that cases that no
+longer match any synced query can be pruned.
+'''
+
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+
+from xml.sax.saxutils import escape
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cases (
+    ixBug INTEGER PRIMARY KEY,
+    sTitle TEXT,
+    sStatus TEXT,
+    sProject TEXT,
+    sPriority TEXT,
+    ixPriority INTEGER,
+    dtLastUpdated TEXT,
+    ixPersonOpenedBy INTEGER,
+    dtOpened TEXT,
+    dtViewed TEXT,
+    xml TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    ixBugEvent INTEGER PRIMARY KEY,
+    ixBug INTEGER NOT NULL,
+    xml TEXT
+);
+CREATE INDEX IF NOT EXISTS events_ixbug ON events (ixBug);
+CREATE INDEX IF NOT EXISTS cases_dtviewed ON cases (dtViewed);
+CREATE TABLE IF NOT EXISTS queries (
+    q TEXT PRIMARY KEY,
+    dtSynced TEXT
+);
+CREATE TABLE IF NOT EXISTS query_cases (
+    q TEXT NOT NULL,
+    ixBug INTEGER NOT NULL,
+    PRIMARY KEY (q, ixBug)
+);
+CREATE INDEX IF NOT EXISTS query_cases_ixbug ON query_cases (ixBug);
+'''
+
+SHORT_COLS = (
+    'ixBug',
+    'sTitle',
+    'sStatus',
+    'sProject',
+    'sPriority',
+    'ixPriority',
+    'dtLastUpdated',
+    'ixPersonOpenedBy',
+    'dtOpened',
+)
+
+# Search keywords that can be answered locally
+FILTERS = {
+    'title': 'sTitle',
+    'status': 'sStatus',
+    'project': 'sProject',
+    'priority': 'sPriority',
+}
+
+
+def _now():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def short_xml(row):
+    '''Render a `cases` row as a <case> with the short-case columns.'''
+    return '<case>{}</case>'.format(''.join(
+        '<{0}>{1}</{0}>'.format(col, escape(str(row[col])))
+        for col in SHORT_COLS if row[col] is not None))
+
+
+class Store(object):
+
+    logger = logging.getLogger('fb.store')
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        # sqlite3 connections can't be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            dirname = os.path.dirname(self._path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            db = sqlite3.connect(self._path)
+            db.row_factory = sqlite3.Row
+            db.executescript(SCHEMA)
+            self._local.db = db
+        return db
+
+    def __contains__(self, ixbug):
+        row = self._db.execute(
+            'SELECT 1 FROM cases WHERE ixBug = ?', (ixbug,)).fetchone()
+        return row is not None
+
+    def set_query_cases(self, q, ids):
+        '''Record that query `q` matches cases `ids`, and prune.
+
+        Cases that `q` matched before, and that no synced query matches
+        any more, are removed. Returns their ids.
+        '''
+        ids = set(ids)
+        with self._db:
+            before = {
+                row['ixBug'] for row in self._db.execute(
+                    'SELECT ixBug FROM query_cases WHERE q = ?', (q,))}
+            self._db.execute('DELETE FROM query_cases WHERE q = ?', (q,))
+            self._db.executemany(
+                'INSERT INTO query_cases (q, ixBug) VALUES (?, ?)',
+                [(q, ixbug) for ixbug in ids])
+            self._db.execute(
+                'INSERT OR REPLACE INTO queries (q, dtSynced) '
+                'VALUES (?, ?)', (q, _now()))
+            pruned = []
+            for ixbug in sorted(before - ids):
+                row = self._db.execute(
+                    'SELECT 1 FROM query_cases WHERE ixBug = ?',
+                    (ixbug,)).fetchone()
+                if row is None:
+                    pruned.append(ixbug)
+            self._db.executemany(
+                'DELETE FROM events WHERE ixBug = ?',
+                [(ixbug,) for ixbug in pruned])
+            self._db.executemany(
+                'DELETE FROM cases WHERE ixBug = ?',
+                [(ixbug,) for ixbug in pruned])
+        return pruned
+
+    def queries(self):
+        return self._db.execute(
+            'SELECT q, dtSynced FROM queries ORDER BY q').fetchall()
+
+    def last_updated(self, ids):
+        '''Map case ids to their stored dtLastUpdated.'''
+        ids = list(ids)
+        found = {}
+        # Stay below SQLite's limit on the number of host parameters
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            rows = self._db.execute(
+                'SELECT ixBug, dtLastUpdated FROM cases '
+                'WHERE ixBug IN ({})'.format(','.join('?' * len(batch))),
+                batch)
+            found.update((r['ixBug'], r['dtLastUpdated']) for r in rows)
+        return found
+
+    def save_case(self, short, xml, events):
+        '''Save a case.
+
+        `short` maps SHORT_COLS to values, `xml` is the <case> without
+        events and `events` is a list of (ixBugEvent, xml).
+        '''
+        values = [short.get(col) for col in SHORT_COLS]
+        with self._db:
+            self._db.execute(
+                'INSERT OR IGNORE INTO cases (ixBug) VALUES (?)',
+                (short['ixBug'],))
+            self._db.execute(
+                'UPDATE cases SET {}, xml = ? WHERE ixBug = ?'.format(
+                    ', '.join('{} = ?'.format(c) for c in SHORT_COLS)),
+                values + [xml, short['ixBug']])
+            self._db.execute(
+                'DELETE FROM events WHERE ixBug = ?', (short['ixBug'],))
+            self._db.executemany(
+                'INSERT OR REPLACE INTO events (ixBugEvent, ixBug, xml) '
+                'VALUES (?, ?, ?)',
+                [(ix, short['ixBug'], exml) for ix, exml in events])
+
+    def get_case_xml(self, ixbug):
+        '''The whole <case>, with events, or None if not mirrored.'''
+        row = self._db.execute(
+            'SELECT xml FROM cases WHERE ixBug = ?', (ixbug,)).fetchone()
+        if row is None or row['xml'] is None:
+            return None
+        events = self._db.execute(
+            'SELECT xml FROM events WHERE ixBug = ? ORDER BY ixBugEvent',
+            (ixbug,))
+        xml = row['xml']
+        if xml.endswith('/>'):
+            # Empty <case/>
+            xml = xml[:-2] + '></case>'
+        head, tail = xml.rsplit('</case>', 1)
+        return '{}<events>{}</events></case>{}'.format(
+            head, ''.join(e['xml'] for e in events), tail)
+
+    def mark_viewed(self, ixbug):
+        with self._db:
+            self._db.execute(
+                'UPDATE cases SET dtViewed = ? WHERE ixBug = ?',
+                (_now(), ixbug))
+
+    def recently_viewed(self, n=20):
+        return self._db.execute(
+            'SELECT * FROM cases WHERE dtViewed IS NOT NULL '
+            'ORDER BY dtViewed DESC LIMIT ?', (n,)).fetchall()
+
+    def search(self, words=(), ids=None, **filters):
+        '''Find cases whose title contains all `words`.
+
+        `ids` restricts the search to some cases and `filters` maps
+        keys in FILTERS to substrings to look for.
+        '''
+        where, params = [], []
+        if ids is not None:
+            ids = list(ids)
+            if len(ids) > 500:
+                rows = self.search(words, **filters)
+                ids = set(ids)
+                return [row for row in rows if row['ixBug'] in ids]
+            where.append('ixBug IN ({})'.format(','.join('?' * len(ids))))
+            params.extend(ids)
+        for word in words:
+            where.append('sTitle LIKE ?')
+            params.append('%{}%'.format(word))
+        for key, value in filters.items():
+            where.append('{} LIKE ?'.format(FILTERS[key]))
+            params.append('%{}%'.format(value))
+        sql = 'SELECT * FROM cases'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        return self._db.execute(sql, params).fetchall()
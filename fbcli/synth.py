@@ -0,0 +1,380 @@
+'''Synthetic FogBugz data, at production scale.
+
+`Dataset` generates FogBugz-shaped XML (and JSON) responses for any
+number of cases, events per case, people and attachments, with HTML
+comments of a given size. Cases are generated on demand and are
+deterministic given the seed, so that huge datasets cost no memory.
+
+Feed it to `fbcli.standin.StandIn(dataset=...)` or use `SynthFB` in
+place of `FB`, e.g. `mock.patch('fbcli.cli.FB', SynthFB(Dataset()))`.
+'''
+
+import datetime
+import json
+import random
+
+from bs4 import BeautifulSoup
+from xml.sax.saxutils import escape
+
+
+WORDS = (
+    'the data backfill client report build deploy server query page '
+    'export import user account error fix release test survey brand '
+    'index score weekly daily migration database cache timeout api '
+    'dashboard chart filter column upload download email alert'
+).split()
+
+FIRST_NAMES = (
+    'Albert Marie Isaac Ada Alan Grace Niels Lise Enrico Emmy Paul '
+    'Rosalind Richard Barbara Werner Dorothy').split()
+
+LAST_NAMES = (
+    'Einstein Curie Newton Lovelace Turing Hopper Bohr Meitner Fermi '
+    'Noether Dirac Franklin Feynman McClintock Heisenberg Hodgkin').split()
+
+STATUSES = [
+    (1, 'Active', 1, False),
+    (2, 'Resolved (Fixed)', 1, True),
+    (3, 'Resolved (Not Reproducible)', 1, True),
+    (4, 'Resolved (Duplicate)', 1, True),
+    (5, 'Resolved (Won\'t Fix)', 1, True),
+    (20, 'Active', 3, False),
+    (21, 'Resolved (Completed)', 3, True),
+]
+
+PRIORITIES = [
+    (1, 'Blocker'),
+    (2, 'Must Fix'),
+    (3, 'High priority'),
+    (4, 'Fix If Time'),
+    (5, 'Low priority'),
+]
+
+CATEGORIES = [(1, 'Bug'), (2, 'Feature'), (3, 'Inquiry'), (6, 'Task')]
+
+PROJECTS = ['BrandIndex', 'Devops', 'Docs', 'Website', 'Mobile']
+
+AREAS = ['Misc', 'UI', 'Backend', 'Data']
+
+VERBS = [
+    (2, 'Edited'),
+    (3, 'Assigned'),
+    (2, 'Edited'),
+    (2, 'Edited'),
+    (14, 'Resolved'),
+    (7, 'Reactivated'),
+]
+
+EPOCH = datetime.datetime(2015, 1, 1)
+
+
+def _el(tag, value=None):
+    if value is None or value == '':
+        return '<{}/>'.format(tag)
+    return '<{0}>{1}</{0}>'.format(tag, escape(str(value)))
+
+
+def _dt(seconds):
+    dt = EPOCH + datetime.timedelta(seconds=seconds)
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class Dataset(object):
+    '''Synthetic FogBugz instance.
+
+    Case ids are 1..`cases`, person ids 1..`people`. Each case has
+    `events` events, with HTML comments of about `comment_size`
+    characters, and `attachments` attachments spread over them.
+    '''
+
+    def __init__(self, cases=1000, events=20, comment_size=500,
+                 people=50, attachments=2, seed=0):
+        self.ncases = cases
+        self.nevents = events
+        self.comment_size = comment_size
+        self.npeople = people
+        self.nattachments = attachments
+        self.seed = seed
+
+    def _rng(self, *key):
+        return random.Random('{}:{}'.format(
+            self.seed, ':'.join(map(str, key))))
+
+    def _words(self, rng, n):
+        return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+    def event_id(self, ixbug, i):
+        return ixbug * self.nevents + i
+
+    # People
+
+    def person(self, ixperson):
+        rng = self._rng('person', ixperson)
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        return {
+            'ixPerson': ixperson,
+            'sFullName': '{} {} {}'.format(first, last, ixperson),
+            'sEmail': '{}.{}{}@example.com'.format(
+                first.lower(), last.lower(), ixperson),
+            'fDeleted': 'false',
+        }
+
+    def person_xml(self, ixperson):
+        return '<person>{}</person>'.format(''.join(
+            _el(k, v) for k, v in self.person(ixperson).items()))
+
+    def people_xml(self):
+        return '<response><people>{}</people></response>'.format(''.join(
+            self.person_xml(ix) for ix in range(1, self.npeople + 1)))
+
+    def _find_person(self, params):
+        if 'ixPerson' in params:
+            return int(params['ixPerson'])
+        for ix in range(1, self.npeople + 1):
+            person = self.person(ix)
+            if params.get('sEmail') in (None, person['sEmail']):
+                return ix
+        return None
+
+    # Cases
+
+    def comment(self, rng):
+        '''HTML comment, with links, bold text and case references.'''
+        parts, size = [], 0
+        while size < self.comment_size:
+            sentence = self._words(rng, rng.randint(5, 15))
+            kind = rng.random()
+            if kind < 0.1:
+                sentence += ' see https://example.com/{}'.format(
+                    rng.randint(1, 1000))
+            elif kind < 0.2:
+                sentence += ' <b>{}</b>'.format(self._words(rng, 2))
+            elif kind < 0.3:
+                sentence += ' related to case {}'.format(
+                    rng.randint(1, self.ncases))
+            parts.append('<p>{}.</p>'.format(sentence.capitalize()))
+            size += len(parts[-1])
+        return ''.join(parts)
+
+    def _attachments(self, ixbug, i, ixbugevent):
+        # Spread attachments over the events, round robin
+        n = len(range(i, self.nattachments, self.nevents))
+        if n == 0:
+            return '<rgAttachments/>'
+        atts = []
+        for j in range(n):
+            ixattachment = ixbugevent * 100 + j
+            fname = 'file_{}_{}.txt'.format(ixbug, ixattachment)
+            url = (
+                'default.asp?pg=pgDownload&amp;pgType=pgFile&amp;'
+                'ixBugEvent={}&amp;ixAttachment={}&amp;sFileName={}'
+                '&sTicket=').format(ixbugevent, ixattachment, fname)
+            atts.append(
+                '<attachment>{}{}</attachment>'.format(
+                    _el('sFileName', fname), _el('sURL', url)))
+        return '<rgAttachments>{}</rgAttachments>'.format(''.join(atts))
+
+    def event_xml(self, ixbug, i):
+        ixbugevent = self.event_id(ixbug, i)
+        rng = self._rng('event', ixbugevent)
+        evt, verb = (1, 'Opened') if i == 0 else rng.choice(VERBS)
+        ixperson = rng.randint(1, self.npeople)
+        person = self.person(ixperson)['sFullName']
+        html = self.comment(rng) if verb in ('Opened', 'Edited') else ''
+        return (
+            '<event ixBug="{ixbug}" ixBugEvent="{ixbugevent}">'
+            '{fields}{attachments}{tail}</event>').format(
+                ixbug=ixbug, ixbugevent=ixbugevent,
+                fields=''.join([
+                    _el('ixBugEvent', ixbugevent),
+                    _el('evt', evt),
+                    _el('sVerb', verb),
+                    _el('ixPerson', ixperson),
+                    _el('ixPersonAssignedTo', 0),
+                    _el('dt', _dt(ixbug * 3600 + i * 60)),
+                    _el('s', html),
+                    _el('fEmail', 'false'),
+                    _el('fHTML', 'true' if html else 'false'),
+                    _el('fExternal', 'false'),
+                    _el('sChanges'),
+                    _el('sFormat', 'html' if html else ''),
+                ]),
+                attachments=self._attachments(ixbug, i, ixbugevent),
+                tail=''.join([
+                    _el('evtDescription', '{} by {}'.format(verb, person)),
+                    _el('bEmail', 'false'),
+                    _el('bExternal', 'false'),
+                    _el('sPerson', person),
+                    _el('sHtml', html),
+                ]))
+
+    def case_fields(self, ixbug):
+        rng = self._rng('case', ixbug)
+        ixstatus, sstatus, ixcategory, _ = rng.choice(STATUSES)
+        ixpriority, spriority = rng.choice(PRIORITIES)
+        scategory = dict(CATEGORIES)[ixcategory]
+        opened_by = rng.randint(1, self.npeople)
+        assigned_to = self.person(rng.randint(1, self.npeople))
+        related = sorted({
+            rng.randint(1, self.ncases) for _ in range(rng.randint(0, 3))})
+        return {
+            'ixBug': ixbug,
+            'sTitle': self._words(rng, rng.randint(3, 10)).capitalize(),
+            'sStatus': sstatus,
+            'ixStatus': ixstatus,
+            'sPersonAssignedTo': assigned_to['sFullName'],
+            'sPriority': spriority,
+            'ixPriority': ixpriority,
+            'sProject': rng.choice(PROJECTS),
+            'sArea': rng.choice(AREAS),
+            'sFixFor': 'ASAP',
+            'ixCategory': ixcategory,
+            'sCategory': scategory,
+            'ixPersonOpenedBy': opened_by,
+            'ixBugParent': 0,
+            'ixBugChildren': '',
+            'ixBugOriginal': '',
+            'ixRelatedBugs': ','.join(map(str, related)),
+            'dtOpened': _dt(ixbug * 3600),
+            'dtLastUpdated': _dt(ixbug * 3600 + self.nevents * 60),
+            'ixBugEventLatest': self.event_id(ixbug, max(self.nevents - 1, 0)),
+            'tags': '',
+        }
+
+    def case_xml(self, ixbug, cols=None):
+        '''A <case>, with only `cols` if given.'''
+        fields = self.case_fields(ixbug)
+        cols = cols or list(fields) + ['events']
+        parts = []
+        for col in cols:
+            if col == 'events':
+                parts.append('<events>{}</events>'.format(''.join(
+                    self.event_xml(ixbug, i)
+                    for i in range(self.nevents))))
+            elif col == 'minievents':
+                parts.append('<minievents>{}</minievents>'.format(''.join(
+                    '<event ixBugEvent="{0}">{1}</event>'.format(
+                        ix, _el('ixBugEvent', ix))
+                    for ix in (
+                        self.event_id(ixbug, i)
+                        for i in range(self.nevents)))))
+            elif col == 'latestEvent' and self.nevents:
+                parts.append('<latestEvent>{}</latestEvent>'.format(
+                    self.event_xml(ixbug, self.nevents - 1)))
+            elif col in fields:
+                parts.append(_el(col, fields[col]))
+        return '<case ixBug="{}" operations="{}">{}</case>'.format(
+            ixbug, 'edit,assign,resolve,email,remind', ''.join(parts))
+
+    def search_ids(self, q):
+        '''Case ids matching search `q`.
+
+        Only lists of ids are supported: anything else matches all.
+        '''
+        ids = str(q).replace(' OR ', ',').split(',')
+        try:
+            ids = [int(ix) for ix in ids]
+        except ValueError:
+            return range(1, self.ncases + 1)
+        return [ix for ix in ids if 1 <= ix <= self.ncases]
+
+    def search_xml(self, q, cols=None, max=None):
+        # pylint: disable=redefined-builtin
+        ids = list(self.search_ids(q))
+        if max:
+            ids = ids[:int(max)]
+        cols = cols.split(',') if cols else ['ixBug']
+        return '<response><cases count="{}">{}</cases></response>'.format(
+            len(ids), ''.join(self.case_xml(ix, cols) for ix in ids))
+
+    def statuses_xml(self):
+        return '<response><statuses>{}</statuses></response>'.format(
+            ''.join(
+                '<status>{}{}{}{}</status>'.format(
+                    _el('ixStatus', ix), _el('sStatus', name),
+                    _el('ixCategory', category),
+                    _el('fResolved', str(resolved).lower()))
+                for ix, name, category, resolved in STATUSES))
+
+    @staticmethod
+    def _list_xml(singular, name, values):
+        return '<response><{0}s>{1}</{0}s></response>'.format(
+            singular, ''.join(
+                '<{0}><ix{1}>{2}</ix{1}><s{1}>{3}</s{1}></{0}>'.format(
+                    singular, name, ix, escape(value))
+                for ix, value in enumerate(values, 1)))
+
+    def respond(self, cmd, params):
+        '''Body of the XML API response to `cmd`, or None.'''
+        if cmd == 'search':
+            return self.search_xml(
+                params.get('q', ''), params.get('cols'), params.get('max'))
+        if cmd == 'viewPerson':
+            ix = self._find_person(params)
+            if ix is None:
+                return None
+            return '<response>{}</response>'.format(self.person_xml(ix))
+        if cmd == 'listPeople':
+            return self.people_xml()
+        if cmd == 'listStatuses':
+            return self.statuses_xml()
+        if cmd == 'listProjects':
+            return self._list_xml('project', 'Project', PROJECTS)
+        if cmd == 'listAreas':
+            return self._list_xml('area', 'Area', AREAS)
+        if cmd == 'listFixFors':
+            return self._list_xml('fixfor', 'FixFor', ['ASAP'])
+        return None
+
+    def respond_http(self, method, path, query=None):
+        '''Body of the JSON API response, or None.'''
+        if method != 'GET':
+            return None
+        parts = path.strip('/').split('/')
+        if parts[:3] != ['f', 'api', '0'] or len(parts) != 5:
+            return None
+        what, ix = parts[3], int(parts[4])
+        if what == 'cases' and 1 <= ix <= self.ncases:
+            fields = self.case_fields(ix)
+            fields['eventEdits'] = []
+            return json.dumps({'data': fields, 'errors': []})
+        if what == 'caseevents' and self.nevents:
+            ixbug, i = divmod(ix, self.nevents)
+            if 1 <= ixbug <= self.ncases:
+                return json.dumps({'data': {'event': {
+                    'ixBug': ixbug,
+                    'ixBugEvent': ix,
+                    'sUniqueID': '{}-{}'.format(ixbug, i),
+                }}, 'errors': []})
+        return None
+
+
+class SynthFB(object):
+    '''Stand-in for `fbcli.fb.FBClient`, answering from a `Dataset`.'''
+
+    def __init__(self, dataset=None):
+        self.dataset = dataset or Dataset()
+        self.current_user = 'synth@example.com'
+        self.current_token = 'synth-token'
+
+    def full_url(self, path):
+        return 'http://synth/' + path.lstrip('/')
+
+    def full_url_with_token(self, path):
+        return self.full_url(path) + '?token=' + self.current_token
+
+    def login(self):
+        pass
+
+    def logout(self):
+        pass
+
+    def __getattr__(self, cmd):
+        if cmd.startswith('_'):
+            raise AttributeError(cmd)
+
+        def helper(**kwargs):
+            xml = self.dataset.respond(cmd, kwargs) or '<response/>'
+            return BeautifulSoup(xml, 'xml').response
+
+        return helper
@@ -15,6 +15,8 @@ import termios
 import six
 from six.moves import html_parser
 
+from fbcli import completion
+
 
 READLINE_HISTFILE = os.path.join(os.path.expanduser("~"), ".fbcli_history")
 
@@ -32,19 +34,90 @@ def _create_readline_logger():
 # READLINE_LOGGER = _create_readline_logger()
 
 
+class Terminal(object):
+    '''Capabilities of the terminal, detected once.
+
+    Detection runs again if stdout or stdin change, or on refresh
+    (e.g. on window resize). Colours can be forced on or off.
+    '''
+
+    def __init__(self):
+        self.force_color = None
+        self._stdout = self._stdin = None
+        self._color = self._stdin_tty = False
+
+    def _check(self):
+        if sys.stdout is not self._stdout or sys.stdin is not self._stdin:
+            self._stdout, self._stdin = sys.stdout, sys.stdin
+            self._color = _supports_color(self._stdout)
+            self._stdin_tty = _isatty(self._stdin)
+
+    def refresh(self):
+        self._stdout = self._stdin = None
+
+    @property
+    def color(self):
+        if self.force_color is not None:
+            return self.force_color
+        self._check()
+        return self._color
+
+    @property
+    def stdin_tty(self):
+        self._check()
+        return self._stdin_tty
+
+
+TERMINAL = Terminal()
+
+
+def set_color(mode):
+    '''Colours "always", "never" or "auto", i.e. only on terminals.'''
+    TERMINAL.force_color = {'always': True, 'never': False}.get(mode)
+
+
+class Color(object):
+    '''A colour, with escape sequences formatted once.'''
+
+    __slots__ = ('code', 'open', 'close', 'rl_open', 'rl_close')
+
+    def __init__(self, code):
+        self.code = code
+        self.open = '\033[{}m'.format(code)
+        self.close = '\033[0m'
+        # \001 and \002 mark ignore boundaries for readline
+        self.rl_open = '\001' + self.open + '\002'
+        self.rl_close = '\001' + self.close + '\002'
+
+    def __call__(self, s, readline_safe=False):
+        if not isinstance(s, six.string_types):
+            s = six.text_type(s)
+        if not TERMINAL.color:
+            return s
+        if readline_safe and TERMINAL.stdin_tty:
+            return self.rl_open + s + self.rl_close
+        return self.open + s + self.close
+
+
+# Color code -> Color
+THEME = {}
+
+
+def theme_color(code):
+    if code not in THEME:
+        THEME[code] = Color(code)
+    return THEME[code]
+
+
 def colorize(color, s, readline_safe=False):
-    if _supports_color(sys.stdout):
-        color_open = '\033[{}m'.format(color)
-        color_close = '\033[0m'
-        if readline_safe and sys.stdin.isatty():
-            # \001 and \002 mark ignore boundaries for readline
-            color_open = '\001' + color_open + '\002'
-            color_close = '\001' + color_close + '\002'
-    else:
-        color_open = color_close = ''
-    if not isinstance(s, six.string_types):
-        s = six.text_type(s)
-    return color_open + s + color_close
+    return theme_color(color)(s, readline_safe=readline_safe)
+
+
+def _isatty(stream):
+    try:
+        return stream.isatty()
+    except Exception:
+        return False
 
 
 def _supports_color(stream):
@@ -55,7 +128,7 @@ def _supports_color(stream):
         curses = None
 
     color = False
-    if curses and hasattr(stream, 'isatty') and stream.isatty():
+    if curses and _isatty(stream):
         try:
             curses.setupterm()
             if curses.tigetnum(str("colors")) > 0:
@@ -144,6 +217,7 @@ def setup_win():
 
 def sigwinch_handler(sig, stack_frame):
     '''Reset globals that depend on window sizes.'''
+    TERMINAL.refresh()
     setup_win()
 
 
@@ -155,10 +229,46 @@ def ltrunc(s, n):
     return s[:n].ljust(n)
 
 
-def completer(text, state):
-    from fbcli.cli import (
-        COMMANDS, ALIASES, LAST_SEARCH, FBShortCase, FBPerson, CURRENT_CASE)
+def _cli():
+    # Imported late: cli imports ui
+    from fbcli import cli
+    return cli
+
+
+def _attachment_ids():
+    case = _cli().CURRENT_CASE
+    return case, lambda: [str(a.id) for a in case.attachments] if case else []
+
+
+def _people():
+    people = _cli().FBPerson.CACHE
+    return people.version, lambda: [person.fullname for person in people]
+
 
+def _commands_and_cases():
+    cli = _cli()
+    commands, aliases = cli.COMMANDS, cli.ALIASES
+    history, last_search = cli.FBShortCase.HISTORY, cli.LAST_SEARCH
+
+    def options():
+        all_options = list(commands.keys()) + list(aliases.keys())
+        all_options += [str(case.id) for case in history]
+        if last_search:
+            all_options += [str(case.id) for case in last_search.shortcases]
+        return all_options
+
+    key = (len(commands), len(aliases), history.version, last_search)
+    return key, options
+
+
+COMPLETER = completion.Completer({
+    'attachment': _attachment_ids,
+    'people': _people,
+    'default': _commands_and_cases,
+})
+
+
+def completer(text, state):
     # READLINE_LOGGER.info('text=%s state=%s', text, state)
     line = readline.get_line_buffer()
 
@@ -173,33 +283,21 @@ def completer(text, state):
     # READLINE_LOGGER.info(
     #     'cmd=%s line=%s rest=%s text=%s', cmd, line, rest, text)
 
-    all_options = []
     if cmd == 'attachment' and text != 'attachment':
-        if CURRENT_CASE:
-            all_options += [str(a.id) for a in CURRENT_CASE.attachments]
+        context = 'attachment'
     elif cmd in ('assign', 'notify'):
-        all_options += [person.fullname for person in FBPerson.CACHE]
+        context = 'people'
     else:
-        all_options += list(COMMANDS.keys())
-        all_options += list(ALIASES.keys())
-        all_options += [str(case.id) for case in FBShortCase.HISTORY]
-        if LAST_SEARCH:
-            all_options += [str(case.id) for case in LAST_SEARCH.shortcases]
-
-    # READLINE_LOGGER.info('all_options=%s', all_options)
-    query = text.lower()
-    options = [x for x in all_options if query in x.lower()]
-    # READLINE_LOGGER.info('#options=%s', len(options))
+        context = 'default'
 
-    try:
-        found = options[state]
-        if rest:
-            found = found[len(' '.join(rest)) + 1:]
-        # READLINE_LOGGER.info('found=%s', found)
-        return found + ' '
-    except IndexError:
+    found = COMPLETER(context, text, state)
+    if found is None:
         # READLINE_LOGGER.info('No suggestions found')
         return None
+    if rest:
+        found = found[len(' '.join(rest)) + 1:]
+    # READLINE_LOGGER.info('found=%s', found)
+    return found + ' '
 
 
 def ignoring_IOerror(f):
@@ -235,30 +333,30 @@ def html_unescape(s):
 
 # http://www.tldp.org/HOWTO/Bash-Prompt-HOWTO/x329.html
 # http://misc.flogisoft.com/bash/tip_colors_and_formatting
-black = partial(colorize, '0;30')
-blue = partial(colorize, '0;34')
-cyan = partial(colorize, '0;36')
-darkgray = partial(colorize, '0;90')
-gray = partial(colorize, '0;37')
-green = partial(colorize, '0;32')
-magenta = partial(colorize, '0;35')
-red = partial(colorize, '0;31')
-white = partial(colorize, '0;97')
-yellow = partial(colorize, '0;33')
-
-lightcyan = partial(colorize, '0;96')
-lightgreen = partial(colorize, '0;92')
-lightmagenta = partial(colorize, '0;95')
-lightred = partial(colorize, '0;91')
-lightblue = partial(colorize, '0;94')
-
-boldcyan = partial(colorize, '1;36')
-boldred = partial(colorize, '1;31')
-boldwhite = partial(colorize, '1;37')
-bold = partial(colorize, '1')
-boldyellow = partial(colorize, '1;33')
-
-reversewhite = partial(colorize, '7;37')
+black = theme_color('0;30')
+blue = theme_color('0;34')
+cyan = theme_color('0;36')
+darkgray = theme_color('0;90')
+gray = theme_color('0;37')
+green = theme_color('0;32')
+magenta = theme_color('0;35')
+red = theme_color('0;31')
+white = theme_color('0;97')
+yellow = theme_color('0;33')
+
+lightcyan = theme_color('0;96')
+lightgreen = theme_color('0;92')
+lightmagenta = theme_color('0;95')
+lightred = theme_color('0;91')
+lightblue = theme_color('0;94')
+
+boldcyan = theme_color('1;36')
+boldred = theme_color('1;31')
+boldwhite = theme_color('1;37')
+bold = theme_color('1')
+boldyellow = theme_color('1;33')
+
+reversewhite = theme_color('7;37')
 
 caseid = partial(_id, boldcyan)
 eventid = partial(_id, darkgray)
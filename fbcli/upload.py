@@ -0,0 +1,158 @@
+'''Streaming multipart uploads.
+
+The fogbugz library builds the whole body of a request in memory,
+files included. Calls uploading files go through here instead: files
+are read in chunks while the body is sent, so memory stays flat
+however big they are. Text files can be gzipped on the way, to a
+temporary file.
+'''
+
+import gzip
+import mimetypes
+import os
+import shutil
+import tempfile
+import uuid
+
+
+CHUNK_SIZE = 256 * 1024
+
+# Worth compressing, even if mimetypes does not know them
+TEXT_EXTENSIONS = ('.log', '.out', '.err', '.csv', '.json', '.yaml', '.yml')
+
+CRLF = b'\r\n'
+
+
+def is_text(fname):
+    if fname.lower().endswith(TEXT_EXTENSIONS):
+        return True
+    mimetype, encoding = mimetypes.guess_type(fname)
+    return encoding is None and bool(mimetype) and (
+        mimetype.startswith('text/') or mimetype.endswith('+xml') or
+        mimetype in ('application/json', 'application/xml'))
+
+
+def gzipped(path, chunk_size=None):
+    '''A temporary file with `path` gzipped, compressed in chunks.'''
+    tmp = tempfile.TemporaryFile()
+    with open(path, 'rb') as src:
+        with gzip.GzipFile(
+                filename=os.path.basename(path), mode='wb',
+                fileobj=tmp) as dst:
+            shutil.copyfileobj(src, dst, chunk_size or CHUNK_SIZE)
+    tmp.seek(0)
+    return tmp
+
+
+class Upload(object):
+    '''A file to upload, named `name` in FogBugz.'''
+
+    def __init__(self, name, path, compress=False):
+        self.name = name
+        self.path = path
+        self._gzipped = None
+        if compress and is_text(path):
+            self.name += '.gz'
+            self._gzipped = gzipped(path)
+
+    @property
+    def size(self):
+        if self._gzipped is not None:
+            return os.fstat(self._gzipped.fileno()).st_size
+        return os.path.getsize(self.path)
+
+    def open(self):
+        if self._gzipped is not None:
+            self._gzipped.seek(0)
+            return self._gzipped
+        return open(self.path, 'rb')
+
+    def close(self):
+        if self._gzipped is not None:
+            self._gzipped.close()
+
+
+def _escape(s):
+    return s.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class MultipartBody(object):
+    '''A multipart/form-data body, read in chunks as it is sent.
+
+    Files are opened one at a time, as their turn comes. `progress`,
+    if given, makes a progress callback for each file, by name.
+    '''
+
+    def __init__(self, fields, uploads, progress=None):
+        self.boundary = uuid.uuid4().hex
+        # As sent, without the files
+        self.fields = {
+            k: str(v) for k, v in fields.items() if v is not None}
+        self._progress = progress
+        # Bytes, or uploads to read from
+        self._parts = []
+        sep = b'--' + self.boundary.encode('ascii') + CRLF
+        for k, v in self.fields.items():
+            self._parts.append(sep + (
+                'Content-Disposition: form-data; name="{}"'.format(k)
+            ).encode('utf-8') + CRLF + CRLF + v.encode('utf-8') + CRLF)
+        for i, upload in enumerate(uploads, 1):
+            self._parts.append(sep + (
+                'Content-Disposition: form-data; name="File{}"; '
+                'filename="{}"'.format(i, _escape(upload.name))
+            ).encode('utf-8') + CRLF +
+                b'Content-Type: application/octet-stream' + CRLF + CRLF)
+            self._parts.append(upload)
+            self._parts.append(CRLF)
+        self._parts.append(
+            b'--' + self.boundary.encode('ascii') + b'--' + CRLF)
+        self._len = sum(
+            len(part) if isinstance(part, bytes) else part.size
+            for part in self._parts)
+        self._current = None
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    def __len__(self):
+        return self._len
+
+    def _next_part(self):
+        part = self._parts.pop(0)
+        if isinstance(part, bytes):
+            return part
+        # Stream the upload
+        self._current = (
+            part, part.open(), 0,
+            self._progress(part.name) if self._progress else None)
+        return b''
+
+    def _read_current(self, n):
+        upload, fid, done, progress = self._current
+        data = fid.read(n)
+        if data:
+            done += len(data)
+            self._current = (upload, fid, done, progress)
+            if progress is not None:
+                progress(done, upload.size)
+            return data
+        fid.close()
+        upload.close()
+        self._current = None
+        if progress is not None:
+            progress(done, upload.size, final=True)
+        return b''
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = CHUNK_SIZE
+        chunks, size = [], 0
+        while size < n and (self._current is not None or self._parts):
+            if self._current is not None:
+                data = self._read_current(n - size)
+            else:
+                data = self._next_part()
+            chunks.append(data)
+            size += len(data)
+        return b''.join(chunks)
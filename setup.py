@@ -13,7 +13,8 @@ setup(
     url='https://github.com/lbolla/fbcli',
     author='Lorenzo Bolla',
     author_email='lbolla@gmail.com',
-    packages=find_packages('.'),
+    packages=find_packages(
+        '.', exclude=['tests', 'tests.*', 'benchmarks', 'benchmarks.*']),
     python_requires='>=3.6',
     install_requires=[
         'fogbugz>=1.0.5',
@@ -22,6 +23,7 @@ setup(
         'pyyaml>=4.2b1',
         'requests>=2.12.1,<3dev',
         'lazy-property==0.0.1',
+        'lxml',
         'six',
     ],
     test_suite='tests',
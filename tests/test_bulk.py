@@ -0,0 +1,55 @@
+import threading
+import unittest
+
+from fbcli import bulk
+
+
+class TestRun(unittest.TestCase):
+
+    def test_failures_do_not_stop_others(self):
+
+        def action(item):
+            if item == 2:
+                raise ValueError('boom')
+
+        results = {r.item: r for r in bulk.run(range(5), action, jobs=2)}
+        self.assertEqual(sorted(results), [0, 1, 2, 3, 4])
+        self.assertIsInstance(results[2].error, ValueError)
+        self.assertEqual(
+            sorted(i for i, r in results.items() if r.error is None),
+            [0, 1, 3, 4])
+
+    def test_jobs(self):
+        lock = threading.Lock()
+        running = [0, 0]  # now, max
+        gate = threading.Event()
+
+        def action(_item):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            gate.wait(0.05)
+            with lock:
+                running[0] -= 1
+
+        list(bulk.run(range(10), action, jobs=3))
+        self.assertEqual(running[1], 3)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_spreads_calls(self):
+        now = [100.0]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+
+        limiter = bulk.RateLimiter(4, clock=lambda: now[0], sleep=sleep)
+        for _ in range(3):
+            limiter.wait()
+        self.assertEqual(slept, [0.25, 0.5])
+
+    def test_no_limit(self):
+        limiter = bulk.RateLimiter(None, sleep=self.fail)
+        limiter.wait()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bs4 import BeautifulSoup
+from six.moves import mock
+
+from fbcli import cache
+
+
+def _response(xml):
+    return BeautifulSoup(xml, 'xml').response
+
+
+class TestMetaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.client = mock.Mock()
+        self.client.full_url.return_value = 'http://fogbugz:8080/'
+        self.client.current_user = 'user@example.com'
+        self.client.listPeople.return_value = _response(
+            '<response><people><person><ixPerson>1</ixPerson></person>'
+            '</people></response>')
+        self.cache = cache.MetaCache(self.client, root=self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_miss_then_hit(self):
+        first = self.cache.get('listPeople')
+        second = self.cache.get('listPeople')
+        self.assertEqual(self.client.listPeople.call_count, 1)
+        self.assertEqual(str(first), str(second))
+        self.assertEqual(second.ixPerson.get_text(), '1')
+
+    def test_clear(self):
+        self.cache.get('listPeople')
+        self.assertEqual(len(self.cache.entries()), 1)
+        self.cache.clear()
+        self.assertEqual(self.cache.entries(), [])
+        self.cache.get('listPeople')
+        self.assertEqual(self.client.listPeople.call_count, 2)
+
+    def test_path_by_host_and_user(self):
+        self.assertEqual(self.cache.path, os.path.join(
+            self.root, 'fogbugz_8080', 'user@example.com'))
+
+    def test_entries_skip_removed(self):
+        self.cache.get('listPeople')
+        (cmd, age, _size), = self.cache.entries()
+        self.assertEqual(cmd, 'listPeople')
+        self.assertGreaterEqual(age, 0)
+        # Removed between listing and stat
+        with mock.patch('os.stat', side_effect=OSError):
+            self.assertEqual(self.cache.entries(), [])
+
+    def test_stale_is_refreshed_in_background(self):
+        self.cache = cache.MetaCache(
+            self.client, root=self.root, ttl={'listPeople': -1})
+        self.cache.get('listPeople')
+        with mock.patch.object(
+                self.cache, '_refresh_in_background') as refresh:
+            self.cache.get('listPeople')
+        refresh.assert_called_once_with('listPeople')
+        self.assertEqual(self.client.listPeople.call_count, 1)
+
+    def test_fetch_many(self):
+        fetch_many = mock.Mock(return_value=[
+            _response('<response><people/></response>'),
+            _response('<response><statuses/></response>'),
+        ])
+        self.cache = cache.MetaCache(
+            self.client, fetch_many=fetch_many, root=self.root)
+        people, statuses = self.cache.get_many(['listPeople', 'listStatuses'])
+        fetch_many.assert_called_once_with([
+            ('listPeople', {}), ('listStatuses', {})])
+        self.assertIsNotNone(people.people)
+        self.assertIsNotNone(statuses.statuses)
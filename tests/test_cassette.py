@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from six.moves import mock
+
+from fbcli import cassette, upload
+
+
+class TestCassette(unittest.TestCase):
+
+    def test_api_key_ignores_token(self):
+        self.assertEqual(
+            cassette.api_key('search', {'q': '1', 'token': 'x'}),
+            cassette.api_key('search', {'q': '1', 'token': 'y'}))
+
+    def test_http_key_normalizes_body(self):
+        path = '/f/api/0/cases/1'
+        self.assertEqual(
+            cassette.http_key('POST', path, {}, '{"b":1,"a":2}'),
+            cassette.http_key('POST', path, {}, b'{"a":2,"b":1}'))
+
+    def test_http_key_ignores_token(self):
+        path = '/f/api/0/jsonapi'
+        self.assertEqual(
+            cassette.http_key('POST', path, {}, '{"cmd":"search","token":1}'),
+            cassette.http_key('POST', path, {}, '{"cmd":"search","token":2}'))
+        self.assertNotEqual(
+            cassette.http_key('POST', path, {}, '{"cmd":"search"}'),
+            cassette.http_key('POST', path, {}, '{"cmd":"listPeople"}'))
+
+    def test_lookup_falls_back_to_cmd(self):
+        c = cassette.Cassette()
+        c.add(cassette.api_key('search', {'q': '1'}), '<response/>',
+              cmd='search')
+        entry = c.lookup(cassette.api_key('search', {'q': '2'}), 'search')
+        self.assertEqual(entry['body'], '<response/>')
+        self.assertIsNone(c.lookup(cassette.api_key('search', {'q': '2'})))
+
+    def test_save_and_load(self):
+        root = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(root, 'fb.json')
+            c = cassette.Cassette()
+            c.add('GET /a?', b'\xff\x00', content_type='image/png')
+            c.save(fname)
+            entry = cassette.Cassette.load(fname).lookup('GET /a?')
+            self.assertEqual(cassette.entry_body(entry), b'\xff\x00')
+        finally:
+            shutil.rmtree(root)
+
+    def test_from_fixtures(self):
+        c = cassette.Cassette.from_fixtures()
+        entry = c.lookup(cassette.api_key('viewPerson', {'ixPerson': '1'}),
+                         'viewPerson')
+        self.assertIn('<person>', entry['body'])
+
+    @staticmethod
+    def _response(body, content=b'<response/>',
+                  content_type='application/x-www-form-urlencoded'):
+        r = mock.Mock(status_code=200, content=content)
+        r.headers = {'Content-Type': 'text/xml'}
+        r.request.url = 'http://fogbugz/api.asp?'
+        r.request.headers = {'Content-Type': content_type}
+        r.request.body = body
+        return r
+
+    def test_recorder(self):
+        c = cassette.Cassette()
+        cassette.Recorder(c)(self._response('cmd=search&q=1&token=x'))
+        entry = c.lookup(cassette.api_key('search', {'q': '1'}))
+        self.assertEqual(entry['cmd'], 'search')
+
+    def test_recorder_skips_secrets(self):
+        c = cassette.Cassette()
+        recorder = cassette.Recorder(c)
+        recorder(self._response(
+            'cmd=logon&email=me%40x.com&password=secret',
+            b'<response><token>t0k3n</token></response>'))
+        recorder(self._response('cmd=logoff&token=t0k3n'))
+        r = self._response('{"cmd": "search", "token": "t0k3n"}')
+        r.request.url = 'http://fogbugz/f/api/0/jsonapi'
+        r.request.method = 'POST'
+        recorder(r)
+        self.assertEqual(len(c), 1)
+        self.assertNotIn('t0k3n', json.dumps(c.entries))
+        self.assertIsNotNone(c.lookup(cassette.http_key(
+            'POST', '/f/api/0/jsonapi', {},
+            '{"cmd": "search", "token": "other"}')))
+
+    def test_recorder_upload(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        path = os.path.join(root, 'a.txt')
+        with open(path, 'wb') as fid:
+            fid.write(b'data')
+        body = upload.MultipartBody(
+            {'cmd': 'edit', 'ixBug': 1, 'token': 'x', 'nFileCount': 1},
+            [upload.Upload('a.txt', path)])
+        # Sent, i.e. read, already
+        while body.read():
+            pass
+        c = cassette.Cassette()
+        cassette.Recorder(c)(
+            self._response(body, content_type=body.content_type))
+        entry = c.lookup(cassette.api_key(
+            'edit', {'ixBug': '1', 'nFileCount': '1'}))
+        self.assertEqual(entry['cmd'], 'edit')
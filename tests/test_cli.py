@@ -4,12 +4,18 @@
 from __future__ import unicode_literals
 
 import os
+import shutil
+import tempfile
 import unittest
 
 from bs4 import BeautifulSoup
+from six.moves import mock
 
 from fbcli import cli
 from fbcli import errors
+from fbcli import index
+from fbcli import startup
+from fbcli import store
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 FIXTURE_DIR = os.path.join(THIS_DIR, 'fixtures')
@@ -56,6 +62,68 @@ class TestFBPerson(unittest.TestCase):
         self.assertEqual(fb.fullname, 'José Arcadio Buendía')
         self.assertEqual(fb.email, 'jose.arcadio.buendia@soledad.com')
 
+    def test_slots(self):
+        # No slots of its own: fields are in records.Person
+        person = cli.FBPerson(get_fixture('person.xml'))
+        self.assertEqual(person.id, 246)
+        self.assertEqual(person.to_dict(), {
+            'id': 246, 'fullname': 'José Arcadio Buendía',
+            'email': 'jose.arcadio.buendia@soledad.com'})
+
+
+class TestFBShortCase(unittest.TestCase):
+
+    def test_init(self):
+        case = cli.FBShortCase(id=41675, title='New PDL Backfill')
+        self.assertEqual(case.id, 41675)
+        self.assertEqual(case.title, 'New PDL Backfill')
+        self.assertEqual(case.priority_id, 999)
+        self.assertEqual(case, cli.FBShortCase(id=41675))
+
+    def test_from_case(self):
+        case = cli.FBCase(get_fixture('FB41675.xml'), current=False)
+        short = cli.FBShortCase.from_case(case)
+        self.assertEqual(short.id, 41675)
+        self.assertEqual(short.title, case.title)
+
+
+class TestPersonDirectory(unittest.TestCase):
+
+    def setUp(self):
+        patches = [
+            mock.patch('fbcli.cli.FB'),
+            mock.patch('fbcli.cli.META'),
+            mock.patch.object(cli.FBPerson, 'CACHE', cli.PersonDirectory()),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        cli.META.get.return_value = get_fixture('person.xml')
+
+    def test_lookups(self):
+        person = cli.FBPerson.get_by_id(246)
+        self.assertIs(
+            cli.FBPerson.get_by_email('Jose.Arcadio.Buendia@soledad.com'),
+            person)
+        self.assertIs(
+            cli.FBPerson.get_by_fullname('josé arcadio buendía'), person)
+        # Loaded once, with listPeople
+        cli.META.get.assert_called_once_with('listPeople')
+        self.assertFalse(cli.FB.viewPerson.called)
+
+    def test_dedup(self):
+        cli.FBPerson.get_all()
+        cli.FBPerson.get_all()
+        self.assertEqual(len(cli.FBPerson.CACHE), 1)
+
+    def test_unknown_id(self):
+        cli.FB.viewPerson.return_value = BeautifulSoup(
+            '<response></response>', 'xml')
+        for _ in range(2):
+            with self.assertRaises(AssertionError):
+                cli.FBPerson.get_by_id(1)
+        self.assertEqual(cli.FB.viewPerson.call_count, 1)
+
 
 class TestFBAttachment(unittest.TestCase):
 
@@ -78,6 +146,343 @@ class TestFBCase(unittest.TestCase):
         self.assertEqual(fb.children_ids, [])
         self.assertEqual(fb.related_ids, [])
 
+    @mock.patch('fbcli.cli.FB')
+    def test_get_many(self, FB):
+        FB.search.return_value = get_fixture('FB41675.xml').response
+        current = cli.CURRENT_CASE
+        cases = cli.FBCase.get_many([41675, 41675, 1])
+        self.assertEqual(list(cases.keys()), [41675])
+        self.assertEqual(cases[41675].operations, [
+            'edit', 'reopen', 'email', 'remind'])
+        self.assertIs(cli.CURRENT_CASE, current)
+        self.assertEqual(FB.search.call_count, 1)
+        self.assertEqual(FB.search.call_args[1]['q'], '41675,1')
+
+    @mock.patch('fbcli.cli.FBCase.BATCH_SIZE', 2)
+    @mock.patch('fbcli.cli.FB')
+    def test_get_many_batches(self, FB):
+        FB.search.return_value = get_fixture('FB41675.xml').response
+        cli.FBCase.get_many(range(5))
+        self.assertEqual(FB.search.call_count, 3)
+
+
+class TestUpdate(unittest.TestCase):
+
+    RAW = (
+        '<case ixBug="41675" operations="edit,close">'
+        '<ixBug>41675</ixBug><sTitle>Renamed</sTitle>'
+        '<latestEvent><event ixBugEvent="99999">'
+        '<ixBugEvent>99999</ixBugEvent><s>Done</s>'
+        '</event></latestEvent></case>')
+
+    def setUp(self):
+        self.case = cli.FBCase(get_fixture('FB41675.xml'), current=False)
+        self.nevents = len(self.case.events)
+
+    @mock.patch('fbcli.cli.search_cases')
+    def test_new_event(self, search_cases):
+        search_cases.return_value = [BeautifulSoup(self.RAW, 'xml').case]
+        self.assertEqual(self.case.title, 'New PDL Backfill')
+        self.case.update()
+        self.assertNotIn('events', search_cases.call_args[0][1].split(','))
+        self.assertEqual(self.case.title, 'Renamed')
+        self.assertEqual(self.case.operations, ['edit', 'close'])
+        self.assertEqual(len(self.case.events), self.nevents + 1)
+        self.assertEqual(self.case.last_event.raw_comment, 'Done')
+        # Known already
+        self.case.update()
+        self.assertEqual(len(self.case.events), self.nevents + 1)
+
+    def _with_minievents(self, new_ids):
+        ids = [event.id for event in self.case.events] + new_ids
+        return BeautifulSoup(self.RAW.replace(
+            '</case>', '<minievents>{}</minievents></case>'.format(''.join(
+                '<event ixBugEvent="{0}"><ixBugEvent>{0}</ixBugEvent>'
+                '</event>'.format(ix) for ix in ids))), 'xml').case
+
+    @mock.patch('fbcli.cli.search_cases')
+    def test_only_latest_is_new(self, search_cases):
+        search_cases.return_value = [self._with_minievents([99999])]
+        self.case.update()
+        self.assertEqual(search_cases.call_count, 1)
+        self.assertEqual(len(self.case.events), self.nevents + 1)
+
+    @mock.patch('fbcli.cli.search_cases')
+    def test_events_added_meanwhile(self, search_cases):
+        search_cases.side_effect = [
+            [self._with_minievents([99998, 99999])],
+            [get_fixture('FB41675.xml').case],
+        ]
+        self.case.update()
+        self.assertEqual(
+            search_cases.call_args_list[1][0][1], 'ixBug,events')
+        # All events, as fetched
+        self.assertEqual(len(self.case.events), self.nevents)
+        self.assertEqual(self.case.title, 'Renamed')
+
+    @mock.patch('fbcli.cli.FB')
+    @mock.patch('fbcli.cli.search_cases')
+    def test_edited_event(self, search_cases, FB):
+        search_cases.return_value = [BeautifulSoup(self.RAW, 'xml').case]
+        event = self.case.events[0]
+        FB.get_event.return_value = {'ixBugEvent': event.id, 's': 'Amended'}
+        self.case.update(event.id)
+        FB.get_event.assert_called_once_with(event.id)
+        self.assertEqual(self.case.events[0].raw_comment, 'Amended')
+
+
+class TestWriteThrough(unittest.TestCase):
+
+    @mock.patch('fbcli.cli.CURRENT_USER', mock.Mock(id=1))
+    @mock.patch('fbcli.cli.FB')
+    def test_edit(self, FB):
+        case = cli.FBCase(get_fixture('FB41675.xml'))
+        FB.edit.return_value = BeautifulSoup(
+            '<response>' + TestUpdate.RAW + '</response>', 'xml').response
+        case.edit(sEvent='Done')
+        _, kwargs = FB.edit.call_args
+        self.assertEqual(kwargs['cols'], ','.join(cli.FBCase.UPDATE_COLS))
+        self.assertFalse(FB.search.called)
+        self.assertEqual(case.title, 'Renamed')
+        self.assertEqual(case.last_event.raw_comment, 'Done')
+        # History is up to date
+        self.assertEqual(next(iter(cli.FBShortCase.HISTORY)).title, 'Renamed')
+
+
+class TestApply(unittest.TestCase):
+
+    @mock.patch('fbcli.cli.STORE', {1, 2})
+    @mock.patch('fbcli.cli.FBCase.get_many')
+    @mock.patch('fbcli.cli.FBCase.get_slim')
+    @mock.patch('fbcli.cli.LAST_SEARCH', [
+        mock.Mock(id=1), mock.Mock(id=2), mock.Mock(id=3)])
+    @mock.patch('fbcli.cli.CURRENT_CASE', None)
+    def test_bulk(self, get_slim, get_many):
+        ok, failing = mock.Mock(id=1), mock.Mock(id=2)
+        failing.close.side_effect = AssertionError('Invalid operation')
+        # Case 3 is missing
+        get_slim.return_value = {1: ok, 2: failing}
+        full = mock.Mock(id=1)
+        get_many.return_value = {1: full}
+        with mock.patch('sys.stdout') as stdout, mock.patch('sys.stderr'):
+            cli.apply('--jobs=2', 'close')
+        get_slim.assert_called_once_with([1, 2, 3])
+        ok.close.assert_called_once_with()
+        failing.close.assert_called_once_with()
+        # Only mirrored cases that changed are fetched whole
+        get_many.assert_called_once_with([1])
+        full.save_local.assert_called_once_with()
+        self.assertIsNone(cli.CURRENT_CASE)
+        out = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        self.assertIn('Invalid operation', out)
+        self.assertIn('Cannot find case 3', out)
+        self.assertIn('1 ok, 2 failed.', out)
+
+
+class TestSlimCase(unittest.TestCase):
+
+    @mock.patch('fbcli.cli.CURRENT_USER', mock.Mock(id=1))
+    @mock.patch('fbcli.cli.FB')
+    @mock.patch('fbcli.cli.search_cases')
+    def test_write(self, search_cases, FB):
+        search_cases.return_value = [BeautifulSoup(
+            '<case ixBug="41675" operations="edit,close">'
+            '<ixBug>41675</ixBug><ixCategory>1</ixCategory>'
+            '<ixBugEventLatest>99998</ixBugEventLatest></case>',
+            'xml').case]
+        case = cli.FBCase.get_slim([41675])[41675]
+        _, cols = search_cases.call_args[0]
+        self.assertEqual(cols.split(','), cli.FBCase.SLIM_COLS)
+        self.assertTrue(case.slim)
+        self.assertEqual(case.events, [])
+        with self.assertRaises(AssertionError):
+            case.save_local()
+        FB.close.return_value = BeautifulSoup(
+            '<response>' + TestUpdate.RAW + '</response>', 'xml').response
+        case.close()
+        self.assertEqual(case.title, 'Renamed')
+        self.assertEqual(
+            [event.raw_comment for event in case.events], ['Done'])
+        self.assertTrue(case.slim)
+
+
+class TestStartUp(unittest.TestCase):
+
+    @mock.patch('fbcli.cli.CURRENT_USER', None)
+    @mock.patch('fbcli.cli.STARTUP', new_callable=startup.Startup)
+    @mock.patch('fbcli.cli.FBStatus')
+    @mock.patch('fbcli.cli.FBPerson')
+    @mock.patch('fbcli.cli.META')
+    @mock.patch('fbcli.cli.FB')
+    def test_start_up(self, FB, META, FBPerson, FBStatus, STARTUP):
+        META.is_stale.return_value = True
+        META.get_many.return_value = ['people', 'statuses', 'projects']
+        cli.start_up()
+        STARTUP.wait()
+        FB.login.assert_called_once_with()
+        # One call: missing responses are fetched concurrently
+        META.get_many.assert_called_once_with(cli.PRELOAD)
+        FBPerson.from_result.assert_called_once_with('people')
+        FBStatus.from_result.assert_called_once_with('statuses')
+        self.assertIs(cli.CURRENT_USER, FBPerson.CACHE.by_email.return_value)
+
+
+class TestStartupGate(unittest.TestCase):
+
+    @mock.patch('fbcli.cli.STARTUP')
+    def test_wait(self, STARTUP):
+        f = mock.Mock()
+        with mock.patch.dict(cli.COMMANDS, {'foo': cli.Command(f)}):
+            cli.exec_('foo', ['x'])
+        STARTUP.wait.assert_called_once_with()
+        f.assert_called_once_with('x')
+
+    @mock.patch('fbcli.cli.STARTUP')
+    def test_no_wait(self, STARTUP):
+        f = mock.Mock()
+        with mock.patch.dict(cli.COMMANDS, {
+                'foo': cli.Command(f, needs_startup=False)}), \
+                mock.patch.dict(cli.ALIASES, {'f': cli.Alias('foo')}):
+            cli.exec_('f', [])
+        self.assertFalse(STARTUP.wait.called)
+        f.assert_called_once_with()
+
+
+class TestCaseIndex(unittest.TestCase):
+
+    class Event(object):
+
+        def __init__(self, id_, urls=(), attachments=(), comment=''):
+            self.id = id_
+            self.raw_comment = comment
+            self.attachments = list(attachments)
+            self.scanned = False
+            self._urls = list(urls)
+
+        @property
+        def urls(self):
+            self.scanned = True
+            return self._urls
+
+    def setUp(self):
+        a, b = mock.Mock(id=1), mock.Mock(id=2)
+        self.events = [
+            self.Event(10, urls=[(0, 'http://a')], comment='http://a'),
+            self.Event(11, attachments=[a, b], comment='Files'),
+            self.Event(12, urls=[(0, 'http://b'), (9, 'http://c')]),
+        ]
+        self.index = cli.CaseIndex(self.events)
+
+    def test_incremental(self):
+        links = self.index.links_of(self.events[0])
+        self.assertEqual([link.url for link in links], ['http://a'])
+        self.assertFalse(self.events[2].scanned)
+        # Ids are case-wide
+        links = self.index.links_of(self.events[2])
+        self.assertEqual([link.id for link in links], [1, 2])
+        self.assertEqual(len(self.index.links), 3)
+
+    def test_lookups(self):
+        self.assertIs(self.index.event('11'), self.events[1])
+        self.assertIsNone(self.index.event(99))
+        self.assertEqual(self.index.attachment(2).id, 2)
+        self.assertEqual(len(self.index.attachments), 2)
+        self.assertIs(self.index.last_with_comment, self.events[1])
+
+
+class TestLocalSearch(unittest.TestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        patches = [
+            mock.patch('fbcli.cli.STORE', store.Store(
+                os.path.join(root, 'cases.sqlite'))),
+            mock.patch('fbcli.cli.INDEX', index.Index(
+                os.path.join(root, 'index.pickle'))),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        # Case 3 matches best, and is the most recent
+        for ixbug, title in [
+                (1, 'Timeout'), (2, 'Slow query'), (3, 'Timeout timeout')]:
+            row = {col: None for col in store.SHORT_COLS}
+            row.update(
+                ixBug=ixbug, sTitle=title, sStatus='Active',
+                sProject='Devops', sPriority='Must Fix', ixPriority=1)
+            cli.STORE.save_case(row, '<case/>', [])
+            cli.INDEX.add_case(ixbug, title, [])
+
+    def test_search_local_keeps_rank(self):
+        found = cli.FBCaseSearch.search_local('timeout')
+        self.assertEqual([sc.id for sc in found.shortcases], [3, 1])
+
+    @mock.patch('fbcli.cli.GREP_LIMIT', 1)
+    def test_grep_counts_all(self):
+        with mock.patch('sys.stdout') as stdout:
+            cli.grep('timeout')
+        out = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        self.assertIn('Timeout timeout', out)
+        self.assertIn('2 case(s) found, best 1 shown.', out)
+
+
+class TestJsonBackend(unittest.TestCase):
+
+    CASE = {
+        'ixBug': 7,
+        'sTitle': 'Build is broken',
+        'ixPriority': 2,
+        'ixRelatedBugs': [3, 4],
+        'tags': ['ci'],
+        'operations': ['edit', 'close'],
+        'events': [{
+            'ixBugEvent': 70,
+            'sPerson': 'Ada',
+            's': 'It <fails>',
+            'rgAttachments': [{'sFileName': 'log.txt', 'sURL': 'log'}],
+        }],
+    }
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(cli.options.mockable(), 'backend', 'json'),
+            mock.patch('fbcli.cli.FB'),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        cli.FB.json_api.return_value = {'cases': [self.CASE]}
+        cli.FB.full_url.side_effect = lambda path: 'http://fogbugz/' + path
+
+    def test_get_by_id(self):
+        case = cli.FBCase.get_by_id(7)
+        cli.FB.json_api.assert_called_once_with(
+            'search', q='7', cols=cli.FBCase.COLS)
+        self.assertEqual(case.title, 'Build is broken')
+        self.assertEqual(case.related_ids, [3, 4])
+        self.assertEqual(case.operations, ['edit', 'close'])
+        event, = case.events
+        self.assertEqual(event.raw_comment, 'It <fails>')
+        self.assertEqual(event.attachments[0].filename, 'log.txt')
+
+    def test_search(self):
+        rs = cli.FBCaseSearch.search('status:active')
+        sc, = rs.shortcases
+        self.assertEqual((sc.id, sc.priority_id), (7, 2))
+
+    @mock.patch('fbcli.cli.INDEX')
+    @mock.patch('fbcli.cli.STORE')
+    def test_save_local(self, STORE, _INDEX):
+        cli.FBCase(self.CASE, current=False).save_local()
+        _, xml, events = STORE.save_case.call_args[0]
+        xml = xml[:-len('</case>')] + '<events>{}</events></case>'.format(
+            ''.join(e for _, e in events))
+        case = cli.FBCase(BeautifulSoup(xml, 'xml').case, current=False)
+        self.assertEqual(case.operations, ['edit', 'close'])
+        self.assertEqual(case.tags, ['ci'])
+        self.assertEqual(case.events[0].raw_comment, 'It <fails>')
+
 
 class TestFBBugEvent(unittest.TestCase):
 
@@ -0,0 +1,52 @@
+import unittest
+
+from fbcli import completion
+
+
+class TestCompleter(unittest.TestCase):
+
+    def setUp(self):
+        self.key = 0
+        self.options = ['Ada Lovelace', 'Alan Turing', 'Grace Hopper']
+        self.computed = 0
+        self.completer = completion.Completer({'people': self._people})
+
+    def _people(self):
+        def options():
+            self.computed += 1
+            return self.options
+        return self.key, options
+
+    def test_rank(self):
+        # Prefixes first, shortest first
+        self.assertEqual(
+            self.completer.complete('people', 'a'),
+            ['Alan Turing', 'Ada Lovelace', 'Grace Hopper'])
+        self.assertEqual(
+            self.completer.complete('people', 'ho'), ['Grace Hopper'])
+        # Subsequence
+        self.assertEqual(
+            self.completer.complete('people', 'alt'), ['Alan Turing'])
+
+    def test_readline(self):
+        self.assertEqual(self.completer('people', 'turing', 0), 'Alan Turing')
+        self.assertIsNone(self.completer('people', 'turing', 1))
+
+    def test_cached_until_key_changes(self):
+        self.completer.complete('people', 'a')
+        self.completer.complete('people', 'ad')
+        self.assertEqual(self.computed, 1)
+        self.options = self.options + ['Adele Goldberg']
+        self.key += 1
+        self.assertEqual(
+            self.completer.complete('people', 'ad'),
+            ['Ada Lovelace', 'Adele Goldberg'])
+        self.assertEqual(self.computed, 2)
+
+    def test_narrow(self):
+        self.completer.complete('people', 'a')
+        self.completer.complete('people', 'gr')
+        # Not narrowed from "gr"
+        self.assertEqual(
+            self.completer.complete('people', 'a'),
+            ['Alan Turing', 'Ada Lovelace', 'Grace Hopper'])
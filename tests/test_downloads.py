@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from six.moves import mock
+
+from fbcli import downloads
+
+
+class Session(object):
+    '''Serve `data`, honouring Range requests.'''
+
+    def __init__(self, data):
+        self.data = data
+        self.requests = []
+
+    def get(self, url, headers=None, **_kwargs):
+        self.requests.append((url, headers))
+        start = 0
+        r = mock.Mock(status_code=200)
+        if headers and 'Range' in headers:
+            start = int(headers['Range'].split('=')[1].rstrip('-'))
+            r.status_code = 206
+        body = self.data[start:]
+        r.headers = {'Content-Length': str(len(body))}
+        r.iter_content.side_effect = lambda n: [
+            body[i:i + n] for i in range(0, len(body), n)]
+        return r
+
+
+class TestDownloadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.client = mock.Mock()
+        self.client.full_url.return_value = 'http://fogbugz/'
+        self.client.current_user = 'user'
+        self.cache = downloads.DownloadCache(
+            self.client, max_bytes=35, root=self.root)
+        self.session = Session(b'0123456789')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_fetch_then_hit(self):
+        progress = mock.Mock()
+        fname = self.cache.fetch(
+            1, 'a.txt', 'http://a', self.session, progress=progress)
+        with open(fname, 'rb') as fid:
+            self.assertEqual(fid.read(), b'0123456789')
+        progress.assert_called_with(10, 10, final=True)
+        self.assertEqual(self.cache.get(1, 'a.txt'), fname)
+        self.cache.fetch(1, 'a.txt', 'http://a', self.session)
+        self.assertEqual(len(self.session.requests), 1)
+
+    def test_resume(self):
+        fname = self.cache.fname(1, 'a.txt')
+        os.makedirs(self.cache.path)
+        with open(fname + downloads.PART, 'wb') as fid:
+            fid.write(b'0123')
+        self.cache.fetch(1, 'a.txt', 'http://a', self.session)
+        self.assertEqual(self.session.requests[0][1], {'Range': 'bytes=4-'})
+        with open(fname, 'rb') as fid:
+            self.assertEqual(fid.read(), b'0123456789')
+
+    def test_evict_least_recently_used(self):
+        for key in range(3):
+            fname = self.cache.fetch(key, 'f', 'http://a', self.session)
+            # Distinct, increasing, last used times
+            os.utime(fname, (key, key))
+        self.cache.get(0, 'f')
+        self.cache.fetch(3, 'f', 'http://a', self.session)
+        self.assertIsNone(self.cache.get(1, 'f'))
+        self.assertIsNotNone(self.cache.get(0, 'f'))
+        self.assertLessEqual(self.cache.size(), 35)
+
+    def test_fetch_many(self):
+        jobs = [(i, 'f{}'.format(i), 'http://a') for i in range(5)]
+        self.cache = downloads.DownloadCache(self.client, root=self.root)
+        results = dict(self.cache.fetch_many(jobs, self.session))
+        self.assertEqual(sorted(results), jobs)
+        self.assertTrue(all(os.path.exists(r) for r in results.values()))
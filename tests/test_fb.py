@@ -1,7 +1,12 @@
+import json
 import os
+import threading
 import unittest
 
 from six.moves import mock
+from six.moves.urllib_parse import parse_qs
+from tornado import gen
+import fogbugz
 
 from fbcli import fb
 
@@ -20,3 +25,242 @@ class TestFB(unittest.TestCase):
             self.assertEqual(client.full_url('a/b/c'), expected)
             self.assertEqual(client.full_url('/a/b/c'), expected)
         del os.environ['FBURL']
+
+    @mock.patch('fbcli.fb.fogbugz.FogBugz')
+    @mock.patch('fbcli.fb.from_env_or_ask', return_value='x')
+    def test_no_private_api_methods(self, _ask, FogBugz):
+        client = fb.FBClient()
+        with self.assertRaises(AttributeError):
+            # pylint: disable=pointless-statement,protected-access
+            client._is_coroutine
+        self.assertFalse(FogBugz.called)
+
+
+class TestPooledOpener(unittest.TestCase):
+
+    @mock.patch('fbcli.fb.from_env_or_ask')
+    def test_session_is_shared(self, ask):
+        ask.return_value = 'http://fogbugz.com'
+        client = fb.FBClient()
+        self.assertIs(client.session, client.session)
+
+    def test_open_request(self):
+        from six.moves.urllib.request import Request
+        session = mock.Mock()
+        session.request.return_value.content = b'<response/>'
+        opener = fb.PooledOpener(session)
+        req = Request('http://fogbugz/api.asp', b'cmd=search', {
+            'Content-Type': 'text/plain'})
+        resp = opener.open(req)
+        self.assertEqual(resp.read(), b'<response/>')
+        session.request.assert_called_once_with(
+            'POST', 'http://fogbugz/api.asp', data=b'cmd=search',
+            headers={'Content-type': 'text/plain'}, timeout=None)
+
+
+class TestAsyncFBClient(unittest.TestCase):
+
+    @staticmethod
+    def _response(xml):
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(xml, 'xml').response
+
+    def test_logon_error(self):
+        resp = self._response(
+            '<response><error code="3">Not logged on</error></response>')
+        with self.assertRaises(fogbugz.FogBugzLogonError):
+            fb.AsyncFBClient._raise_on_xml_error(resp)
+
+    def test_api_error(self):
+        resp = self._response(
+            '<response><error code="10">Bad</error></response>')
+        with self.assertRaises(fogbugz.FogBugzAPIError):
+            fb.AsyncFBClient._raise_on_xml_error(resp)
+
+    def test_no_private_api_methods(self):
+        afb = fb.AsyncFBClient(mock.Mock())
+        with self.assertRaises(AttributeError):
+            # pylint: disable=pointless-statement,protected-access
+            afb._missing
+
+    def test_retry_after_logon(self):
+        client = mock.Mock(api_url='http://fogbugz/api.asp',
+                           current_token='t')
+        afb = fb.AsyncFBClient(client)
+        bodies = [
+            b'<response><error code="3">Not logged on</error></response>',
+            b'<response><cases count="0"/></response>',
+        ]
+
+        async def fetch(_call, *_args):
+            return mock.Mock(body=bodies.pop(0))
+
+        with mock.patch.object(afb, '_fetch', fetch):
+            resp, = afb.run_all([('search', {'q': '1'})])
+        client.login.assert_called_once_with()
+        self.assertEqual(resp.cases['count'], '0')
+
+
+class StubHTTPClient(object):
+    '''Answer searches with the case asked for, counting requests at once.'''
+
+    in_flight = max_in_flight = 0
+    lock = threading.Lock()
+
+    def __init__(self, **_kwargs):
+        pass
+
+    async def fetch(self, request, raise_error=True):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            await gen.sleep(0.02)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+        q = parse_qs(request.body.decode('utf-8'))['q'][0]
+        body = '<response><case><ixBug>{}</ixBug></case></response>'.format(q)
+        return mock.Mock(body=body.encode('utf-8'))
+
+    def close(self):
+        pass
+
+
+class TestAsyncFBClientRun(unittest.TestCase):
+
+    def setUp(self):
+        StubHTTPClient.in_flight = StubHTTPClient.max_in_flight = 0
+        patch = mock.patch('fbcli.fb.AsyncHTTPClient', StubHTTPClient)
+        patch.start()
+        self.addCleanup(patch.stop)
+        client = mock.Mock(api_url='http://fogbugz/api.asp',
+                           current_token='t')
+        self.afb = fb.AsyncFBClient(client, max_concurrency=3)
+
+    def _search_all(self, ids):
+        resps = self.afb.run_all([('search', {'q': str(id_)}) for id_ in ids])
+        return [int(resp.case.ixBug.string) for resp in resps]
+
+    def test_run_all(self):
+        ids = list(range(1, 13))
+        self.assertEqual(self._search_all(ids), ids)
+        self.assertEqual(StubHTTPClient.max_in_flight, 3)
+
+    def test_run_in_threads(self):
+        results = {}
+
+        def target(ids):
+            results[ids[0]] = self._search_all(ids)
+
+        threads = [
+            threading.Thread(target=target, args=([i, i + 1],))
+            for i in (1, 5, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {1: [1, 2], 5: [5, 6], 9: [9, 10]})
+
+
+class ClientTestCase(unittest.TestCase):
+    '''A client with a mock session.'''
+
+    def setUp(self):
+        patches = [
+            mock.patch('fbcli.fb.from_env_or_ask', return_value='x'),
+            mock.patch.object(
+                fb.FBClient, 'session', new_callable=mock.PropertyMock),
+            mock.patch.object(
+                fb.FBClient, 'api_url', new_callable=mock.PropertyMock,
+                return_value='http://fogbugz/api.asp'),
+            mock.patch.object(
+                fb.FBClient, 'current_token', new_callable=mock.PropertyMock,
+                return_value=b'token'),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.client = fb.FBClient()
+        self.session = self.client.session
+
+
+class TestIterResponse(ClientTestCase):
+
+    XML = (
+        b'<response><cases count="2">'
+        b'<case ixBug="1"><ixBug>1</ixBug></case>'
+        b'<case ixBug="2"><ixBug>2</ixBug></case>'
+        b'</cases></response>')
+
+    def _respond(self, *bodies):
+        responses = []
+        for body in bodies:
+            r = mock.Mock()
+            # Split anywhere, even in the middle of tags
+            r.iter_content.return_value = [
+                body[i:i + 7] for i in range(0, len(body), 7)]
+            responses.append(r)
+        self.session.post.side_effect = responses
+
+    def test_stream(self):
+        self._respond(self.XML)
+        ids = [
+            el.findtext('ixBug')
+            for el in self.client.iter_response('search', 'case', q='x')]
+        self.assertEqual(ids, ['1', '2'])
+        _, kwargs = self.session.post.call_args
+        self.assertTrue(kwargs['stream'])
+        self.assertEqual(kwargs['data']['token'], 'token')
+
+    def test_retry_on_logon_error(self):
+        self._respond(
+            b'<response><error code="3">Not logged on</error></response>',
+            self.XML)
+        with mock.patch.object(self.client, 'login') as login:
+            cases = list(self.client.iter_response('search', 'case'))
+        self.assertEqual(len(cases), 2)
+        login.assert_called_once_with()
+
+    def test_api_error(self):
+        self._respond(b'<response><error code="10">Bad</error></response>')
+        with self.assertRaises(fogbugz.FogBugzAPIError):
+            list(self.client.iter_response('search', 'case'))
+
+
+class TestJsonApi(ClientTestCase):
+
+    DATA = {'cases': [{'ixBug': 1}, {'ixBug': 2}]}
+
+    def _respond(self, *payloads):
+        responses = []
+        for payload in payloads:
+            r = mock.Mock()
+            r.json.return_value = payload
+            responses.append(r)
+        self.session.post.side_effect = responses
+
+    def test_json_api(self):
+        self._respond({'data': self.DATA, 'errors': []})
+        data = self.client.json_api('search', q='x', cols=['ixBug'])
+        self.assertEqual(data, self.DATA)
+        args, kwargs = self.session.post.call_args
+        self.assertTrue(args[0].endswith('/f/api/0/jsonapi'))
+        self.assertEqual(json.loads(kwargs['data']), {
+            'cmd': 'search', 'token': 'token', 'q': 'x', 'cols': ['ixBug']})
+
+    def test_retry_on_logon_error(self):
+        self._respond(
+            {'data': {}, 'errors': [{'code': 3, 'message': 'Log in'}]},
+            {'data': self.DATA, 'errors': []})
+        with mock.patch.object(self.client, 'login') as login:
+            data = self.client.json_api('search', q='x')
+        self.assertEqual(data, self.DATA)
+        login.assert_called_once_with()
+
+    def test_api_error(self):
+        self._respond(
+            {'data': {}, 'errors': [{'code': 10, 'message': 'Bad'}]})
+        with self.assertRaises(fogbugz.FogBugzAPIError):
+            self.client.json_api('search', q='x')
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fbcli import index
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = index.Index()
+        self.index.add_case(1, 'Build is broken', [
+            (10, 'The connection was reset by the server.'),
+            (11, 'Server restarted, build fixed.'),
+        ])
+        self.index.add_case(2, 'Docs are outdated', [
+            (20, 'The server section mentions an old connection string.'),
+        ])
+
+    def test_tokenize(self):
+        self.assertEqual(
+            index.tokenize('Héllo, World! foo_bar 42'),
+            ['héllo', 'world', 'foo_bar', '42'])
+
+    def test_word(self):
+        results = self.index.search('server')
+        self.assertEqual(sorted(r[0] for r in results), [1, 2])
+        self.assertEqual(results[0][0], 1)
+        self.assertEqual(results[0][2], [10, 11])
+
+    def test_all_words_must_match(self):
+        results = self.index.search('build connection')
+        self.assertEqual([r[0] for r in results], [1])
+
+    def test_phrase(self):
+        results = self.index.search('"connection was reset"')
+        self.assertEqual([(r[0], r[2]) for r in results], [(1, [10])])
+        self.assertEqual(self.index.search('"reset connection"'), [])
+
+    def test_title_match(self):
+        results = self.index.search('outdated')
+        self.assertEqual([(r[0], r[2]) for r in results], [(2, [0])])
+
+    def test_reindex_case(self):
+        self.index.add_case(2, 'Docs are fine', [])
+        self.assertEqual(self.index.search('outdated'), [])
+        self.assertEqual(len(self.index), 4)
+
+    def test_save_and_load(self):
+        root = tempfile.mkdtemp()
+        try:
+            path = os.path.join(root, 'index.pickle')
+            self.index._path = path  # pylint: disable=protected-access
+            self.index.save()
+            loaded = index.Index(path)
+            self.assertEqual(
+                loaded.search('server'), self.index.search('server'))
+        finally:
+            shutil.rmtree(root)
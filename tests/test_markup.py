@@ -0,0 +1,32 @@
+import unittest
+
+from fbcli import markup
+
+
+class TestMarkup(unittest.TestCase):
+
+    HTML = (
+        '<p>See <a href="http://x.com">the <b>docs</b></a> at '
+        'http://y.com/z</p>'
+        '<img src=" http://i.com/1.png"><img src="data:image/png,x">'
+        '<a href="http://q.com">http://q.com</a>')
+
+    def test_from_html(self):
+        m = markup.from_html(self.HTML)
+        self.assertIn('http://y.com/z', m.text)
+        self.assertEqual(m.imgs, ('http://i.com/1.png',))
+        self.assertEqual(m.anchors, (('the docs', 'http://x.com'),))
+        for pos, url in m.urls:
+            self.assertEqual(m.text[pos:pos + len(url)], url)
+
+    def test_memoized(self):
+        self.assertIs(markup.from_html(self.HTML), markup.from_html(self.HTML))
+
+    def test_from_text(self):
+        m = markup.from_text('Go to http://x.com now')
+        self.assertEqual(m.urls, ((6, 'http://x.com'),))
+        self.assertEqual((m.imgs, m.anchors), ((), ()))
+
+    def test_strip_tags(self):
+        self.assertEqual(
+            markup.strip_tags(' <b>Ada</b> &amp; co '), 'Ada & co')
@@ -0,0 +1,89 @@
+import os
+import unittest
+
+from bs4 import BeautifulSoup
+
+from fbcli import records
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def get_fixture(what):
+    with open(os.path.join(FIXTURE_DIR, what), 'r') as fid:
+        return BeautifulSoup(fid.read(), 'xml')
+
+
+class TestRecords(unittest.TestCase):
+
+    def test_case(self):
+        rec = records.Case.from_xml(get_fixture('FB41675.xml'))
+        self.assertEqual(rec.id, 41675)
+        self.assertEqual(rec.title, 'New PDL Backfill')
+        self.assertEqual(rec.parent_id, 0)
+        self.assertEqual(rec.children_ids, [])
+        self.assertEqual(rec.tags, [])
+        # Missing tags
+        self.assertIsNone(rec.milestone)
+        self.assertEqual(rec.priority_id, 999)
+        self.assertFalse(hasattr(rec, '__dict__'))
+
+    def test_short_case(self):
+        rec = records.Case.from_xml(get_fixture('FB41675.xml')).short()
+        self.assertEqual(rec.to_row()['ixBug'], 41675)
+        self.assertEqual(rec.to_row()['sStatus'], 'Closed (Fixed)')
+        self.assertEqual(records.ShortCase.from_row(rec.to_row()).id, 41675)
+
+    def test_sort_key(self):
+        a = records.ShortCase(
+            priority_id=1, project='A', dtlastupdated='2019-01-02T00:00:00Z')
+        b = records.ShortCase(
+            priority_id=1, project='A', dtlastupdated='2018-12-31T00:00:00Z')
+        c = records.ShortCase(project='A')
+        self.assertEqual(sorted([c, a, b], key=lambda r: r.sort_key),
+                         [b, a, c])
+
+    def test_defaults_not_shared(self):
+        a, b = records.Case(), records.Case()
+        a.tags.append('x')
+        self.assertEqual(b.tags, [])
+
+    def test_person(self):
+        rec = records.Person.from_xml(get_fixture('person.xml'))
+        self.assertEqual(rec.id, 246)
+        self.assertEqual(rec.email, 'jose.arcadio.buendia@soledad.com')
+
+    def test_event(self):
+        rec = records.Event.from_xml(get_fixture('FB38451.xml'))
+        self.assertEqual(rec.id, 65957)
+        self.assertEqual(len(rec.attachments), 4)
+        self.assertEqual(rec.attachments[0].filename, 'bixmv_id.xls')
+
+    def test_from_json(self):
+        rec = records.Case.load({
+            'ixBug': 7, 'sTitle': 'Broken', 'ixRelatedBugs': [3, 4],
+            'tags': ['ci'], 'sFixFor': None})
+        self.assertEqual(rec.id, 7)
+        self.assertEqual(rec.related_ids, [3, 4])
+        self.assertEqual(rec.tags, ['ci'])
+        # Nulls are missing
+        self.assertIsNone(rec.milestone)
+        self.assertEqual(rec.priority_id, 999)
+
+    def test_subclass_without_slots(self):
+
+        class Person(records.Person):
+            __slots__ = ()
+
+        person = Person(id=1, fullname='Ursula')
+        self.assertEqual(person.to_dict(), {
+            'id': 1, 'fullname': 'Ursula', 'email': None})
+
+    def test_to_xml(self):
+        rec = records.Case.from_xml(get_fixture('FB41675.xml'))
+        xml = rec.to_xml(ixBug=rec.id)
+        again = records.Case.from_xml(BeautifulSoup(xml, 'xml'))
+        self.assertEqual(again.to_dict(), rec.to_dict())
+        rec = records.Event.from_xml(get_fixture('FB38451.xml'))
+        again = records.Event.from_xml(BeautifulSoup(rec.to_xml(), 'xml'))
+        self.assertEqual(again.attachments[3].url, rec.attachments[3].url)
+        self.assertEqual(again.html, rec.html)
@@ -0,0 +1,100 @@
+import io
+import json
+import os
+import unittest
+
+import requests
+from six.moves import mock
+
+from fbcli import cli
+from fbcli import fb
+from fbcli.cassette import Cassette, http_key
+from fbcli.standin import StandIn
+from fbcli.synth import Dataset
+
+
+class TestStandIn(unittest.TestCase):
+
+    def setUp(self):
+        cassette = Cassette.from_fixtures()
+        cassette.add(
+            http_key('GET', '/f/api/0/cases/41675', {}),
+            json.dumps({'data': {'ixBugEventLatest': 1}}),
+            content_type='application/json')
+        self.standin = StandIn(cassette)
+        self.url = self.standin.start()
+
+    def tearDown(self):
+        self.standin.stop()
+
+    def test_api_xml(self):
+        r = requests.get(self.url + 'api.xml')
+        self.assertIn('<url>api.asp?</url>', r.text)
+
+    def test_xml_api(self):
+        r = requests.post(self.url + 'api.asp', data={
+            'cmd': 'search', 'q': '41675', 'token': 'x'})
+        self.assertIn('<sTitle>New PDL Backfill</sTitle>', r.text)
+
+    def test_logon(self):
+        r = requests.post(self.url + 'api.asp', data={
+            'cmd': 'logon', 'email': 'a', 'password': 'b'})
+        self.assertIn('<token>', r.text)
+
+    def test_json_api(self):
+        r = requests.get(self.url + 'f/api/0/cases/41675?token=x')
+        self.assertEqual(r.json()['data']['ixBugEventLatest'], 1)
+
+    def test_not_recorded(self):
+        r = requests.get(self.url + 'f/api/0/cases/1')
+        self.assertEqual(r.status_code, 404)
+
+    def test_client(self):
+        with mock.patch.dict(os.environ, self.standin.env()):
+            client = fb.FBClient()
+            resp = client.search(q='41675', cols='sTitle')
+        self.assertEqual(resp.case.sTitle.string, 'New PDL Backfill')
+
+
+class TestStandInDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.standin = StandIn(dataset=Dataset(cases=100, events=3))
+        self.url = self.standin.start()
+
+    def tearDown(self):
+        self.standin.stop()
+
+    def test_search(self):
+        r = requests.post(self.url + 'api.asp', data={
+            'cmd': 'search', 'q': '42', 'cols': 'ixBug,events'})
+        self.assertIn('<ixBug>42</ixBug>', r.text)
+        self.assertEqual(r.text.count('<event '), 3)
+
+    def test_fallback_to_cassette(self):
+        r = requests.get(self.url + 'f/api/0/favorites/')
+        self.assertEqual(r.status_code, 404)
+
+
+class TestStandInCli(unittest.TestCase):
+    '''Drive the REPL against the stand-in.'''
+
+    def setUp(self):
+        self.standin = StandIn(Cassette.from_fixtures())
+        self.standin.start()
+        self.addCleanup(self.standin.stop)
+        with mock.patch.dict(os.environ, self.standin.env()):
+            client = fb.FBClient()
+        for patch in [
+                mock.patch.object(cli, 'FB', client),
+                mock.patch.object(cli, 'LAST_SEARCH', None)]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_search(self):
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            cli.exec_('search', ['41675'])
+        self.assertIn('New PDL Backfill', stdout.getvalue())
+        self.assertIn('1 case(s) found.', stdout.getvalue())
+        self.assertEqual(
+            [sc.id for sc in cli.LAST_SEARCH.shortcases], [41675])
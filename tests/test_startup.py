@@ -0,0 +1,53 @@
+import threading
+import unittest
+
+from fbcli import startup
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_after(self):
+        order = []
+        gate = threading.Event()
+
+        def logon():
+            gate.wait(1)
+            order.append('logon')
+
+        s = startup.Startup()
+        s.start('logon', logon)
+        s.start('user', lambda: order.append('user') or 'me',
+                after=['logon'])
+        s.start('people', lambda: order.append('people'))
+        s.wait('people')
+        self.assertEqual(order, ['people'])
+        gate.set()
+        self.assertEqual(s.wait('user'), ['me'])
+        self.assertEqual(order, ['people', 'logon', 'user'])
+
+    def test_error_raised_once(self):
+
+        def logon():
+            raise ValueError('Bad password')
+
+        s = startup.Startup()
+        s.start('logon', logon)
+        s.start('user', lambda: 'me', after=['logon'])
+        with self.assertRaises(ValueError):
+            s.wait()
+        # Already reported
+        self.assertEqual(s.wait(), [None, None])
+        self.assertFalse(s.succeeded('logon'))
+        self.assertFalse(s.succeeded('unknown'))
+
+    def test_timings(self):
+        now = [10.0]
+        s = startup.Startup(clock=lambda: now[0])
+        now[0] = 11.0
+        s.start('logon', lambda: now.__setitem__(0, 13.0))
+        s.wait()
+        ((name, start, elapsed, error),) = s.timings()
+        self.assertEqual(name, 'logon')
+        self.assertEqual(start, 1.0)
+        self.assertEqual(elapsed, 2.0)
+        self.assertIsNone(error)
@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from fbcli import stats
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = stats.Stats()
+
+    def test_timed(self):
+        with self.stats.timed('search') as call:
+            self.stats.add_bytes(100)
+            self.stats.add_retry()
+        self.assertEqual(call.nbytes, 100)
+        summary = self.stats.calls['search']
+        self.assertEqual(summary.count, 1)
+        self.assertEqual(summary.nbytes, 100)
+        self.assertEqual(summary.retries, 1)
+
+    def test_nested_calls_are_accounted_to_outermost(self):
+        with self.stats.timed('amend'):
+            with self.stats.timed('_http_get_case'):
+                self.stats.add_bytes(10)
+            self.stats.add_bytes(5)
+        self.assertEqual(list(self.stats.calls), ['amend'])
+        self.assertEqual(self.stats.calls['amend'].nbytes, 15)
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            with self.stats.timed('search'):
+                raise ValueError()
+        self.assertEqual(self.stats.calls['search'].errors, 1)
+
+    def test_concurrent_calls(self):
+        first = self.stats.start('listPeople')
+        second = self.stats.start('listStatuses')
+        first.nbytes = 10
+        self.stats.finish(second)
+        self.stats.finish(first)
+        self.assertEqual(
+            sorted(self.stats.calls), ['listPeople', 'listStatuses'])
+        self.assertEqual(self.stats.calls['listPeople'].nbytes, 10)
+
+    def test_command(self):
+        with self.stats.command('show'):
+            with self.stats.timed('search'):
+                pass
+        summary = self.stats.commands['show']
+        self.assertEqual(summary.count, 1)
+        self.assertEqual(summary.api_calls, 1)
+        self.assertEqual(self.stats.current_command, None)
+
+    def test_histogram(self):
+        summary = stats.Summary()
+        for elapsed in [0.0005, 0.003, 0.003, 20]:
+            call = stats.Call('search')
+            call.elapsed = elapsed
+            summary.add(call)
+        counts = summary.histogram()
+        self.assertEqual(counts[0], 1)
+        self.assertEqual(counts[stats.BUCKETS.index(5)], 2)
+        self.assertEqual(counts[-1], 1)
+        self.assertEqual(summary.percentile(0.5), 0.003)
+
+    def test_trace(self):
+        root = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(root, 'trace.jsonl')
+            self.stats.trace_to(fname)
+            with self.stats.command('search'):
+                with self.stats.timed('search') as call:
+                    call.cache = 'hit'
+            with open(fname) as fid:
+                lines = [json.loads(line) for line in fid]
+            self.assertEqual(len(lines), 1)
+            self.assertEqual(lines[0]['name'], 'search')
+            self.assertEqual(lines[0]['command'], 'search')
+            self.assertEqual(lines[0]['cache'], 'hit')
+        finally:
+            shutil.rmtree(root)
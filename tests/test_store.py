@@ -0,0 +1,99 @@
+import shutil
+import tempfile
+import os
+import unittest
+
+from fbcli import store
+
+
+def _row(ixbug, **kwargs):
+    row = {col: None for col in store.SHORT_COLS}
+    row.update(
+        ixBug=ixbug,
+        sTitle='Case {}'.format(ixbug),
+        sStatus='Active',
+        sProject='Devops',
+        dtLastUpdated='2019-01-01T00:00:00Z')
+    row.update(kwargs)
+    return row
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = store.Store(os.path.join(self.root, 'cases.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_save_and_get_case(self):
+        self.store.save_case(
+            _row(1), '<case ixBug="1"><ixBug>1</ixBug></case>', [
+                (11, '<event ixBugEvent="11"/>'),
+                (10, '<event ixBugEvent="10"/>'),
+            ])
+        self.assertEqual(
+            self.store.get_case_xml(1),
+            '<case ixBug="1"><ixBug>1</ixBug><events>'
+            '<event ixBugEvent="10"/><event ixBugEvent="11"/>'
+            '</events></case>')
+        self.assertIsNone(self.store.get_case_xml(2))
+
+    def test_resave_replaces_events(self):
+        self.store.save_case(_row(1), '<case/>', [(10, '<event/>')])
+        self.store.save_case(_row(1), '<case/>', [])
+        self.assertEqual(
+            self.store.get_case_xml(1), '<case><events></events></case>')
+
+    def test_contains(self):
+        self.store.save_case(_row(1), '<case/>', [])
+        self.assertIn(1, self.store)
+        self.assertNotIn(2, self.store)
+
+    def test_last_updated(self):
+        self.store.save_case(_row(1), '<case/>', [])
+        self.assertEqual(
+            self.store.last_updated([1, 2]), {1: '2019-01-01T00:00:00Z'})
+
+    def test_set_query_cases(self):
+        for ixbug in range(1, 4):
+            self.store.save_case(_row(ixbug), '<case/>', [(ixbug, '<e/>')])
+        self.assertEqual(self.store.set_query_cases('a', [1, 2]), [])
+        self.assertEqual(self.store.set_query_cases('b', [2, 3]), [])
+        self.assertEqual(
+            [r['q'] for r in self.store.queries()], ['a', 'b'])
+        # 2 is still matched by b
+        self.assertEqual(self.store.set_query_cases('a', []), [1])
+        self.assertNotIn(1, self.store)
+        self.assertIsNone(self.store.get_case_xml(1))
+        self.assertIn(2, self.store)
+
+    def test_search(self):
+        self.store.save_case(_row(1, sTitle='Fix the build'), '<case/>', [])
+        self.store.save_case(
+            _row(2, sTitle='Fix the docs', sProject='Docs'), '<case/>', [])
+        ids = [r['ixBug'] for r in self.store.search(['fix'])]
+        self.assertEqual(sorted(ids), [1, 2])
+        ids = [r['ixBug'] for r in self.store.search(['fix'], project='doc')]
+        self.assertEqual(ids, [2])
+
+    def test_search_ids(self):
+        for ixbug in range(3):
+            self.store.save_case(_row(ixbug), '<case/>', [])
+        ids = [r['ixBug'] for r in self.store.search(ids=[0, 2])]
+        self.assertEqual(sorted(ids), [0, 2])
+
+    def test_recently_viewed(self):
+        self.store.save_case(_row(1), '<case/>', [])
+        self.store.save_case(_row(2), '<case/>', [])
+        self.store.mark_viewed(2)
+        ids = [r['ixBug'] for r in self.store.recently_viewed()]
+        self.assertEqual(ids, [2])
+
+    def test_short_xml(self):
+        self.assertEqual(
+            store.short_xml(_row(1, sTitle='a < b')),
+            '<case><ixBug>1</ixBug><sTitle>a &lt; b</sTitle>'
+            '<sStatus>Active</sStatus><sProject>Devops</sProject>'
+            '<dtLastUpdated>2019-01-01T00:00:00Z</dtLastUpdated></case>')
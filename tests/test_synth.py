@@ -0,0 +1,69 @@
+import unittest
+
+from bs4 import BeautifulSoup
+
+from fbcli import synth
+
+
+class TestDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = synth.Dataset(
+            cases=10, events=5, comment_size=200, people=3, attachments=7)
+
+    def _soup(self, xml):
+        return BeautifulSoup(xml, 'xml').response
+
+    def test_deterministic(self):
+        other = synth.Dataset(
+            cases=10, events=5, comment_size=200, people=3, attachments=7)
+        self.assertEqual(self.dataset.case_xml(3), other.case_xml(3))
+        self.assertNotEqual(
+            self.dataset.case_xml(3), self.dataset.case_xml(4))
+
+    def test_search_by_ids(self):
+        resp = self._soup(self.dataset.respond(
+            'search', {'q': '1,2,42', 'cols': 'sTitle,events'}))
+        self.assertEqual(resp.cases['count'], '2')
+        case = resp.cases.find('case')
+        self.assertIsNotNone(case.sTitle)
+        self.assertIsNone(case.sStatus)
+        self.assertEqual(len(case.events.findAll('event')), 5)
+
+    def test_search_query(self):
+        resp = self._soup(self.dataset.respond(
+            'search', {'q': 'status:active', 'max': '4'}))
+        self.assertEqual(resp.cases['count'], '4')
+
+    def test_attachments(self):
+        resp = self._soup(self.dataset.respond(
+            'search', {'q': '1', 'cols': 'events'}))
+        self.assertEqual(len(resp.findAll('attachment')), 7)
+
+    def test_comment_size(self):
+        resp = self._soup(self.dataset.respond(
+            'search', {'q': '1', 'cols': 'events'}))
+        opened = resp.find('event')
+        self.assertGreaterEqual(len(opened.sHtml.string), 200)
+
+    def test_people(self):
+        resp = self._soup(self.dataset.respond('listPeople', {}))
+        self.assertEqual(len(resp.findAll('person')), 3)
+        email = resp.find('person').sEmail.string
+        resp = self._soup(self.dataset.respond(
+            'viewPerson', {'sEmail': email}))
+        self.assertEqual(resp.person.ixPerson.string, '1')
+
+    def test_json(self):
+        self.assertIn(
+            '"ixBugEventLatest": 19',
+            self.dataset.respond_http('GET', '/f/api/0/cases/3'))
+        self.assertIsNone(self.dataset.respond_http('GET', '/f/api/0/x'))
+
+
+class TestSynthFB(unittest.TestCase):
+
+    def test_search(self):
+        fb = synth.SynthFB(synth.Dataset(cases=5, events=2))
+        resp = fb.search(q='3', cols='ixBug,sTitle')
+        self.assertEqual(resp.cases.case.ixBug.string, '3')
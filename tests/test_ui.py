@@ -1,4 +1,7 @@
 import unittest
+
+from six.moves import mock
+
 from fbcli import ui
 
 
@@ -6,3 +9,29 @@ class TestReadline(unittest.TestCase):
 
     def test_completer(self):
         self.assertEqual(ui.completer('mycase', 0), 'mycases ')
+
+
+class TestColor(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(ui.set_color, 'auto')
+
+    def test_never(self):
+        ui.set_color('never')
+        self.assertEqual(ui.red('x'), 'x')
+        self.assertEqual(ui.caseid(1), '[1]')
+
+    def test_always(self):
+        ui.set_color('always')
+        self.assertEqual(ui.red(1), '\033[0;31m1\033[0m')
+        self.assertIs(ui.theme_color('0;31'), ui.red)
+
+    @mock.patch('fbcli.ui._supports_color', return_value=True)
+    def test_detect_once(self, supports):
+        ui.TERMINAL.refresh()
+        ui.red('x')
+        ui.green('y')
+        self.assertEqual(supports.call_count, 1)
+        ui.TERMINAL.refresh()
+        ui.red('x')
+        self.assertEqual(supports.call_count, 2)
@@ -0,0 +1,68 @@
+import email
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from six.moves import mock
+
+from fbcli import upload
+
+
+def _parse(body):
+    '''{name: (filename, payload)} of the parts of a multipart body.'''
+    data = b''
+    while True:
+        # Small reads, like a socket would do
+        chunk = body.read(7)
+        if not chunk:
+            break
+        data += chunk
+    assert len(data) == len(body)
+    msg = email.message_from_bytes(
+        b'Content-Type: ' + body.content_type.encode('ascii') +
+        b'\r\n\r\n' + data)
+    return {
+        part.get_param('name', header='content-disposition'): (
+            part.get_filename(), part.get_payload(decode=True))
+        for part in msg.get_payload()}
+
+
+class TestMultipartBody(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def _file(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as fid:
+            fid.write(data)
+        return path
+
+    def test_body(self):
+        core = self._file('core', b'\x00\x01' * 1000)
+        progress = mock.Mock()
+        body = upload.MultipartBody(
+            {'cmd': 'edit', 'ixBug': 1, 'sEvent': None},
+            [upload.Upload('core', core)], progress=progress)
+        parts = _parse(body)
+        self.assertEqual(parts['cmd'], (None, b'edit'))
+        self.assertEqual(parts['ixBug'], (None, b'1'))
+        self.assertNotIn('sEvent', parts)
+        self.assertEqual(parts['File1'], ('core', b'\x00\x01' * 1000))
+        progress.assert_called_once_with('core')
+        progress.return_value.assert_called_with(2000, 2000, final=True)
+
+    def test_gzip_text(self):
+        log = self._file('app.log', b'All good\n' * 1000)
+        core = self._file('core', b'\x00')
+        body = upload.MultipartBody({}, [
+            upload.Upload('app.log', log, compress=True),
+            upload.Upload('core', core, compress=True)])
+        parts = _parse(body)
+        name, data = parts['File1']
+        self.assertEqual(name, 'app.log.gz')
+        self.assertEqual(gzip.decompress(data), b'All good\n' * 1000)
+        self.assertEqual(parts['File2'], ('core', b'\x00'))